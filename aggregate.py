@@ -0,0 +1,320 @@
+"""
+Columnar representation of matches used to aggregate costs
+Made by @plutus
+"""
+import datetime
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# decimal places costs are pushed, compared and reported with
+COST_PRECISION = 6
+
+
+def round_cost(cost: float) -> float:
+    """
+    :param cost: cost
+    :return: cost rounded the same way everywhere it is pushed or compared
+    """
+    return round(float(cost), COST_PRECISION)
+
+
+class CostTolerance:
+    """
+    Absolute and relative tolerance under which a new cost is not worth pushing
+    """
+    __slots__ = ('absolute', 'relative')
+
+    def __init__(self, absolute: float = 0.0, relative: float = 0.0):
+        """
+        :param absolute: max difference in money
+        :param relative: max difference as a fraction of the current cost
+        """
+        self.absolute = max(0.0, float(absolute))
+        self.relative = max(0.0, float(relative))
+
+    def __bool__(self):
+        return self.absolute > 0 or self.relative > 0
+
+    def is_within(self, current, cost: float) -> bool:
+        """
+        :param current: cost currently in Binom or last pushed, None when unknown
+        :param cost: new cost
+        :return: True when the new cost does not need to be pushed
+        """
+        if current is None:
+            return False
+
+        current = round_cost(current)
+        difference = abs(round_cost(cost) - current)
+
+        return difference <= self.absolute or difference <= self.relative * abs(current)
+
+
+class MatchColumns:
+    """
+    Matched (Binom campaign, traffic source campaign) pairs stored as
+    parallel arrays per traffic source, so costs are summed in one flat
+    grouped pass instead of walking Match objects.
+    """
+    __slots__ = ('binom_campaigns', 'columns')
+
+    def __init__(self, matches: list):
+        """
+        :param matches: list of Match objects
+        """
+        self.binom_campaigns = [match.get_binom_campaign() for match in matches]
+        self.columns = {}
+
+        for position, match in enumerate(matches):
+            for ts_name, ts_campaigns in match.get_matched_ts_campaigns():
+                if ts_name not in self.columns:
+                    self.columns[ts_name] = (array('l'), [])
+
+                binom_positions, ts_campaign_ids = self.columns[ts_name]
+                binom_positions.extend([position] * len(ts_campaigns))
+                ts_campaign_ids.extend(ts_campaigns)
+
+    def __len__(self):
+        return sum(len(ts_campaign_ids) for _, ts_campaign_ids in self.columns.values())
+
+    def get_positions(self, ts_names):
+        """
+        :param ts_names: traffic source names
+        :return: set of positions of Binom campaigns matched with any of them
+        """
+        positions = set()
+
+        for ts_name in ts_names:
+            if ts_name in self.columns:
+                positions.update(self.columns[ts_name][0])
+
+        return positions
+
+    def sum_costs(self, costs_by_ts: dict, with_stats: bool = False, fx_rates: dict = None):
+        """
+        :param costs_by_ts: dict of costs by campaign ids grouped by traffic sources
+        :param with_stats: also return contributing (ts_name, ts_campaign_id, cost) rows
+        :param fx_rates: dict of rates to the Binom currency by traffic sources, 1 when missing
+        :return: (list of totals by Binom campaign position,
+                  list of contributing rows by position or None)
+        """
+        totals = [0.0] * len(self.binom_campaigns)
+        stats = [[] for _ in self.binom_campaigns] if with_stats else None
+
+        for ts_name, (binom_positions, ts_campaign_ids) in self.columns.items():
+            costs = costs_by_ts.get(ts_name)
+            fx_rate = float((fx_rates or {}).get(ts_name, 1.0))
+
+            if not costs:
+                continue
+
+            if not with_stats:
+                for position, cost in zip(binom_positions, map(costs.get, ts_campaign_ids)):
+                    if cost:
+                        totals[position] += float(cost) * fx_rate
+                continue
+
+            for position, ts_campaign_id, cost in zip(
+                    binom_positions,
+                    ts_campaign_ids,
+                    map(costs.get, ts_campaign_ids)
+            ):
+                if cost:
+                    totals[position] += float(cost) * fx_rate
+                    # converted costs, so a rate change changes the stats hash
+                    stats[position].append(
+                        (ts_name, ts_campaign_id, cost if fx_rate == 1.0 else float(cost) * fx_rate))
+
+        return totals, stats
+
+
+class CostAggregator:
+    """
+    Statistics rows buffered in flat columns (days and token values stored as
+    codes), converted to the Binom currency, bucketed into days and summed per
+    (Binom campaign position, day, token value) in one pass at the end:
+    a single sort and grouped sum with NumPy, a dict loop without it.
+
+    Each source (traffic source) has its FX rate, and a UTC offset in hours
+    when its rows are UTC timestamps instead of days of the sync timezone.
+    """
+
+    def __init__(self, use_numpy: bool = None):
+        """
+        :param use_numpy: False forces the pure Python reduce, NumPy is used when installed by default
+        """
+        self.use_numpy = numpy is not None if use_numpy is None else use_numpy and numpy is not None
+        self.fx_rates = array('d')
+        self.utc_offsets = []
+        self.dates = {}
+        self.token_values = {}
+        self.sources = array('l')
+        self.positions = array('l')
+        self.date_codes = array('l')
+        self.token_codes = array('l')
+        self.costs = array('d')
+
+    def __len__(self):
+        return len(self.costs)
+
+    def add_source(self, fx_rate: float = 1.0, utc_offset: int = None) -> int:
+        """
+        :param fx_rate: rate from the source currency to the Binom one
+        :param utc_offset: hours added to UTC row timestamps, None when rows are already local days
+        :return: source code passed to add()
+        """
+        self.fx_rates.append(float(fx_rate))
+        self.utc_offsets.append(utc_offset)
+
+        return len(self.fx_rates) - 1
+
+    def add(self, source: int, position: int, date: str, token_value, cost: float):
+        """
+        :param source: code returned by add_source()
+        :param position: Binom campaign position
+        :param date: day (YYYY-MM-DD) or UTC timestamp (YYYY-MM-DD HH:MM:SS) of the row
+        :param token_value: token value, None for the whole campaign
+        :param cost: cost in the source currency
+        """
+        date_code = self.dates.get(date)
+
+        if date_code is None:
+            date_code = self.dates[date] = len(self.dates)
+
+        token_code = self.token_values.get(token_value)
+
+        if token_code is None:
+            token_code = self.token_values[token_value] = len(self.token_values)
+
+        self.sources.append(source)
+        self.positions.append(position)
+        self.date_codes.append(date_code)
+        self.token_codes.append(token_code)
+        self.costs.append(cost)
+
+    def get_hours(self) -> list:
+        """
+        :return: hours since 0001-01-01 of the buffered dates, by date code
+        """
+        hours = []
+
+        for date in self.dates:
+            day = datetime.date.fromisoformat(str(date)[:10])
+            hour = int(date[11:13]) if len(date) >= 13 else 0
+            hours.append(day.toordinal() * 24 + hour)
+
+        return hours
+
+    def reduce(self) -> dict:
+        """
+        :return: dict of costs by (position, day (YYYY-MM-DD), token value)
+        """
+        if not self.costs:
+            return {}
+
+        if self.use_numpy:
+            positions, day_codes, token_codes, sums, days, token_values = self.reduce_columns()
+
+            return {
+                (position, days[day_code], token_values[token_code]): cost
+                for position, day_code, token_code, cost in zip(positions, day_codes, token_codes, sums)
+            }
+
+        hours = self.get_hours()
+        dates = list(self.dates)
+        token_values = list(self.token_values)
+        days = {}
+        totals = {}
+
+        for source, position, date_code, token_code, cost in zip(
+                self.sources, self.positions, self.date_codes, self.token_codes, self.costs
+        ):
+            utc_offset = self.utc_offsets[source]
+
+            if utc_offset is None:
+                day = dates[date_code][:10]
+            else:
+                ordinal = (hours[date_code] + utc_offset) // 24
+                day = days.get(ordinal)
+
+                if day is None:
+                    day = days[ordinal] = datetime.date.fromordinal(ordinal).isoformat()
+
+            key = (position, day, token_values[token_code])
+            totals[key] = totals.get(key, 0.0) + cost * self.fx_rates[source]
+
+        return totals
+
+    def reduce_columns(self):
+        """
+        Compact form of reduce(), cheap to send between processes.
+
+        :return: (array of positions, array of day codes, array of token value codes,
+                  array of costs, list of days (YYYY-MM-DD), list of token values)
+        """
+        if not self.use_numpy:
+            totals = self.reduce()
+            days = {}
+            token_values = {}
+            columns = (array('l'), array('l'), array('l'), array('d'))
+
+            for (position, day, token_value), cost in totals.items():
+                columns[0].append(position)
+                columns[1].append(days.setdefault(day, len(days)))
+                columns[2].append(token_values.setdefault(token_value, len(token_values)))
+                columns[3].append(cost)
+
+            return (*columns, list(days), list(token_values))
+
+        if not self.costs:
+            return array('l'), array('l'), array('l'), array('d'), [], []
+
+        # arrays are read through the buffer protocol, without copying row by row
+        sources = numpy.asarray(self.sources)
+        positions = numpy.asarray(self.positions).astype(numpy.int64)
+        date_codes = numpy.asarray(self.date_codes)
+        token_codes = numpy.asarray(self.token_codes).astype(numpy.int64)
+        costs = numpy.asarray(self.costs) * numpy.asarray(self.fx_rates)[sources]
+
+        hours = numpy.array(self.get_hours(), dtype=numpy.int64)
+        is_utc = numpy.array([offset is not None for offset in self.utc_offsets])
+        offsets = numpy.array([offset or 0 for offset in self.utc_offsets], dtype=numpy.int64)
+        ordinals = numpy.where(
+            is_utc[sources],
+            (hours[date_codes] + offsets[sources]) // 24,
+            hours[date_codes] // 24
+        )
+        day_ordinals, day_codes = numpy.unique(ordinals, return_inverse=True)
+
+        # one int64 key per (position, day, token value), grouped by a single sort
+        keys = (positions * len(day_ordinals) + day_codes) * len(self.token_values) + token_codes
+        unique_keys, groups = numpy.unique(keys, return_inverse=True)
+        sums = numpy.bincount(groups, weights=costs)
+
+        key_positions, rest = numpy.divmod(unique_keys, len(day_ordinals) * len(self.token_values))
+        key_days, key_tokens = numpy.divmod(rest, len(self.token_values))
+
+        return (
+            to_array('l', key_positions),
+            to_array('l', key_days),
+            to_array('l', key_tokens),
+            to_array('d', sums),
+            [datetime.date.fromordinal(int(ordinal)).isoformat() for ordinal in day_ordinals],
+            list(self.token_values)
+        )
+
+
+def to_array(typecode: str, values) -> array:
+    """
+    :param typecode: array typecode
+    :param values: NumPy array
+    :return: array.array with the same values
+    """
+    result = array(typecode)
+    result.frombytes(values.astype(numpy.dtype(typecode)).tobytes())
+
+    return result
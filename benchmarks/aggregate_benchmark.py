@@ -0,0 +1,115 @@
+"""
+Memory and CPU of dict-backed records with the per-match cost walk against
+slot records with columnar aggregation.
+Run from the repository root: python -m benchmarks.aggregate_benchmark
+Made by @plutus
+"""
+import random
+import sys
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+from aggregate import MatchColumns
+from match import Match
+from traffic_source import TSCampaign
+
+TS_NAME = 'bench'
+
+
+class DictTSCampaign:
+    """
+    TSCampaign as it was before __slots__
+    """
+
+    def __init__(self, ts_name, id, url, name='Placeholder', cost=None):
+        self.ts_name = ts_name
+        self.id = id
+        self.url = url
+        self.name = name
+        self.cost = cost
+
+
+class DictMatch:
+    """
+    Match as it was before __slots__
+    """
+
+    def __init__(self, binom_campaign):
+        self.binom_campaign = binom_campaign
+        self.ts_campaigns = {}
+
+
+def build(pairs: int, per_campaign: int, ts_campaign_class, match_class):
+    """
+    :return: (list of matches, dict of costs by ts campaign id)
+    """
+    random.seed(0)
+    matches = []
+    costs = {}
+
+    for binom_id in range(pairs // per_campaign):
+        match = match_class(SimpleNamespace(id=binom_id))
+        match.ts_campaigns[TS_NAME] = {}
+        url = 'https://t.com/click.php?key=%d' % binom_id
+
+        for i in range(per_campaign):
+            ts_id = binom_id * per_campaign + i
+            cost = round(random.random(), 4)
+            ts_campaign = ts_campaign_class(TS_NAME, ts_id, url)
+            ts_campaign.cost = cost
+            match.ts_campaigns[TS_NAME][ts_id] = ts_campaign
+            costs[ts_id] = cost
+
+        matches.append(match)
+
+    return matches, costs
+
+
+def walk(matches: list):
+    """
+    Per-match aggregation used before MatchColumns
+    """
+    totals = {}
+
+    for match in matches:
+        real_cost = 0.0
+        for ts_campaigns in match.ts_campaigns.values():
+            for ts_campaign in ts_campaigns.values():
+                if ts_campaign.cost:
+                    real_cost += float(ts_campaign.cost)
+        totals[match.binom_campaign.id] = real_cost
+
+    return totals
+
+
+def main(pairs: int, per_campaign: int = 4):
+    print('%d matched pairs, %d per Binom campaign' % (pairs, per_campaign))
+    print('%10s %12s %12s' % ('layout', 'memory (MB)', 'sum (s)'))
+
+    tracemalloc.start()
+    matches, costs = build(pairs, per_campaign, DictTSCampaign, DictMatch)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    started = time.perf_counter()
+    expected = walk(matches)
+    print('%10s %12.1f %12.3f' % ('dicts', memory / 2 ** 20, time.perf_counter() - started))
+    del matches
+
+    tracemalloc.start()
+    matches, costs = build(pairs, per_campaign, TSCampaign, Match)
+    columns = MatchColumns(matches)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    started = time.perf_counter()
+    totals, _ = columns.sum_costs({TS_NAME: costs})
+    print('%10s %12.1f %12.3f' % ('columns', memory / 2 ** 20, time.perf_counter() - started))
+
+    assert all(
+        abs(totals[position] - expected[binom_campaign.id]) < 1e-9
+        for position, binom_campaign in enumerate(columns.binom_campaigns)
+    )
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
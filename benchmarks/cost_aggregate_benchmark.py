@@ -0,0 +1,102 @@
+"""
+Per (Binom campaign, day, token value) cost totals of token statistics rows:
+the dict loop used before against CostAggregator, pure Python and NumPy,
+with FX conversion and UTC rows bucketed into days.
+Run from the repository root: python -m benchmarks.cost_aggregate_benchmark [rows]
+Made by @plutus
+"""
+import datetime
+import random
+import sys
+import time
+
+from aggregate import CostAggregator, numpy
+
+DAYS = 7
+ZONES = 2000
+BINOM_CAMPAIGNS = 500
+FX_RATE = 0.92
+UTC_OFFSET = 3
+
+
+def generate(count: int):
+    """
+    :param count: statistics rows
+    :return: list of (position, UTC hour, token value, cost) rows, every
+             (campaign, zone) pair having a row per hour as hourly statistics do
+    """
+    rng = random.Random(0)
+    first = datetime.datetime(2026, 10, 1)
+    hours = [
+        (first + datetime.timedelta(hours=hour)).strftime('%Y-%m-%d %H:00:00')
+        for hour in range(DAYS * 24)
+    ]
+    pairs = [
+        (rng.randrange(BINOM_CAMPAIGNS), str(rng.randrange(ZONES)))
+        for _ in range(max(1, count // len(hours)))
+    ]
+
+    return [
+        (position, hour, token_value, round(rng.uniform(0, 2), 6))
+        for position, token_value in pairs
+        for hour in hours
+    ]
+
+
+def loop(rows: list) -> dict:
+    """
+    Row by row sum as fetch_token_costs did, plus the same conversion and bucketing
+    """
+    totals = {}
+
+    for position, hour, token_value, cost in rows:
+        moment = datetime.datetime.fromisoformat(hour) + datetime.timedelta(hours=UTC_OFFSET)
+        key = (position, moment.date().isoformat(), token_value)
+        totals[key] = totals.get(key, 0.0) + cost * FX_RATE
+
+    return totals
+
+
+def aggregate(rows: list, use_numpy: bool):
+    """
+    :return: (totals, seconds spent adding rows, seconds spent in reduce)
+    """
+    started = time.perf_counter()
+    aggregator = CostAggregator(use_numpy)
+    source = aggregator.add_source(FX_RATE, UTC_OFFSET)
+
+    for position, hour, token_value, cost in rows:
+        aggregator.add(source, position, hour, token_value, cost)
+
+    added = time.perf_counter()
+    totals = aggregator.reduce()
+
+    return totals, added - started, time.perf_counter() - added
+
+
+def main(count: int):
+    rows = generate(count)
+    count = len(rows)
+    print('%d rows, %d days of hourly UTC rows, %d zones, %d Binom campaigns' % (count, DAYS, ZONES, BINOM_CAMPAIGNS))
+    print('%12s %10s %10s %10s' % ('engine', 'add (s)', 'reduce (s)', 'total (s)'))
+
+    started = time.perf_counter()
+    expected = loop(rows)
+    elapsed = time.perf_counter() - started
+    print('%12s %10s %10s %10.3f' % ('dict loop', '-', '-', elapsed))
+
+    engines = [('python', False)] + ([('numpy', True)] if numpy is not None else [])
+
+    for name, use_numpy in engines:
+        totals, add_seconds, reduce_seconds = aggregate(rows, use_numpy)
+        print('%12s %10.3f %10.3f %10.3f' % (name, add_seconds, reduce_seconds, add_seconds + reduce_seconds))
+
+        assert totals.keys() == expected.keys()
+        assert all(abs(totals[key] - cost) < 1e-6 for key, cost in expected.items())
+
+    if numpy is None:
+        print('%12s not installed, pip install numpy to compare' % 'numpy')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
@@ -0,0 +1,50 @@
+"""
+Synthetic Binom and PropellerAds campaigns for benchmarks
+Made by @plutus
+"""
+import random
+
+
+class SyntheticAccount:
+    """
+    N Binom campaigns and M PropellerAds campaigns, match_ratio of the
+    PropellerAds campaigns point to a Binom campaign click URL.
+    """
+
+    def __init__(
+            self,
+            binom_count: int,
+            ts_count: int,
+            match_ratio: float = 0.8,
+            tracking_domain: str = 'http://127.0.0.1',
+            seed: int = 0
+    ):
+        rng = random.Random(seed)
+        self.tracking_domain = tracking_domain
+        self.binom_campaigns = [
+            {
+                'id': camp_id,
+                'name': 'Binom campaign %d' % camp_id,
+                'click_key': '%020x' % rng.getrandbits(80),
+                'ts_id': 1,
+                'status': 1
+            }
+            for camp_id in range(1, binom_count + 1)
+        ]
+        self.ts_campaigns = []
+        self.costs = {}
+
+        for ts_id in range(1, ts_count + 1):
+            if self.binom_campaigns and rng.random() < match_ratio:
+                click_key = rng.choice(self.binom_campaigns)['click_key']
+                url = '%s/click.php?key=%s&zone={zoneid}&cost={cost}' % (tracking_domain, click_key)
+            else:
+                url = 'https://landing.example.com/?id=%d' % ts_id
+
+            self.ts_campaigns.append({
+                'id': ts_id,
+                'name': 'PropellerAds campaign %d' % ts_id,
+                'target_url': url,
+                'status': 6
+            })
+            self.costs[ts_id] = round(rng.uniform(0, 50), 4)
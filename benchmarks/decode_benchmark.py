@@ -0,0 +1,85 @@
+"""
+Memory and latency of streaming record decoding against json.loads with
+a SimpleNamespace object_hook, on a synthetic campaign@get_all payload.
+Run from the repository root: python -m benchmarks.decode_benchmark
+Made by @plutus
+"""
+import json
+import sys
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+from binom import BinomCampaign
+from stream import iter_records, iter_text
+
+
+class FakeResponse:
+    """
+    Mimics requests response opened with stream=True
+    """
+    encoding = None
+    url = 'http://bench.local/arm.php'
+
+    def __init__(self, body: bytes):
+        self.body = body
+
+    def iter_content(self, chunk_size: int):
+        for i in range(0, len(self.body), chunk_size):
+            yield self.body[i:i + chunk_size]
+
+
+def generate(rows: int):
+    """
+    :param rows: number of campaigns
+    :return: JSON payload bytes
+    """
+    return json.dumps([
+        {
+            'id': i,
+            'name': 'Campaign %d' % i,
+            'click_key': 'k%019d' % i,
+            'ts_id': i % 50,
+            'group_name': 'Group %d' % (i % 20),
+            'status': 1,
+            'lp_data': {'lp': [{'id': i, 'weight': 100}]},
+        }
+        for i in range(rows)
+    ]).encode()
+
+
+def object_hook_path(body: bytes):
+    return list(json.loads(body.decode(), object_hook=lambda d: SimpleNamespace(**d)))
+
+
+def streaming_path(body: bytes):
+    return list(iter_records(iter_text(FakeResponse(body)), BinomCampaign))
+
+
+def measure(decode, body: bytes):
+    """
+    :return: (seconds, peak allocated bytes, rows)
+    """
+    tracemalloc.start()
+    started = time.perf_counter()
+    rows = decode(body)
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return elapsed, peak, len(rows)
+
+
+def main(rows: int):
+    body = generate(rows)
+    print('payload: %d rows, %.1f MB' % (rows, len(body) / 2 ** 20))
+    print('%16s %10s %12s' % ('path', 'time (s)', 'peak (MB)'))
+
+    for name, decode in (('object_hook', object_hook_path), ('streaming', streaming_path)):
+        elapsed, peak, count = measure(decode, body)
+        assert count == rows
+        print('%16s %10.2f %12.1f' % (name, elapsed, peak / 2 ** 20))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,112 @@
+"""
+End-to-end CostSynchronizer.sync against the local fake APIs at several
+scales, reporting wall time, request count and peak RSS.
+Run from the repository root: python -m benchmarks.e2e_benchmark
+Made by @plutus
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import resource
+import subprocess
+import sys
+import time
+
+from benchmarks.datagen import SyntheticAccount
+from benchmarks.fake_server import FakeAPIServer
+
+SCALES = [(1000, 2000), (5000, 20000), (20000, 100000)]
+
+
+def run_sync(url: str, args):
+    """
+    Run one synchronization in this process, it is the child side of main().
+
+    :param url: fake server url
+    :return: result dict
+    """
+    from binom import Binom
+    from providers.propeller_ads import TSPropellerAdsProvider
+    from sync import CostSynchronizer
+    from traffic_source import TSProviders
+    from transport import Transport
+
+    ts_providers = TSProviders()
+    ts_providers.add_ts_provider('propeller_ads', TSPropellerAdsProvider(
+        'propeller_ads',
+        'bench',
+        page_size=args.page_size,
+        page_concurrency=args.concurrency,
+        stats_concurrency=args.concurrency,
+        transport=Transport(pool_size=args.concurrency),
+        base_uri='%s/v5/' % url
+    ))
+    synchronizer = CostSynchronizer(
+        Binom(url, 'bench', transport=Transport(pool_size=args.concurrency)),
+        0,
+        ts_providers,
+        datetime.datetime.now() - datetime.timedelta(days=1),
+        update_concurrency=args.concurrency
+    )
+    started = time.perf_counter()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        summary = synchronizer.sync()
+
+    return {
+        'wall_seconds': round(time.perf_counter() - started, 3),
+        'updated': len(summary.updated),
+        'failed': len(summary.failed),
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    }
+
+
+def main(args):
+    print('%8s %8s %9s %10s %10s %9s %12s' % (
+        'binom', 'ts', 'updated', 'wall (s)', 'requests', 'failed', 'peak RSS MB'))
+
+    for binom_count, ts_count in args.scales:
+        account = SyntheticAccount(binom_count, ts_count, args.match_ratio)
+        server = FakeAPIServer(account, args.latency, args.page_size).start()
+
+        # a fresh process per scale keeps peak RSS meaningful
+        child = subprocess.run(
+            [
+                sys.executable, '-m', 'benchmarks.e2e_benchmark',
+                '--child', server.url,
+                '--page-size', str(args.page_size),
+                '--concurrency', str(args.concurrency)
+            ],
+            stdout=subprocess.PIPE,
+            check=True
+        )
+        result = json.loads(child.stdout.decode().strip().splitlines()[-1])
+        server.shutdown()
+
+        print('%8d %8d %9d %10.2f %10d %9d %12.1f' % (
+            binom_count, ts_count, result['updated'], result['wall_seconds'],
+            server.get_requests_count(), result['failed'], result['peak_rss_mb']))
+
+
+def parse_scale(value: str):
+    binom_count, ts_count = value.split('x')
+    return int(binom_count), int(ts_count)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='End-to-end sync benchmark')
+    parser.add_argument('--scales', nargs='*', type=parse_scale, default=SCALES,
+                        help='BINOMxTS campaigns counts, e.g. 1000x5000')
+    parser.add_argument('--match-ratio', type=float, default=0.8)
+    parser.add_argument('--latency', type=float, default=0.005, help='fake API latency (s)')
+    parser.add_argument('--page-size', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_sync(args.child, args)))
+    else:
+        main(args)
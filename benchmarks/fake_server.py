@@ -0,0 +1,137 @@
+"""
+Local fake Binom and PropellerAds APIs for benchmarks
+Made by @plutus
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from benchmarks.datagen import SyntheticAccount
+
+ZONES = 4
+
+
+class FakeAPIServer(ThreadingHTTPServer):
+    """
+    Serves arm.php?action=campaign@get_all, ?page=save_update_costs, ?page=Campaigns,
+    v5/adv/campaigns and v5/adv/statistics out of a SyntheticAccount.
+    """
+    daemon_threads = True
+    # default backlog of 5 drops SYNs of concurrent connections
+    request_queue_size = 256
+
+    def __init__(self, account: SyntheticAccount, latency: float = 0.0, max_page_size: int = 1000):
+        super().__init__(('127.0.0.1', 0), FakeAPIHandler)
+        self.account = account
+        self.latency = latency
+        self.max_page_size = max_page_size
+        self.requests = {}
+        self.updates = {}
+        self.token_updates = {}
+        self.stats_calls = []
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def count(self, endpoint: str):
+        with self.lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+
+    def get_requests_count(self):
+        with self.lock:
+            return sum(self.requests.values())
+
+
+class FakeAPIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def send_json(self, data):
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        query = parse_qs(parts.query)
+        server = self.server
+        time.sleep(server.latency)
+
+        if parts.path == '/arm.php' and query.get('action') == ['campaign@get_all']:
+            server.count('campaign@get_all')
+            self.send_json(server.account.binom_campaigns)
+        elif query.get('page') == ['save_update_costs']:
+            server.count('save_update_costs')
+            with server.lock:
+                if 'token_value' in query:
+                    server.token_updates[(int(query['camp_id'][0]), query['token_value'][0])] = \
+                        float(query['cost'][0])
+                else:
+                    server.updates[int(query['camp_id'][0])] = float(query['cost'][0])
+            self.send_json({'update_status': True})
+        elif query.get('page') == ['Campaigns']:
+            server.count('Campaigns')
+            with server.lock:
+                self.send_json([
+                    {
+                        'id': campaign['id'],
+                        'name': campaign['name'],
+                        'clicks': 0,
+                        'cost': server.updates.get(campaign['id'], 0.0)
+                    }
+                    for campaign in server.account.binom_campaigns
+                ])
+        elif parts.path == '/v5/adv/campaigns':
+            server.count('adv/campaigns')
+            page = int(query.get('page', ['1'])[0])
+            page_size = min(int(query.get('page_size', ['100'])[0]), server.max_page_size)
+            campaigns = server.account.ts_campaigns
+            self.send_json({
+                'result': campaigns[(page - 1) * page_size:page * page_size],
+                'total': len(campaigns)
+            })
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        server = self.server
+        time.sleep(server.latency)
+
+        if urlsplit(self.path).path != '/v5/adv/statistics':
+            self.send_error(404)
+            return
+
+        server.count('adv/statistics')
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        with server.lock:
+            server.stats_calls.append(payload['campaign_id'])
+        group_by = payload['group_by']
+        day = payload['day_from'][:10]
+        costs = server.account.costs
+        # costs are spread over ZONES zones when grouped by zone
+        zones = ZONES if 'zone_id' in group_by else 1
+        self.send_json([
+            {
+                'campaign_id': campaign_id,
+                'money': costs[campaign_id] / zones,
+                **({'date': day} if 'date' in group_by else {}),
+                **({'zone_id': campaign_id * 100 + zone} if 'zone_id' in group_by else {})
+            }
+            for campaign_id in payload['campaign_id']
+            if campaign_id in costs
+            for zone in range(zones)
+        ])
+
+    def log_message(self, format, *args):
+        pass
@@ -0,0 +1,87 @@
+"""
+Benchmark of the click key index against the substring scan used before.
+Run from the repository root: python -m benchmarks.match_benchmark
+Made by @plutus
+"""
+import random
+import string
+import sys
+import time
+
+from traffic_source import TSCampaign, TSMatchIndex
+
+BINOM_DOMAIN = 'https://tracker.example.com'
+SCAN_SAMPLE = 200
+
+
+def random_key(length: int = 20):
+    """
+    :param length: key length
+    :return: random click key
+    """
+    return ''.join(random.choices(string.ascii_lowercase + string.digits, k=length))
+
+
+def generate(count: int):
+    """
+    :param count: number of Binom and traffic source campaigns
+    :return: (binom campaign urls, list of TSCampaign objects)
+    """
+    keys = [random_key() for _ in range(count)]
+    binom_urls = ['%s/click.php?key=%s' % (BINOM_DOMAIN, key) for key in keys]
+    ts_campaigns = [
+        TSCampaign('bench', i, '%s&zone={zoneid}&cost={cost}' % url)
+        for i, url in enumerate(random.sample(binom_urls, count))
+    ]
+
+    return binom_urls, ts_campaigns
+
+
+def bench_scan(binom_urls: list, ts_campaigns: list):
+    """
+    Time the substring scan on a sample and extrapolate to all Binom campaigns.
+
+    :return: seconds
+    """
+    sample = binom_urls[:SCAN_SAMPLE]
+    started = time.perf_counter()
+
+    for url in sample:
+        [ts_campaign for ts_campaign in ts_campaigns if url in ts_campaign.url]
+
+    return (time.perf_counter() - started) * len(binom_urls) / len(sample)
+
+
+def bench_index(binom_urls: list, ts_campaigns: list):
+    """
+    Time index building plus matching of every Binom campaign.
+
+    :return: (build seconds, match seconds)
+    """
+    started = time.perf_counter()
+    index = TSMatchIndex()
+
+    for ts_campaign in ts_campaigns:
+        index.add(ts_campaign)
+
+    built = time.perf_counter()
+
+    for url in binom_urls:
+        index.match(url)
+
+    return built - started, time.perf_counter() - built
+
+
+def main(scales: list):
+    random.seed(0)
+    print('%10s %12s %12s %12s %10s' % ('campaigns', 'scan (s)', 'build (s)', 'match (s)', 'speedup'))
+
+    for count in scales:
+        binom_urls, ts_campaigns = generate(count)
+        scan = bench_scan(binom_urls, ts_campaigns)
+        build, match = bench_index(binom_urls, ts_campaigns)
+        print('%10d %12.3f %12.3f %12.3f %9.0fx' % (count, scan, build, match, scan / (build + match)))
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [1000, 10000, 100000])
@@ -0,0 +1,154 @@
+"""
+Scaling of sharded matching and token cost aggregation with the number of
+processes, against the single process index and CostAggregator.
+Run from the repository root: python -m benchmarks.shard_benchmark [--shards 1 2 4 8]
+Made by @plutus
+"""
+import argparse
+import os
+import random
+import time
+from types import SimpleNamespace
+
+from aggregate import CostAggregator
+from match import match_campaigns
+from shard import Sharder
+from snapshot import normalize, to_pairs
+from traffic_source import TSCampaign, TSProvider, TSProviders
+
+BINOM_DOMAIN = 'https://tracker.example.com'
+TS_NAME = 'bench'
+
+
+class StaticBinom:
+    """
+    Binom client serving generated campaigns
+    """
+
+    def __init__(self, binom_campaigns: list):
+        self.binom_campaigns = binom_campaigns
+
+    def get_tracking_domain(self):
+        return BINOM_DOMAIN
+
+    def get_all_campaigns(self):
+        return self.binom_campaigns
+
+
+class StaticProvider(TSProvider):
+    """
+    Provider serving generated campaigns
+    """
+
+    def __init__(self, ts_campaigns: dict):
+        super().__init__(TS_NAME)
+        self.campaigns = ts_campaigns
+
+    def get_ts_campaigns(self):
+        if self.ts_campaigns is None:
+            self.ts_campaigns = self.campaigns
+
+        return self.ts_campaigns
+
+
+def generate(binom_count: int, ts_count: int):
+    """
+    :return: (StaticBinom object, dict of TSCampaign objects by ids)
+    """
+    rng = random.Random(0)
+    binom_campaigns = [
+        SimpleNamespace(id=camp_id, click_key='%020x' % rng.getrandbits(80))
+        for camp_id in range(1, binom_count + 1)
+    ]
+    ts_campaigns = {}
+
+    for ts_id in range(1, ts_count + 1):
+        click_key = rng.choice(binom_campaigns).click_key
+        url = '%s/click.php?key=%s&zone={zoneid}&cost={cost}' % (BINOM_DOMAIN, click_key)
+        ts_campaigns[ts_id] = TSCampaign(TS_NAME, ts_id, url)
+
+    return StaticBinom(binom_campaigns), ts_campaigns
+
+
+def get_providers(ts_campaigns: dict) -> TSProviders:
+    """
+    :return: TSProviders with fresh campaigns, no index built yet
+    """
+    return TSProviders({TS_NAME: StaticProvider(ts_campaigns)})
+
+
+def bench_match(binom, ts_campaigns: dict, shards: int):
+    """
+    :return: (seconds, pairs)
+    """
+    ts_providers = get_providers(ts_campaigns)
+    started = time.perf_counter()
+
+    if shards == 0:
+        ts_providers.build_match_indexes()
+        matches, _ = match_campaigns(binom, ts_providers, binom.get_all_campaigns())
+    else:
+        matches, _ = Sharder(shards).match(binom, ts_providers, binom.get_all_campaigns())
+
+    return time.perf_counter() - started, normalize(to_pairs(matches))
+
+
+def bench_aggregate(binom, rows: list, shards: int):
+    """
+    :return: (reduce seconds, totals)
+    """
+    if shards == 0:
+        aggregator = CostAggregator()
+    else:
+        aggregator = Sharder(shards, min_rows=0).create_aggregator(BINOM_DOMAIN, binom.get_all_campaigns())
+
+    source = aggregator.add_source()
+
+    for position, day, token_value, cost in rows:
+        aggregator.add(source, position, day, token_value, cost)
+
+    started = time.perf_counter()
+    totals = aggregator.reduce()
+
+    return time.perf_counter() - started, totals
+
+
+def main(binom_count: int, ts_count: int, rows_count: int, shards_list: list):
+    binom, ts_campaigns = generate(binom_count, ts_count)
+    rng = random.Random(1)
+    rows = [
+        (rng.randrange(binom_count), '2026-10-%02d' % rng.randint(1, 7), str(rng.randrange(5000)), rng.random())
+        for _ in range(rows_count)
+    ]
+    print('%d Binom campaigns, %d traffic source campaigns, %d token rows, %d cores' % (
+        binom_count, ts_count, rows_count, os.cpu_count() or 1))
+    print('%12s %12s %10s %14s %10s' % ('processes', 'match (s)', 'speedup', 'aggregate (s)', 'speedup'))
+
+    match_base, expected_pairs = bench_match(binom, ts_campaigns, 0)
+    aggregate_base, expected_totals = bench_aggregate(binom, rows, 0)
+    print('%12s %12.3f %10s %14.3f %10s' % ('in process', match_base, '1.0x', aggregate_base, '1.0x'))
+
+    for shards in shards_list:
+        match_seconds, pairs = bench_match(binom, ts_campaigns, shards)
+        aggregate_seconds, totals = bench_aggregate(binom, rows, shards)
+        print('%12d %12.3f %9.1fx %14.3f %9.1fx' % (
+            shards, match_seconds, match_base / match_seconds,
+            aggregate_seconds, aggregate_base / aggregate_seconds))
+
+        assert pairs == expected_pairs
+        assert totals.keys() == expected_totals.keys()
+        assert all(abs(totals[key] - cost) < 1e-9 for key, cost in expected_totals.items())
+
+
+if __name__ == '__main__':
+    cores = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--binom', type=int, default=20000, help='Binom campaigns')
+    parser.add_argument('--ts', type=int, default=300000, help='traffic source campaigns')
+    parser.add_argument('--rows', type=int, default=1000000, help='token statistics rows')
+    parser.add_argument(
+        '--shards', type=int, nargs='+',
+        default=sorted({2 ** power for power in range(cores.bit_length())} | {2}),
+        help='processes to compare, powers of two up to the number of cores by default')
+    args = parser.parse_args()
+    main(args.binom, args.ts, args.rows, args.shards)
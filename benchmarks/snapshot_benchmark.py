@@ -0,0 +1,90 @@
+"""
+Matching with the match snapshot against a full in-process match, for
+unchanged catalogs and for a share of changed campaigns.
+Run from the repository root: python -m benchmarks.snapshot_benchmark [--churn 0 0.001 0.01]
+Made by @plutus
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.shard_benchmark import BINOM_DOMAIN, generate, get_providers
+from match import match_campaigns
+from snapshot import MatchSnapshot, normalize, to_pairs
+from traffic_source import TSCampaign
+
+
+def bench_full(binom, ts_campaigns: dict):
+    """
+    :return: (seconds, pairs) of building the match index and matching every campaign
+    """
+    ts_providers = get_providers(ts_campaigns)
+    started = time.perf_counter()
+    ts_providers.build_match_indexes()
+    matches, _ = match_campaigns(binom, ts_providers, binom.get_all_campaigns())
+
+    return time.perf_counter() - started, normalize(to_pairs(matches))
+
+
+def bench_snapshot(snapshot: MatchSnapshot, binom, ts_campaigns: dict):
+    """
+    :return: (seconds, pairs, snapshot file written)
+    """
+    ts_providers = get_providers(ts_campaigns)
+    written = os.stat(snapshot.path).st_mtime_ns if os.path.exists(snapshot.path) else None
+    started = time.perf_counter()
+    matches, _ = snapshot.match(binom, ts_providers, binom.get_all_campaigns())
+    seconds = time.perf_counter() - started
+
+    return seconds, normalize(to_pairs(matches)), os.stat(snapshot.path).st_mtime_ns != written
+
+
+def change(binom, ts_campaigns: dict, share: float, rng: random.Random):
+    """
+    Give new click keys to a share of the Binom campaigns and new URLs to a
+    share of the traffic source campaigns.
+    """
+    binom_campaigns = binom.get_all_campaigns()
+
+    for binom_campaign in rng.sample(binom_campaigns, int(len(binom_campaigns) * share)):
+        binom_campaign.click_key = '%020x' % rng.getrandbits(80)
+
+    for ts_id in rng.sample(list(ts_campaigns), int(len(ts_campaigns) * share)):
+        url = '%s/click.php?key=%s&zone={zoneid}' % (BINOM_DOMAIN, rng.choice(binom_campaigns).click_key)
+        ts_campaigns[ts_id] = TSCampaign(ts_campaigns[ts_id].ts_name, ts_id, url)
+
+
+def main(binom_count: int, ts_count: int, shares: list):
+    binom, ts_campaigns = generate(binom_count, ts_count)
+    rng = random.Random(2)
+    print('%d Binom campaigns, %d traffic source campaigns' % (binom_count, ts_count))
+    print('%10s %12s %14s %10s %10s' % ('churn', 'full (s)', 'snapshot (s)', 'speedup', 'written'))
+
+    with tempfile.TemporaryDirectory() as directory:
+        snapshot = MatchSnapshot(os.path.join(directory, 'matches.json'))
+        seconds, pairs, _ = bench_snapshot(snapshot, binom, ts_campaigns)
+        print('%10s %12s %14.3f %10s %10s' % ('first run', '', seconds, '', 'yes'))
+
+        for share in shares:
+            change(binom, ts_campaigns, share, rng)
+            full_seconds, expected_pairs = bench_full(binom, ts_campaigns)
+            seconds, pairs, written = bench_snapshot(snapshot, binom, ts_campaigns)
+            print('%10s %12.3f %14.3f %9.1fx %10s' % (
+                '%g%%' % (share * 100), full_seconds, seconds, full_seconds / seconds, 'yes' if written else 'no'))
+
+            assert pairs == expected_pairs
+
+        print('snapshot file: %.1f MB' % (os.path.getsize(snapshot.path) / 1e6))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--binom', type=int, default=20000, help='Binom campaigns')
+    parser.add_argument('--ts', type=int, default=200000, help='traffic source campaigns')
+    parser.add_argument(
+        '--churn', type=float, nargs='+', default=[0, 0.001, 0.01],
+        help='shares of campaigns changed before each run')
+    args = parser.parse_args()
+    main(args.binom, args.ts, args.churn)
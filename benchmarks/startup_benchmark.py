@@ -0,0 +1,91 @@
+"""
+Interpreter startup and import cost of the CLI entry point, from -X importtime,
+against importing the whole sync pipeline.
+Run from the repository root: python -m benchmarks.startup_benchmark
+Made by @plutus
+"""
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# must not be imported before a command needs them
+HEAVY_MODULES = ('requests', 'urllib3', 'peewee', 'dotenv', 'sync')
+
+
+def import_times(statement: str):
+    """
+    :param statement: python statement run in a fresh interpreter
+    :return: dict of cumulative import microseconds by module name
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', statement],
+        cwd=ROOT,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True
+    )
+    times = {}
+
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+
+        _, cumulative, module = line[len('import time:'):].split('|')
+
+        if cumulative.strip().isdigit():
+            times[module.strip()] = int(cumulative)
+
+    return times
+
+
+def wall_time(args: list, repeat: int):
+    """
+    :param args: interpreter arguments
+    :param repeat: runs
+    :return: best wall time in seconds
+    """
+    best = None
+
+    for _ in range(repeat):
+        started = time.perf_counter()
+        subprocess.run([sys.executable] + args, cwd=ROOT, stdout=subprocess.DEVNULL, check=True)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best
+
+
+def main(repeat: int = 5, top: int = 8):
+    cli_times = import_times('import cli')
+    sync_times = import_times('import sync')
+    loaded = [module for module in HEAVY_MODULES if module in cli_times]
+
+    print('%24s %12s' % ('import', 'cumulative (ms)'))
+    for statement, times in (('cli', cli_times), ('sync', sync_times)):
+        print('%24s %12.1f' % (statement, times.get(statement, 0) / 1000))
+
+    print('\nslowest imports of sync:')
+    for module, us in sorted(
+            ((module, us) for module, us in sync_times.items() if '.' not in module),
+            key=lambda row: -row[1]
+    )[:top]:
+        print('%24s %12.1f' % (module, us / 1000))
+
+    print('\n%24s %12s' % ('command', 'wall (ms)'))
+    for name, args in (
+            ('python -c pass', ['-c', 'pass']),
+            ('cli.py --help', ['cli.py', '--help']),
+            ('import sync', ['-c', 'import sync'])
+    ):
+        print('%24s %12.1f' % (name, wall_time(args, repeat) * 1000))
+
+    assert not loaded, 'cli imports %s at startup' % ', '.join(loaded)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
@@ -0,0 +1,80 @@
+"""
+Runs CostSynchronizer.update_costs against a local stub Binom server
+and compares wall time with the expected N / concurrency round trips.
+Run from the repository root: python -m benchmarks.update_benchmark
+Made by @plutus
+"""
+import datetime
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+from binom import Binom
+from sync import CostSynchronizer, CostUpdate
+
+LATENCY = 0.05
+
+
+class StubBinomHandler(BaseHTTPRequestHandler):
+    """
+    Answers every save_update_costs request after a fixed latency
+    """
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    requests_count = 0
+    lock = threading.Lock()
+
+    def do_GET(self):
+        with self.lock:
+            StubBinomHandler.requests_count += 1
+
+        time.sleep(LATENCY)
+        body = b'{"update_status": true}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    # default backlog of 5 drops SYNs of concurrent connections
+    request_queue_size = 128
+
+
+def main(updates_count: int, concurrency_levels: list):
+    server = StubServer(('127.0.0.1', 0), StubBinomHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    domain = 'http://127.0.0.1:%d' % server.server_address[1]
+    day = datetime.date.today()
+    updates = [CostUpdate(SimpleNamespace(id=i), 1.0, day, None) for i in range(updates_count)]
+
+    print('%12s %10s %12s %16s' % ('concurrency', 'updates', 'wall (s)', 'round trips'))
+
+    for concurrency in concurrency_levels:
+        synchronizer = CostSynchronizer(
+            Binom(domain, 'bench', pool_size=concurrency),
+            0,
+            None,
+            None,
+            update_concurrency=concurrency
+        )
+        started = time.perf_counter()
+        synchronizer.update_costs(updates)
+        elapsed = time.perf_counter() - started
+
+        assert len(synchronizer.summary.updated) == updates_count
+        print('%12d %10d %12.2f %7.1f (~%d)' % (
+            concurrency, updates_count, elapsed, elapsed / LATENCY,
+            -(-updates_count // concurrency)))
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200, [1, 4, 16, 32])
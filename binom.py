@@ -2,9 +2,20 @@
 Made by @plutus
 """
 import json
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
 from types import SimpleNamespace
 
-import requests
+from cache import CatalogCache, cached_stream
+from stream import iter_records, iter_text, record_type
+from transport import Transport
+
+BinomCampaign = record_type('BinomCampaign', ['id', 'name', 'click_key'])
+BinomCampaignStats = record_type('BinomCampaignStats', ['id', 'name', 'clicks', 'cost'])
+# day None stands for yesterday, token_value None for the whole campaign
+CostItem = namedtuple('CostItem', ['camp_id', 'day', 'cost', 'token_value'], defaults=(None,))
+CostItemResult = namedtuple('CostItemResult', ['item', 'response', 'error'])
 
 
 class Binom:
@@ -25,27 +36,141 @@ class Binom:
     DATE_CURRENT_WEEK = 11
     DATE_CUSTOM_DATE = 12
 
-    def __init__(self, tracking_domain: str, api_key: str):
+    def __init__(
+            self,
+            tracking_domain: str,
+            api_key: str,
+            pool_size: int = 10,
+            cache: CatalogCache = None,
+            transport: Transport = None
+    ):
         self.tracking_domain = tracking_domain
-        self.v1 = BinomV1API("%s/" % tracking_domain, api_key)
-        self.v2 = BinomV2API("%s/" % tracking_domain, api_key)
+        self.pool_size = pool_size
+        transport = transport if transport else Transport(pool_size)
+        self.v1 = BinomV1API("%s/" % tracking_domain, api_key, transport)
+        self.v2 = BinomV2API("%s/" % tracking_domain, api_key, transport, cache)
 
-    def update_cost(self, camp_id: int, cost_type: int, date: str, timezone: int, cost: float):
+    def update_cost(
+            self,
+            camp_id: int,
+            cost_type: int,
+            date: int,
+            timezone: int,
+            cost: float,
+            date_s: str = None,
+            date_e: str = None,
+            token_number: int = None,
+            token_value: str = None
+    ):
         """
         :param camp_id: Binom campaign ID
         :param cost_type: one of Binom.COST_*
-        :param date: date used for cost updating
+        :param date: one of Binom.DATE_*
         :param timezone: timezone used for cost updating
         :param cost: new cost to be updated
+        :param date_s: start date (YYYY-MM-DD) for Binom.DATE_CUSTOM_DATE
+        :param date_e: end date (YYYY-MM-DD) for Binom.DATE_CUSTOM_DATE
+        :param token_number: campaign token (1-10) the cost is limited to
+        :param token_value: value of that token
         :return: response object
         """
-        return self.v1.update_cost({
+        payload = {
             'camp_id': camp_id,
             'type': cost_type,
             'date': date,
             'timezone': timezone,
             'cost': cost
-        })
+        }
+
+        if date == self.DATE_CUSTOM_DATE:
+            payload['date_s'] = date_s
+            payload['date_e'] = date_e if date_e else date_s
+
+        if token_number:
+            payload['token_number'] = token_number
+            payload['token_value'] = token_value
+
+        return self.v1.update_cost(payload)
+
+    def update_costs(
+            self,
+            items: list,
+            timezone: int,
+            cost_type: int = COST_TYPE_FULL,
+            batch_size: int = 100,
+            concurrency: int = None,
+            token_number: int = None
+    ):
+        """
+        Update costs of many campaigns, a failing item does not fail the others.
+
+        The Binom API saves costs of one campaign per request, so items are
+        sent as concurrent single updates over the kept-alive connections. At
+        most batch_size of them are submitted at once and every completed one
+        is replaced by the next item, a slow request holds no other.
+
+        :param items: list of CostItem objects
+        :param timezone: timezone used for cost updating
+        :param cost_type: one of Binom.COST_*
+        :param batch_size: items submitted ahead of their results, at least concurrency
+        :param concurrency: requests in flight, pool_size by default
+        :param token_number: campaign token the items token_value belongs to
+        :return: generator of CostItemResult objects in completion order
+        """
+        concurrency = max(1, concurrency if concurrency else self.pool_size)
+        items = iter(items)
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = {}
+
+            def submit(count: int):
+                for item in islice(items, count):
+                    futures[self.submit_update(executor, item, timezone, cost_type, token_number)] = item
+
+            submit(max(batch_size, concurrency))
+
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                # refill before handing results over, the consumer does not hold the window
+                submit(len(done))
+
+                for future in done:
+                    item = futures.pop(future)
+
+                    try:
+                        result = CostItemResult(item, future.result(), None)
+                    except Exception as error:
+                        result = CostItemResult(item, None, error)
+
+                    yield result
+
+    def submit_update(
+            self,
+            executor,
+            item: CostItem,
+            timezone: int,
+            cost_type: int,
+            token_number: int = None
+    ):
+        """
+        :param executor: executor the request runs in
+        :param item: CostItem object
+        :param timezone: timezone used for cost updating
+        :param cost_type: one of Binom.COST_*
+        :param token_number: campaign token the item token_value belongs to
+        :return: future of the update_cost() response
+        """
+        return executor.submit(
+            self.update_cost,
+            camp_id=item.camp_id,
+            cost_type=cost_type,
+            date=self.DATE_YESTERDAY if item.day is None else self.DATE_CUSTOM_DATE,
+            timezone=timezone,
+            cost=item.cost,
+            date_s=None if item.day is None else str(item.day),
+            token_number=token_number if item.token_value is not None else None,
+            token_value=item.token_value
+        )
 
     def get_campaign(self, camp_id: int):
         """
@@ -54,9 +179,49 @@ class Binom:
         """
         return self.v2.get_campaign(camp_id)
 
+    def get_campaigns_stats(
+            self,
+            date: int,
+            timezone: int,
+            date_s: str = None,
+            date_e: str = None
+    ):
+        """
+        :param date: one of Binom.DATE_*
+        :param timezone: timezone of the stats
+        :param date_s: start date (YYYY-MM-DD) for Binom.DATE_CUSTOM_DATE
+        :param date_e: end date (YYYY-MM-DD) for Binom.DATE_CUSTOM_DATE
+        :return: generator of BinomCampaignStats records of all campaigns
+        """
+        payload = {
+            'user_group': 'all',
+            'status': 'all',
+            'date': date,
+            'timezone': timezone
+        }
+
+        if date == self.DATE_CUSTOM_DATE:
+            payload['date_s'] = date_s
+            payload['date_e'] = date_e if date_e else date_s
+
+        return self.v1.get_campaigns_stats(payload)
+
+    def get_costs(self, day, timezone: int) -> dict:
+        """
+        Read the current cost of every campaign in one request.
+
+        :param day: day (YYYY-MM-DD)
+        :param timezone: timezone of the stats
+        :return: dict of costs by Binom campaign IDs
+        """
+        return {
+            int(stats.id): float(stats.cost or 0)
+            for stats in self.get_campaigns_stats(self.DATE_CUSTOM_DATE, timezone, date_s=str(day))
+        }
+
     def get_all_campaigns(self):
         """
-        :return: list of binom campaign objects
+        :return: generator of BinomCampaign records
         """
         return self.v2.get_all_campaigns()
 
@@ -71,9 +236,10 @@ class BinomV1API:
     """
     V1 version of the Binom API
     """
-    def __init__(self, tracking_domain, api_key):
+    def __init__(self, tracking_domain, api_key, transport: Transport = None):
         self.domain = tracking_domain
         self.api_key = api_key
+        self.transport = transport if transport else Transport()
 
     def __get(self, payload=None):
         """
@@ -83,13 +249,25 @@ class BinomV1API:
         payload = payload if payload else {}
         payload['api_key'] = self.api_key
 
-        response = requests.get(self.domain, payload)
+        response = self.transport.get(self.domain, params=payload)
 
         return json.loads(
             response.text,
             object_hook=lambda d: SimpleNamespace(**d)
         )
 
+    def __stream(self, record: type, payload=None):
+        """
+        :param record: record type of the response array rows
+        :param payload: payload dict
+        :return: generator of records decoded while the response is read
+        """
+        payload = payload if payload else {}
+        payload['api_key'] = self.api_key
+
+        with self.transport.get(self.domain, params=payload, stream=True) as response:
+            yield from iter_records(iter_text(response), record)
+
     def update_cost(self, payload):
         """
         :param payload: payload dict
@@ -99,14 +277,31 @@ class BinomV1API:
 
         return self.__get(payload)
 
+    def get_campaigns_stats(self, payload):
+        """
+        :param payload: payload dict
+        :return: generator of BinomCampaignStats records
+        """
+        payload['page'] = 'Campaigns'
+
+        return self.__stream(BinomCampaignStats, payload)
+
 
 class BinomV2API:
     """
     V2 version of the Binom API
     """
-    def __init__(self, tracking_domain, api_key):
+    def __init__(
+            self,
+            tracking_domain,
+            api_key,
+            transport: Transport = None,
+            cache: CatalogCache = None
+    ):
         self.domain = tracking_domain
         self.api_key = api_key
+        self.transport = transport if transport else Transport()
+        self.cache = cache
         self.endpoint = self.domain.rstrip('/') + '/arm.php'
 
     def __get(self, payload=None):
@@ -117,13 +312,31 @@ class BinomV2API:
         payload = payload if payload else {}
         payload['api_key'] = self.api_key
 
-        response = requests.get(self.endpoint, payload)
+        response = self.transport.get(self.endpoint, params=payload)
 
         return json.loads(
             response.text,
             object_hook=lambda d: SimpleNamespace(**d)
         )
 
+    def __stream(self, record: type, payload=None, cache: CatalogCache = None):
+        """
+        :param record: record type of the response array rows
+        :param payload: payload dict
+        :param cache: CatalogCache used for this request
+        :return: generator of records decoded while the response is read
+        """
+        payload = payload if payload else {}
+        payload['api_key'] = self.api_key
+
+        return cached_stream(
+            self.transport,
+            cache,
+            self.endpoint,
+            payload,
+            decode=lambda chunks: iter_records(chunks, record)
+        )
+
     def get_campaign(self, camp_id: int):
         """
         :param camp_id: Binom campaign ID
@@ -133,6 +346,10 @@ class BinomV2API:
 
     def get_all_campaigns(self):
         """
-        :return: response object
+        :return: generator of BinomCampaign records
         """
-        return self.__get({'action': 'campaign@get_all'})
+        return self.__stream(
+            BinomCampaign,
+            {'action': 'campaign@get_all'},
+            cache=self.cache
+        )
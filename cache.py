@@ -0,0 +1,270 @@
+"""
+On-disk cache for campaign catalogs
+Made by @plutus
+"""
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+from stream import CHUNK_SIZE, iter_text
+
+
+class CatalogCache:
+    """
+    Stores gzip compressed API responses on disk.
+
+    Entries younger than ttl are returned without any request. Older ones are
+    revalidated with ETag/Last-Modified when the API sent them, otherwise they
+    are downloaded again. The oldest entries are evicted above max_entries.
+    """
+
+    def __init__(self, directory: str, ttl: int = 3600, max_entries: int = 256):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # entries fetched before are revalidated whatever their age
+        self.stale_before = 0.0
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def get_key(url: str, params: dict = None, namespace: str = None):
+        """
+        :param url: request url
+        :param params: request query params
+        :param namespace: account the response belongs to, when not in params
+        :return: cache key
+        """
+        raw = json.dumps([namespace, url, params or {}], sort_keys=True, default=str)
+
+        return hashlib.sha1(raw.encode()).hexdigest()
+
+    def get_path(self, key: str):
+        """
+        :param key: cache key
+        :return: entry body file path
+        """
+        return os.path.join(self.directory, '%s.json.gz' % key)
+
+    def get_meta(self, key: str):
+        """
+        :param key: cache key
+        :return: meta dict or None when there is no entry
+        """
+        try:
+            with open('%s.meta' % self.get_path(key)) as meta:
+                meta = json.load(meta)
+        except (OSError, ValueError):
+            return None
+
+        return meta if os.path.exists(self.get_path(key)) else None
+
+    def set_meta(self, key: str, etag: str = None, last_modified: str = None):
+        """
+        :param key: cache key
+        :param etag: ETag response header
+        :param last_modified: Last-Modified response header
+        """
+        path = '%s.meta' % self.get_path(key)
+        fd, tmp_path = self.create_temporary(key)
+
+        with os.fdopen(fd, 'w') as meta:
+            json.dump({'fetched_at': time.time(), 'etag': etag, 'last_modified': last_modified}, meta)
+
+        os.replace(tmp_path, path)
+        # eviction goes by body mtime, keep revalidated entries
+        os.utime(self.get_path(key))
+
+    def create_temporary(self, key: str):
+        """
+        Unique file of the entry directory, threads of tenants sharing the
+        cache may write the same entry at once.
+
+        :param key: cache key
+        :return: (file descriptor, path)
+        """
+        return tempfile.mkstemp(prefix='%s.' % key, suffix='.tmp', dir=self.directory)
+
+    def is_fresh(self, meta: dict):
+        """
+        :param meta: entry meta dict
+        :return: True when the entry can be used without revalidation
+        """
+        return meta['fetched_at'] > self.stale_before and time.time() - meta['fetched_at'] < self.ttl
+
+    def expire(self):
+        """
+        Make the current entries stale, they are revalidated on their next read.
+        """
+        self.stale_before = time.time()
+
+    def iter_body(self, key: str, chunk_size: int = CHUNK_SIZE):
+        """
+        :param key: cache key
+        :param chunk_size: read size in characters
+        :return: generator of body text chunks
+        """
+        with gzip.open(self.get_path(key), 'rt', encoding='utf-8') as body:
+            for chunk in iter(lambda: body.read(chunk_size), ''):
+                yield chunk
+
+    @contextmanager
+    def writer(self, key: str, etag: str = None, last_modified: str = None):
+        """
+        Write entry body chunk by chunk, the entry is replaced only when
+        the whole body was written.
+
+        :param key: cache key
+        :param etag: ETag response header
+        :param last_modified: Last-Modified response header
+        :return: write function
+        """
+        path = self.get_path(key)
+        fd, tmp_path = self.create_temporary(key)
+
+        try:
+            with os.fdopen(fd, 'wb') as raw, \
+                    gzip.open(raw, 'wt', encoding='utf-8', compresslevel=6) as body:
+                yield body.write
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+        os.replace(tmp_path, path)
+        self.set_meta(key, etag, last_modified)
+        self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently written entries above max_entries.
+        """
+        entries = [
+            entry for entry in os.scandir(self.directory)
+            if entry.name.endswith('.json.gz')
+        ]
+
+        if len(entries) <= self.max_entries:
+            return
+
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+
+        for entry in entries[:len(entries) - self.max_entries]:
+            for path in (entry.path, '%s.meta' % entry.path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def clear(self):
+        """
+        Remove all entries.
+        """
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(('.json.gz', '.meta')):
+                os.remove(entry.path)
+
+
+def cached_stream(
+        transport,
+        cache: CatalogCache,
+        url: str,
+        params: dict = None,
+        headers: dict = None,
+        namespace: str = None,
+        decode=None
+):
+    """
+    GET request body served from the cache when possible.
+
+    A downloaded body is stored only once decode() went through it without
+    error, error bodies sent with a 2xx status are never cached.
+
+    :param transport: Transport or requests.Session
+    :param cache: CatalogCache or None to always download
+    :param url: request url
+    :param params: query params
+    :param headers: request headers
+    :param namespace: account the response belongs to, when not in params
+    :param decode: function of the text chunks returning an iterable of decoded values
+    :return: generator of decoded values, of response text chunks without decode
+    """
+    decode = decode if decode else iter
+
+    if cache is None:
+        with transport.get(url, params=params, headers=headers, stream=True) as response:
+            yield from decode(iter_text(response))
+        return
+
+    key = cache.get_key(url, params, namespace)
+    meta = cache.get_meta(key)
+    headers = dict(headers) if headers else {}
+
+    if meta is not None:
+        if cache.is_fresh(meta):
+            yield from decode(cache.iter_body(key))
+            return
+
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+
+    with transport.get(url, params=params, headers=headers, stream=True) as response:
+        if response.status_code == 304 and meta is not None:
+            cache.set_meta(key, meta.get('etag'), meta.get('last_modified'))
+            yield from decode(cache.iter_body(key))
+            return
+
+        if not response.ok:
+            yield from decode(iter_text(response))
+            return
+
+        with cache.writer(
+                key,
+                response.headers.get('ETag'),
+                response.headers.get('Last-Modified')
+        ) as write:
+            chunks = iter_written(iter_text(response), write)
+            yield from decode(chunks)
+
+            # the decoder may stop at the end of the value, store the whole body
+            for _ in chunks:
+                pass
+
+
+def iter_written(chunks, write):
+    """
+    :param chunks: iterable of text chunks
+    :param write: function called with every chunk
+    :return: generator of the chunks
+    """
+    for chunk in chunks:
+        write(chunk)
+        yield chunk
+
+
+def cached_get(
+        transport,
+        cache: CatalogCache,
+        url: str,
+        params: dict = None,
+        headers: dict = None,
+        namespace: str = None,
+        decode=None
+):
+    """
+    :param decode: function of the response text returning the decoded value,
+                   the response is cached only when it does not raise
+    :return: decoded value, response text without decode, see cached_stream()
+    """
+    decode = decode if decode else str
+
+    values = cached_stream(
+        transport, cache, url, params, headers, namespace,
+        decode=lambda chunks: [decode(''.join(chunks))]
+    )
+
+    return list(values)[0]
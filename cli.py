@@ -0,0 +1,265 @@
+"""
+Command line entry point, heavy modules are only imported by the command that needs them
+Made by @plutus
+"""
+import argparse
+import datetime
+import logging
+import os
+import sys
+
+from config import config
+
+BENCHMARKS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks')
+
+
+def setup_logging():
+    """
+    Log to update.log
+    """
+    logging.basicConfig(
+        filename='update.log',
+        level=logging.INFO,
+        format='%(asctime)s %(message)s',
+        datefmt='%m/%d/%Y %H:%M:%S'
+    )
+
+
+def export_metrics():
+    """
+    Write the metrics report and Prometheus file when they are configured
+    """
+    from metrics import metrics
+
+    metrics.export(config.get('METRICS_REPORT'), config.get('METRICS_PROMETHEUS_FILE'))
+
+
+def get_cache(args):
+    """
+    :param args: parsed arguments
+    :return: CatalogCache object or None
+    """
+    from sync import create_cache
+
+    return None if args.no_cache else create_cache(config)
+
+
+def get_synchronizer(args, cache=None):
+    """
+    :param args: parsed arguments
+    :param cache: CatalogCache object, the one of the arguments when not given
+    :return: CostSynchronizer object
+    """
+    from sync import create_synchronizer
+
+    return create_synchronizer(
+        config,
+        cache if cache is not None else get_cache(args),
+        force=getattr(args, 'force', False),
+        rebuild_matches=args.rebuild_matches
+    )
+
+
+def run_tenants(args, date_from: datetime.date = None, date_to: datetime.date = None):
+    """
+    :param args: parsed arguments
+    :param date_from: first day to backfill, yesterday only when not given
+    :param date_to: last day to backfill (inclusive)
+    """
+    from tenants import TenantsRunner
+
+    TenantsRunner.from_file(
+        args.tenants,
+        config,
+        get_cache(args),
+        force=args.force,
+        rebuild_matches=args.rebuild_matches
+    ).run(date_from, date_to)
+
+
+def command_sync(args):
+    """
+    Sync yesterday costs
+
+    :param args: parsed arguments
+    """
+    if args.tenants:
+        run_tenants(args)
+    else:
+        get_synchronizer(args).sync()
+
+    export_metrics()
+
+
+def command_backfill(args):
+    """
+    Sync the costs of a dates range day by day
+
+    :param args: parsed arguments
+    """
+    if args.tenants:
+        run_tenants(args, args.date_from, args.date_to)
+    else:
+        synchronizer = get_synchronizer(args)
+        synchronizer.sync_range(args.date_from, args.date_to or synchronizer.yesterday.date())
+
+    export_metrics()
+
+
+def command_dry_run(args):
+    """
+    Report cost differences with Binom without updating
+
+    :param args: parsed arguments
+    """
+    from reconcile import summarize, write_report
+
+    synchronizer = get_synchronizer(args)
+    deltas = synchronizer.dry_run(
+        args.date_from,
+        args.date_to or synchronizer.yesterday.date()
+    )
+    write_report(deltas, args.report)
+
+    for line in summarize(deltas):
+        logging.info(line)
+        print(line)
+
+    export_metrics()
+
+
+def command_daemon(args):
+    """
+    Run the intraday sync daemon
+
+    :param args: parsed arguments
+    """
+    from daemon import SyncDaemon
+    from metrics import metrics
+
+    cache = get_cache(args)
+    synchronizer = get_synchronizer(args, cache)
+
+    if int(config.get('METRICS_PORT')):
+        metrics.serve(int(config.get('METRICS_PORT')))
+
+    SyncDaemon(
+        synchronizer,
+        interval=int(config.get('DAEMON_INTERVAL')),
+        catalog_interval=int(config.get('DAEMON_CATALOG_INTERVAL')),
+        after_cycle=export_metrics,
+        cache=cache
+    ).run()
+
+
+def command_bench(args):
+    """
+    Run a benchmark module
+
+    :param args: parsed arguments
+    """
+    import runpy
+
+    module = 'benchmarks.%s_benchmark' % args.name
+    sys.argv = [module] + args.args
+    runpy.run_module(module, run_name='__main__', alter_sys=True)
+
+
+def get_benchmarks():
+    """
+    :return: names of the benchmarks/*_benchmark.py modules
+    """
+    return sorted(
+        name[:-len('_benchmark.py')]
+        for name in os.listdir(BENCHMARKS_DIR)
+        if name.endswith('_benchmark.py')
+    )
+
+
+def add_dates(parser, required: bool = False):
+    """
+    :param parser: command parser
+    :param required: --from is mandatory
+    """
+    parser.add_argument(
+        '--from', dest='date_from', type=datetime.date.fromisoformat, required=required,
+        help='first day (YYYY-MM-DD)')
+    parser.add_argument(
+        '--to', dest='date_to', type=datetime.date.fromisoformat,
+        help='last day (YYYY-MM-DD), defaults to yesterday')
+
+
+def build_parser():
+    """
+    :return: argparse.ArgumentParser object
+    """
+    parser = argparse.ArgumentParser(description='Binom cost synchronizer')
+    commands = parser.add_subparsers(dest='command', metavar='command')
+    commands.required = True
+
+    cache = argparse.ArgumentParser(add_help=False)
+    cache.add_argument(
+        '--no-cache', action='store_true',
+        help='download campaign lists even if the cached ones are fresh')
+    cache.add_argument(
+        '--rebuild-matches', action='store_true',
+        help='re-match every campaign instead of updating the match snapshot')
+
+    force = argparse.ArgumentParser(add_help=False)
+    force.add_argument(
+        '--force', action='store_true',
+        help='push every cost, even if it did not change since the last run')
+
+    tenants = argparse.ArgumentParser(add_help=False)
+    tenants.add_argument(
+        '--tenants', metavar='FILE',
+        help='sync every tenant listed in the given JSON file')
+
+    command = commands.add_parser(
+        'sync', parents=[cache, force, tenants], help='sync yesterday costs')
+    command.set_defaults(handler=command_sync)
+
+    command = commands.add_parser(
+        'backfill', parents=[cache, force, tenants], help='sync costs day by day for a dates range')
+    add_dates(command, required=True)
+    command.set_defaults(handler=command_backfill)
+
+    command = commands.add_parser(
+        'dry-run', parents=[cache],
+        help='compare costs with Binom without updating, yesterday when no dates are given')
+    add_dates(command)
+    command.add_argument(
+        '--report', default='cost-diff.csv',
+        help='differences report, CSV or JSON for a .json extension (default: cost-diff.csv)')
+    command.set_defaults(handler=command_dry_run)
+
+    command = commands.add_parser(
+        'daemon', parents=[cache, force], help='keep running and sync today costs every CS_DAEMON_INTERVAL seconds')
+    command.set_defaults(handler=command_daemon)
+
+    command = commands.add_parser('bench', help='run a benchmark from benchmarks/')
+    command.add_argument('name', choices=get_benchmarks())
+    command.add_argument('args', nargs=argparse.REMAINDER, help='benchmark arguments')
+    command.set_defaults(handler=command_bench)
+
+    return parser
+
+
+def main(argv: list = None):
+    """
+    :param argv: arguments, sys.argv[1:] by default
+    """
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    if getattr(args, 'date_from', None) and getattr(args, 'date_to', None) and args.date_from > args.date_to:
+        parser.error('--from %s is after --to %s' % (args.date_from, args.date_to))
+
+    if args.command != 'bench':
+        setup_logging()
+
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
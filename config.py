@@ -3,21 +3,33 @@ Made by @plutus
 """
 import os
 
-from dotenv import load_dotenv
 
-load_dotenv()
+class Config:
+    def __init__(self, config: dict = None, loader=None):
+        """
+        :param config: dict of config values
+        :param loader: function returning the config values, called on first use
+        """
+        self.values = config
+        self.loader = loader
 
+    @property
+    def config(self):
+        """
+        :return: dict of config values
+        """
+        if self.values is None:
+            self.values = self.loader()
 
-class Config:
-    def __init__(self, config):
-        self.config = config
+        return self.values
 
-    def get(self, key):
+    def get(self, key, default=None):
         """
         :param key: key to get
+        :param default: value of keys missing from the config
         :return: config value for given key
         """
-        return self.config[key]
+        return self.config.get(key, default)
 
     def set(self, key, value):
         """
@@ -28,9 +40,65 @@ class Config:
         self.config[key] = value
 
 
-config = Config({
-    "TIMEZONE": os.getenv('CS_TIMEZONE'),
-    "BINOM_DOMAIN": os.getenv('CS_BINOM_DOMAIN'),
-    "BINOM_API_KEY": os.getenv('CS_BINOM_API_KEY'),
-    "PROPELLER_ADS_API_KEY": os.getenv('CS_PROPELLER_ADS_API_KEY')
-})
+def load_config():
+    """
+    Read .env and the CS_* environment variables, the ones not listed here
+    (e.g. keys of provider plugins) are kept without the CS_ prefix.
+
+    :return: dict of config values
+    """
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+    extra = {key[3:]: value for key, value in os.environ.items() if key.startswith('CS_')}
+
+    return {
+        **extra,
+        "TIMEZONE": os.getenv('CS_TIMEZONE'),
+        "BINOM_DOMAIN": os.getenv('CS_BINOM_DOMAIN'),
+        "BINOM_API_KEY": os.getenv('CS_BINOM_API_KEY'),
+        "PROVIDERS": os.getenv('CS_PROVIDERS', ''),
+        "PROVIDERS_DIR": os.getenv('CS_PROVIDERS_DIR', ''),
+        "PROPELLER_ADS_API_KEY": os.getenv('CS_PROPELLER_ADS_API_KEY'),
+        "PROPELLER_ADS_FX_RATE": os.getenv('CS_PROPELLER_ADS_FX_RATE', '1'),
+        "UPDATE_CONCURRENCY": os.getenv('CS_UPDATE_CONCURRENCY', '8'),
+        "UPDATE_BATCH_SIZE": os.getenv('CS_UPDATE_BATCH_SIZE', '100'),
+        "UPDATE_TOLERANCE_ABS": os.getenv('CS_UPDATE_TOLERANCE_ABS', '0'),
+        "UPDATE_TOLERANCE_REL": os.getenv('CS_UPDATE_TOLERANCE_REL', '0'),
+        "UPDATE_TOLERANCE_SOURCE": os.getenv('CS_UPDATE_TOLERANCE_SOURCE', 'state'),
+        "PROPELLER_ADS_PAGE_SIZE": os.getenv('CS_PROPELLER_ADS_PAGE_SIZE', '500'),
+        "PROPELLER_ADS_PAGE_CONCURRENCY": os.getenv('CS_PROPELLER_ADS_PAGE_CONCURRENCY', '4'),
+        "PROPELLER_ADS_STATS_CHUNK_SIZE": os.getenv('CS_PROPELLER_ADS_STATS_CHUNK_SIZE', '500'),
+        "PROPELLER_ADS_STATS_CONCURRENCY": os.getenv('CS_PROPELLER_ADS_STATS_CONCURRENCY', '4'),
+        "TOKEN_NUMBER": os.getenv('CS_TOKEN_NUMBER', '0'),
+        "TOKEN_FIELD": os.getenv('CS_TOKEN_FIELD', 'zone_id'),
+        "TOKEN_CHUNK_SIZE": os.getenv('CS_TOKEN_CHUNK_SIZE', '100'),
+        "STATE_DB": os.getenv('CS_STATE_DB', 'state.db'),
+        "JOURNAL": os.getenv('CS_JOURNAL', 'sync.journal'),
+        "JOURNAL_FSYNC_EVERY": os.getenv('CS_JOURNAL_FSYNC_EVERY', '256'),
+        "MATCH_SNAPSHOT": os.getenv('CS_MATCH_SNAPSHOT', 'matches.json'),
+        "MATCH_SNAPSHOT_MAX_CHURN": os.getenv('CS_MATCH_SNAPSHOT_MAX_CHURN', '0.5'),
+        "MATCH_SNAPSHOT_CHECK": os.getenv('CS_MATCH_SNAPSHOT_CHECK', '0'),
+        "DAEMON_INTERVAL": os.getenv('CS_DAEMON_INTERVAL', '900'),
+        "DAEMON_CATALOG_INTERVAL": os.getenv('CS_DAEMON_CATALOG_INTERVAL', '3600'),
+        "CACHE_DIR": os.getenv('CS_CACHE_DIR', '.cache'),
+        "CACHE_TTL": os.getenv('CS_CACHE_TTL', '3600'),
+        "CACHE_MAX_ENTRIES": os.getenv('CS_CACHE_MAX_ENTRIES', '256'),
+        "PROVIDER_TIMEOUT": os.getenv('CS_PROVIDER_TIMEOUT', '600'),
+        "HTTP_POOL_SIZE": os.getenv('CS_HTTP_POOL_SIZE', '10'),
+        "HTTP_TIMEOUT": os.getenv('CS_HTTP_TIMEOUT', '60'),
+        "HTTP_RETRIES": os.getenv('CS_HTTP_RETRIES', '4'),
+        "HTTP_BREAKER_THRESHOLD": os.getenv('CS_HTTP_BREAKER_THRESHOLD', '5'),
+        "HTTP_BREAKER_RESET": os.getenv('CS_HTTP_BREAKER_RESET', '30'),
+        "BINOM_RATE_LIMIT": os.getenv('CS_BINOM_RATE_LIMIT', '0'),
+        "PROPELLER_ADS_RATE_LIMIT": os.getenv('CS_PROPELLER_ADS_RATE_LIMIT', '0'),
+        "METRICS_REPORT": os.getenv('CS_METRICS_REPORT', 'run-report.json'),
+        "METRICS_PROMETHEUS_FILE": os.getenv('CS_METRICS_PROMETHEUS_FILE', ''),
+        "METRICS_PORT": os.getenv('CS_METRICS_PORT', '0'),
+        "TENANT_CONCURRENCY": os.getenv('CS_TENANT_CONCURRENCY', '4'),
+        "SHARDS": os.getenv('CS_SHARDS', '0')
+    }
+
+
+config = Config(loader=load_config)
@@ -0,0 +1,114 @@
+"""
+Long-running intraday cost synchronization
+Made by @plutus
+"""
+import datetime
+import fcntl
+import logging
+import signal
+import threading
+import time
+
+from cache import CatalogCache
+from sync import CostSynchronizer
+
+
+class SyncDaemon:
+    """
+    Runs CostSynchronizer for today every interval seconds.
+
+    HTTP sessions, campaigns and matches are kept between cycles, campaigns
+    are refreshed every catalog_interval seconds, even when the cached ones
+    are younger than the cache TTL. Cycles run one after another in a single
+    thread so they never overlap.
+    """
+
+    def __init__(
+            self,
+            synchronizer: CostSynchronizer,
+            interval: int = 900,
+            catalog_interval: int = 3600,
+            lock_path: str = 'daemon.lock',
+            after_cycle=None,
+            cache: CatalogCache = None
+    ):
+        """
+        :param synchronizer: CostSynchronizer object
+        :param interval: seconds between the cycles starts
+        :param catalog_interval: seconds between the campaigns refreshes
+        :param lock_path: lock file preventing two daemons
+        :param after_cycle: function called after each cycle
+        :param cache: CatalogCache of the synchronizer API clients
+        """
+        self.synchronizer = synchronizer
+        self.interval = interval
+        self.catalog_interval = catalog_interval
+        self.lock_path = lock_path
+        self.after_cycle = after_cycle
+        self.cache = cache
+        self.stopping = threading.Event()
+        self.catalogs_fetched_at = None
+        self.last_day = None
+
+    def stop(self, *args):
+        """
+        Let the current cycle finish and exit.
+        """
+        logging.info('Stopping after the current cycle')
+        self.stopping.set()
+
+    def today(self):
+        """
+        :return: today date in the synchronizer timezone
+        """
+        return (
+            datetime.datetime.now(datetime.timezone.utc)
+            + datetime.timedelta(hours=self.synchronizer.timezone)
+        ).date()
+
+    def run(self):
+        """
+        Run cycles until SIGTERM/SIGINT is received.
+        """
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        with open(self.lock_path, 'w') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                raise Exception('Another daemon holds %s' % self.lock_path)
+
+            while not self.stopping.is_set():
+                started = time.monotonic()
+
+                try:
+                    self.run_cycle()
+                except Exception:
+                    logging.exception('Sync cycle failed')
+
+                if self.after_cycle:
+                    self.after_cycle()
+
+                self.stopping.wait(max(0.0, self.interval - (time.monotonic() - started)))
+
+    def run_cycle(self):
+        """
+        Sync today costs, the previous day is synced once more right after midnight.
+        """
+        refresh_catalogs = self.catalogs_fetched_at is None or \
+            time.monotonic() - self.catalogs_fetched_at >= self.catalog_interval
+
+        if refresh_catalogs and self.catalogs_fetched_at is not None and self.cache is not None:
+            self.cache.expire()
+
+        self.synchronizer.reset(catalogs=refresh_catalogs)
+
+        if refresh_catalogs:
+            self.synchronizer.get_matches()
+            self.catalogs_fetched_at = time.monotonic()
+
+        today = self.today()
+        date_from = self.last_day if self.last_day and self.last_day < today else today
+        self.synchronizer.sync_range(date_from, today)
+        self.last_day = today
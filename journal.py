@@ -0,0 +1,144 @@
+"""
+Append-only journal of the cost updates of a run, used to resume interrupted runs
+Made by @plutus
+"""
+import json
+import os
+import time
+from collections import namedtuple
+
+# day is always explicit (YYYY-MM-DD), token_value None stands for the whole campaign
+JournalItem = namedtuple('JournalItem', ['camp_id', 'day', 'cost', 'token_value', 'stats_hash'])
+
+PLANNED = 'p'
+ACKED = 'a'
+
+
+class RunJournal:
+    """
+    JSON lines file: planned updates are written and fsynced before they are
+    sent, acknowledged ones are appended with batched fsyncs. A run that
+    completes truncates the file, so a non-empty journal means the previous
+    run was interrupted and lists what is still outstanding.
+
+    Losing the last unsynced acks only means re-sending those updates, which
+    is harmless as Binom replaces the cost instead of adding to it.
+    """
+
+    def __init__(self, path: str, fsync_every: int = 256, fsync_interval: float = 1.0):
+        """
+        :param path: journal file path
+        :param fsync_every: acks written between two fsyncs at most
+        :param fsync_interval: seconds between two fsyncs at most
+        """
+        self.path = path
+        self.fsync_every = max(1, fsync_every)
+        self.fsync_interval = fsync_interval
+        self.file = None
+        self.unsynced = 0
+        self.synced_at = time.monotonic()
+
+    @staticmethod
+    def get_key(camp_id, day: str, token_value=None):
+        """
+        :return: identity of an update, replays of the same key overwrite each other
+        """
+        return str(camp_id), str(day), None if token_value is None else str(token_value)
+
+    def open(self):
+        """
+        :return: journal file opened for appending
+        """
+        if self.file is None:
+            self.file = open(self.path, 'a')
+
+        return self.file
+
+    def write(self, record: list):
+        self.open().write(json.dumps(record, separators=(',', ':')) + '\n')
+
+    def sync(self):
+        """
+        Flush and fsync the appended records.
+        """
+        if self.file is not None:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+        self.unsynced = 0
+        self.synced_at = time.monotonic()
+
+    def plan(self, items: list):
+        """
+        Record updates about to be sent, durable before the first request.
+
+        :param items: list of JournalItem objects
+        """
+        if not items:
+            return
+
+        for item in items:
+            self.write([PLANNED, *item])
+
+        self.sync()
+
+    def ack(self, camp_id, day: str, token_value=None):
+        """
+        Record an update Binom accepted.
+
+        :param camp_id: Binom campaign ID
+        :param day: updated day (YYYY-MM-DD)
+        :param token_value: token value, None for the whole campaign
+        """
+        self.write([ACKED, camp_id, str(day), token_value])
+        self.unsynced += 1
+
+        if self.unsynced >= self.fsync_every or time.monotonic() - self.synced_at >= self.fsync_interval:
+            self.sync()
+
+    def get_pending(self) -> list:
+        """
+        :return: list of JournalItem objects planned and not acknowledged by an interrupted run
+        """
+        if not os.path.exists(self.path):
+            return []
+
+        pending = {}
+
+        with open(self.path) as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # torn last line of a crashed run
+                    continue
+
+                if record[0] == PLANNED:
+                    item = JournalItem(*record[1:])
+                    pending[self.get_key(item.camp_id, item.day, item.token_value)] = item
+                elif record[0] == ACKED:
+                    pending.pop(self.get_key(*record[1:]), None)
+
+        return list(pending.values())
+
+    def close(self):
+        """
+        Sync and close the file, its records are kept for the next run to resume.
+        """
+        if self.file is not None:
+            self.sync()
+            self.file.close()
+            self.file = None
+
+    def complete(self):
+        """
+        Forget the run once all its updates went through (or failed for good).
+        """
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+        with open(self.path, 'w') as file:
+            os.fsync(file.fileno())
+
+        self.unsynced = 0
@@ -10,6 +10,8 @@ class Match:
     """
     Contains matched traffic sources campaigns for given Binom campaign
     """
+    __slots__ = ('binom_campaign', 'ts_campaigns')
+
     def __init__(self, binom_campaign):
         self.binom_campaign = binom_campaign
         self.ts_campaigns = {}
@@ -67,17 +69,21 @@ class Match:
             yield ts_name, self.ts_campaigns[ts_name]
 
 
-def match_campaigns(binom: Binom, ts_providers: TSProviders):
+def match_campaigns(binom: Binom, ts_providers: TSProviders, binom_campaigns=None):
     """
     :param binom: Binom object
     :param ts_providers: TSProviders object
+    :param binom_campaigns: already fetched Binom campaigns, fetched here when not given
     :return: list of Match objects, matched traffic sources campaigns
     """
     matches = []
     matched_ts_campaigns = {}
     binom_domain = binom.get_tracking_domain()
 
-    for binom_campaign in binom.get_all_campaigns():
+    if binom_campaigns is None:
+        binom_campaigns = binom.get_all_campaigns()
+
+    for binom_campaign in binom_campaigns:
         if not binom_campaign.click_key:
             continue
 
@@ -0,0 +1,263 @@
+"""
+Run instrumentation: stage spans, counters and latency histograms
+exported as a JSON report or in the Prometheus text format
+Made by @plutus
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def get_endpoint(url: str):
+    """
+    :param url: request url
+    :return: host and path, without the query string holding secrets
+    """
+    parts = urlsplit(url)
+
+    return '%s%s' % (parts.netloc, parts.path)
+
+
+class Histogram:
+    """
+    Cumulative histogram with fixed buckets
+    """
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        """
+        :param value: observed value
+        """
+        self.sum += value
+        self.count += 1
+
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 6),
+            'buckets': dict(zip([str(bound) for bound in self.buckets], self.counts))
+        }
+
+
+class Metrics:
+    """
+    Thread safe metrics registry
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.stages = {}
+        self.counters = {}
+        self.histograms = {}
+
+    @contextmanager
+    def span(self, stage: str):
+        """
+        Measure wall time of a pipeline stage.
+
+        :param stage: stage name
+        """
+        started = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+
+            with self.lock:
+                total = self.stages.setdefault(stage, {'count': 0, 'seconds': 0.0, 'last': 0.0})
+                total['count'] += 1
+                total['seconds'] += elapsed
+                total['last'] = elapsed
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """
+        :param name: counter name
+        :param value: increment
+        :param labels: counter labels
+        """
+        key = (name, tuple(sorted(labels.items())))
+
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        """
+        :param name: histogram name
+        :param value: observed value
+        :param labels: histogram labels
+        """
+        key = (name, tuple(sorted(labels.items())))
+
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+    def observe_request(self, method: str, url: str, status, seconds: float, sent: int, received: int = None):
+        """
+        :param method: HTTP method
+        :param url: request url
+        :param status: response status code or error name
+        :param seconds: time until the response headers
+        :param sent: request bytes
+        :param received: response bytes, None when counted while streaming
+        """
+        endpoint = get_endpoint(url)
+        self.inc('http_requests_total', endpoint=endpoint, method=method, status=str(status))
+        self.observe('http_request_duration_seconds', seconds, endpoint=endpoint, method=method)
+        self.inc('http_sent_bytes_total', sent, endpoint=endpoint)
+
+        if received is not None:
+            self.inc('http_received_bytes_total', received, endpoint=endpoint)
+
+    def to_dict(self):
+        """
+        :return: JSON serializable run report
+        """
+        with self.lock:
+            return {
+                'started_at': self.started_at,
+                'uptime_seconds': round(time.time() - self.started_at, 3),
+                'stages': {
+                    stage: {key: round(value, 6) for key, value in total.items()}
+                    for stage, total in self.stages.items()
+                },
+                'counters': [
+                    {'name': name, 'labels': dict(labels), 'value': value}
+                    for (name, labels), value in sorted(self.counters.items())
+                ],
+                'histograms': [
+                    {'name': name, 'labels': dict(labels), **histogram.to_dict()}
+                    for (name, labels), histogram in sorted(self.histograms.items())
+                ]
+            }
+
+    def write_json(self, path: str):
+        """
+        :param path: report file path
+        """
+        with open(path, 'w') as report:
+            json.dump(self.to_dict(), report, indent=2, default=str)
+
+    def write_prometheus(self, path: str):
+        """
+        Write metrics for the node exporter textfile collector.
+
+        :param path: .prom file path
+        """
+        tmp_path = '%s.tmp' % path
+
+        with open(tmp_path, 'w') as report:
+            report.write(self.to_prometheus())
+
+        os.replace(tmp_path, path)
+
+    def export(self, json_path: str = None, prometheus_path: str = None):
+        """
+        :param json_path: JSON run report path, skipped when empty
+        :param prometheus_path: Prometheus text file path, skipped when empty
+        """
+        if json_path:
+            self.write_json(json_path)
+        if prometheus_path:
+            self.write_prometheus(prometheus_path)
+
+    def to_prometheus(self, prefix: str = 'binom_cs_'):
+        """
+        :param prefix: metric names prefix
+        :return: metrics in the Prometheus text exposition format
+        """
+        def format_labels(labels):
+            if not labels:
+                return ''
+            return '{%s}' % ','.join(
+                '%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                for name, value in labels
+            )
+
+        lines = []
+
+        with self.lock:
+            lines.append('# TYPE %sstage_seconds_total counter' % prefix)
+            lines.extend(
+                '%sstage_seconds_total{stage="%s"} %f' % (prefix, stage, total['seconds'])
+                for stage, total in sorted(self.stages.items())
+            )
+            lines.append('# TYPE %sstage_last_seconds gauge' % prefix)
+            lines.extend(
+                '%sstage_last_seconds{stage="%s"} %f' % (prefix, stage, total['last'])
+                for stage, total in sorted(self.stages.items())
+            )
+
+            typed = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                if name not in typed:
+                    lines.append('# TYPE %s%s counter' % (prefix, name))
+                    typed.add(name)
+                lines.append('%s%s%s %s' % (prefix, name, format_labels(labels), value))
+
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                if name not in typed:
+                    lines.append('# TYPE %s%s histogram' % (prefix, name))
+                    typed.add(name)
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    lines.append('%s%s_bucket%s %d' % (
+                        prefix, name, format_labels(labels + (('le', bound),)), count))
+                lines.append('%s%s_bucket%s %d' % (
+                    prefix, name, format_labels(labels + (('le', '+Inf'),)), histogram.count))
+                lines.append('%s%s_sum%s %f' % (prefix, name, format_labels(labels), histogram.sum))
+                lines.append('%s%s_count%s %d' % (prefix, name, format_labels(labels), histogram.count))
+
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port: int, host: str = '0.0.0.0'):
+        """
+        Expose /metrics for Prometheus scraping from a background thread.
+
+        :param port: listen port
+        :param host: listen address
+        :return: ThreadingHTTPServer
+        """
+        registry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+
+                body = registry.to_prometheus().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        return server
+
+
+metrics = Metrics()
@@ -1,35 +1,129 @@
 """
+Registry of traffic source providers: modules of providers/ (or of the
+CS_PROVIDERS_DIR directory) exposing a PROVIDER class, and the
+binom_cost_synchronizer.providers entry points of installed packages
 Made by @plutus
 """
-from providers.propeller_ads import TSPropellerAdsProvider
+import functools
+import importlib
+import importlib.util
+import logging
+import os
+
 from traffic_source import TSProviders
+from cache import CatalogCache
 from config import Config
+from transport import Transport, TransportPool
+
+PROVIDERS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'providers')
+PROVIDERS_ENTRY_POINT = 'binom_cost_synchronizer.providers'
+
+
+def load_module_provider(name: str, path: str):
+    """
+    :param name: provider name, the module name
+    :param path: module file path
+    :return: PROVIDER class of the module
+    """
+    if os.path.dirname(path) == PROVIDERS_DIR:
+        module = importlib.import_module('providers.%s' % name)
+    else:
+        spec = importlib.util.spec_from_file_location('cs_provider_%s' % name, path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+
+    if not hasattr(module, 'PROVIDER'):
+        raise Exception('Provider module %s has no PROVIDER class' % path)
+
+    return module.PROVIDER
 
-PROPELLER_ADS = 'propeller_ads'
 
+def get_entry_points() -> list:
+    """
+    :return: list of the provider entry points of installed packages
+    """
+    from importlib.metadata import entry_points
+
+    found = entry_points()
+
+    if hasattr(found, 'select'):
+        return list(found.select(group=PROVIDERS_ENTRY_POINT))
 
-def get_ts_providers(config: Config) -> TSProviders:
+    return list(found.get(PROVIDERS_ENTRY_POINT, []))
+
+
+@functools.lru_cache()
+def discover_providers(plugins_dir: str = '') -> dict:
     """
-    Get providers list.
+    List the available providers without importing them.
 
-    This is a place when new providers can be defined later on.
-    :return:
+    :param plugins_dir: extra directory of provider modules
+    :return: dict of functions returning the provider class by provider names
     """
+    loaders = {}
+
+    for directory in filter(None, (PROVIDERS_DIR, plugins_dir)):
+        for filename in sorted(os.listdir(directory)):
+            if filename.endswith('.py') and not filename.startswith('_'):
+                name = filename[:-len('.py')]
+                loaders[name] = functools.partial(load_module_provider, name, os.path.join(directory, filename))
+
+    for entry_point in get_entry_points():
+        loaders[entry_point.name] = entry_point.load
 
-    provider_details = {
-        PROPELLER_ADS: {
-            'class': TSPropellerAdsProvider,
-            'args': ['PROPELLER_ADS_API_KEY']
-        }
-    }
+    return loaders
 
+
+def get_configured_providers(config: Config, available) -> list:
+    """
+    :param config: Config object
+    :param available: names of the discovered providers
+    :return: names listed in CS_PROVIDERS, or the ones with a CS_<NAME>_API_KEY when it is empty
+    """
+    names = [name.strip() for name in (config.get('PROVIDERS') or '').split(',') if name.strip()]
+
+    if not names:
+        return [name for name in available if config.get('%s_API_KEY' % name.upper())]
+
+    unknown = [name for name in names if name not in available]
+
+    if unknown:
+        raise Exception('Unknown provider(s) %s, available: %s' % (
+            ', '.join(unknown), ', '.join(sorted(available))))
+
+    return names
+
+
+def get_ts_providers(
+        config: Config,
+        cache: CatalogCache = None,
+        transports: TransportPool = None
+) -> TSProviders:
+    """
+    Instantiate the configured providers, only their modules are imported.
+
+    :param config: Config object
+    :param cache: CatalogCache shared by providers for campaign lists
+    :param transports: TransportPool shared between tenants, own transports when not given
+    :return: TSProviders object
+    """
+    loaders = discover_providers(config.get('PROVIDERS_DIR') or '')
     ts_providers = TSProviders()
 
-    for name, data in provider_details.items():
-        instance = data['class'](
-            name,
-            *[config.get(key) for key in data['args']]
-        )
-        ts_providers.add_ts_provider(name, instance)
+    for name in get_configured_providers(config, loaders):
+        provider_class = loaders[name]()
+        rate_limit_key = '%s_RATE_LIMIT' % name.upper()
+        default_rate_limit = provider_class.capabilities.rate_limit
+
+        if transports is not None:
+            transport = transports.get(name, rate_limit_key, default_rate_limit=default_rate_limit)
+        else:
+            transport = Transport.from_config(config, rate_limit_key, default_rate_limit=default_rate_limit)
+
+        ts_providers.add_ts_provider(
+            name, provider_class.from_config(name, config, cache=cache, transport=transport))
+
+    if not ts_providers.get_ts_providers():
+        logging.warning('No traffic source provider configured, set CS_PROVIDERS or CS_<NAME>_API_KEY')
 
     return ts_providers
@@ -2,33 +2,129 @@
 Made by @plutus
 """
 import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from types import SimpleNamespace
 
-import requests
-
-from traffic_source import TSProvider, TSCampaign
+from cache import CatalogCache, cached_get
+from stream import iter_records, iter_text, record_type
+from traffic_source import ProviderCapabilities, TSProvider, TSCampaign
+from transport import Transport
 
 
 class TSPropellerAdsProvider(TSProvider):
     """
     PropellerAds Provider
     """
+    capabilities = ProviderCapabilities(
+        supports_pagination=True,
+        max_ids_per_stats_call=500,
+        supports_day_grouping=True,
+        supports_tokens=True,
+        max_concurrent_stats_calls=4
+    )
+
+    config_args = ('API_KEY',)
+    config_kwargs = {
+        'page_size': 'PAGE_SIZE',
+        'page_concurrency': 'PAGE_CONCURRENCY',
+        'stats_chunk_size': 'STATS_CHUNK_SIZE',
+        'stats_concurrency': 'STATS_CONCURRENCY'
+    }
+
+    def __init__(
+            self,
+            ts_name: str,
+            api_key: str,
+            substring_fallback: bool = True,
+            page_size: int = 500,
+            page_concurrency: int = 4,
+            stats_chunk_size: int = 500,
+            stats_concurrency: int = 4,
+            cache: CatalogCache = None,
+            transport: Transport = None,
+            base_uri: str = None
+    ):
+        super().__init__(ts_name, substring_fallback)
+        self.page_size = int(page_size)
+
+        if self.page_size < 1:
+            raise Exception('PropellerAds page size must be at least 1, got %d' % self.page_size)
+
+        self.page_concurrency = max(1, int(page_concurrency))
+        self.stats_chunk_size = max(1, int(stats_chunk_size))
+        self.stats_concurrency = max(1, int(stats_concurrency))
+        # TSProviders splits the statistics calls by these settings
+        self.capabilities = self.capabilities._replace(
+            max_ids_per_stats_call=self.stats_chunk_size,
+            max_concurrent_stats_calls=self.stats_concurrency
+        )
+        self.api = PropellerAdsAPIV5(
+            api_key,
+            pool_size=max(self.page_concurrency, self.stats_concurrency),
+            cache=cache,
+            transport=transport,
+            base_uri=base_uri
+        )
 
-    def __init__(self, ts_name: str, api_key: str):
-        super().__init__(ts_name)
-        self.api = PropellerAdsAPIV5(api_key)
-
-    def get_ts_campaigns(self, page: int = None, page_size: int = None):
+    def get_ts_campaigns(self):
         """
-        Fetch PropellerAds campaigns and store them.
-        :param page: page number
-        :param page_size: page size
-        :return:
+        Fetch all PropellerAds campaigns and store them.
+        :return: dict of TSPropellerAdsCampaign objects
+        """
+        if self.ts_campaigns is None:
+            self.ts_campaigns = {
+                ts_campaign.id: ts_campaign
+                for ts_campaign in self.iter_ts_campaigns()
+            }
+
+        return self.ts_campaigns
+
+    def iter_ts_campaigns(self):
         """
-        if self.ts_campaigns:
-            return self.ts_campaigns
+        Yield PropellerAds campaigns as the pages arrive.
 
-        response = self.api.get_campaigns_list(
+        The first page tells how many pages there are, the remaining ones
+        are fetched concurrently. The API may serve less rows than page_size
+        asked for, pages are counted with the size of the first one.
+        :return: generator of TSPropellerAdsCampaign objects
+        """
+        if self.ts_campaigns is not None:
+            yield from self.ts_campaigns.values()
+            return
+
+        response = self.fetch_campaigns_page(1)
+        page_size = len(response.result)
+        yield from self.to_ts_campaigns(response.result)
+
+        if not page_size:
+            return
+
+        pages_count = get_pages_count(response, page_size)
+
+        if pages_count is None:
+            # no paging metadata, read pages one by one until a short or empty page
+            page, rows = 1, response.result
+            while len(rows) >= page_size:
+                page += 1
+                rows = self.fetch_campaigns_page(page).result
+                yield from self.to_ts_campaigns(rows)
+            return
+
+        with ThreadPoolExecutor(max_workers=self.page_concurrency) as executor:
+            futures = [
+                executor.submit(self.fetch_campaigns_page, page)
+                for page in range(2, pages_count + 1)
+            ]
+
+            for future in as_completed(futures):
+                yield from self.to_ts_campaigns(future.result().result)
+
+    def fetch_campaigns_page(self, page: int):
+        """
+        :param page: page number, starting from 1
+        :return: response object
+        """
+        return self.api.get_campaigns_list(
             is_archived=0,
             status=[
                 TSPropellerAdsCampaign.STATUS_WORKING,
@@ -37,34 +133,50 @@ class TSPropellerAdsProvider(TSProvider):
                 TSPropellerAdsCampaign.STATUS_COMPLETED,
             ],
             page=page,
-            page_size=page_size)
-
-        ts_campaigns = {}
+            page_size=self.page_size)
 
-        for data in response.result:
-            ts_campaigns[data.id] = TSPropellerAdsCampaign(
+    def to_ts_campaigns(self, rows: list):
+        """
+        :param rows: campaigns list from the API response
+        :return: generator of TSPropellerAdsCampaign objects
+        """
+        for data in rows:
+            yield TSPropellerAdsCampaign(
                 ts_name=self.ts_name,
                 id=data.id,
                 url=data.target_url,
                 name=data.name
             )
 
-        self.ts_campaigns = ts_campaigns
-
-        return self.ts_campaigns
-
-    def match(self, binom_campaign_url: str):
+    def get_cost(
+            self,
+            ts_campaign_ids: list,
+            date_from: str,
+            date_to: str,
+            timezone: int
+    ):
         """
-        :param binom_campaign_url: Binom campaign URL
-        :return: list of matched PropellerAds campaigns
+        :param ts_campaign_ids: list of campaigns ids
+        :param date_from: date from
+        :param date_to: date to
+        :param timezone: timezone
+        :return: dict of costs by campaign ids
         """
-        return [
-            ts_campaign
-            for ts_campaign_id, ts_campaign in self.get_ts_campaigns().items()
-            if binom_campaign_url in ts_campaign.url
-        ]
+        costs = {}
 
-    def get_cost(
+        for stats in self.iter_statistics(
+                ts_campaign_ids,
+                date_from,
+                date_to,
+                timezone,
+                group_by="campaign_id"
+        ):
+            costs[stats.campaign_id] = \
+                costs.get(stats.campaign_id, 0.0) + float(stats.money or 0)
+
+        return costs
+
+    def get_daily_cost(
             self,
             ts_campaign_ids: list,
             date_from: str,
@@ -76,29 +188,95 @@ class TSPropellerAdsProvider(TSProvider):
         :param date_from: date from
         :param date_to: date to
         :param timezone: timezone
-        :return: list of costs grouped by campaign ids
+        :return: dict of costs by campaign ids grouped by day (YYYY-MM-DD)
+        """
+        costs_by_day = {}
+
+        for stats in self.iter_statistics(
+                ts_campaign_ids,
+                date_from,
+                date_to,
+                timezone,
+                group_by=["campaign_id", "date"]
+        ):
+            costs = costs_by_day.setdefault(str(stats.date)[:10], {})
+            costs[stats.campaign_id] = \
+                costs.get(stats.campaign_id, 0.0) + float(stats.money or 0)
+
+        return costs_by_day
+
+    def iter_token_costs(
+            self,
+            ts_campaign_ids: list,
+            date_from: str,
+            date_to: str,
+            timezone: int,
+            token: str = 'zone_id'
+    ):
+        """
+        :param ts_campaign_ids: list of campaigns ids
+        :param date_from: date from
+        :param date_to: date to
+        :param timezone: timezone
+        :param token: zone_id or sub_id
+        :return: generator of (campaign id, day (YYYY-MM-DD), token value, cost) tuples
+        """
+        if token not in ('zone_id', 'sub_id'):
+            raise Exception('PropellerAds statistics cannot be grouped by %s' % token)
+
+        for stats in self.iter_statistics(
+                ts_campaign_ids,
+                date_from,
+                date_to,
+                timezone,
+                group_by=["campaign_id", token, "date"]
+        ):
+            yield stats.campaign_id, str(stats.date)[:10], getattr(stats, token), float(stats.money or 0)
+
+    def iter_statistics(
+            self,
+            ts_campaign_ids: list,
+            date_from: str,
+            date_to: str,
+            timezone: int,
+            group_by
+    ):
+        """
+        Stream statistics of the campaigns in a single call, TSProviders splits
+        the ids in chunks of max_ids_per_stats_call fetched concurrently.
+
+        :param ts_campaign_ids: list of campaigns ids
+        :param date_from: date from
+        :param date_to: date to
+        :param timezone: timezone
+        :param group_by: statistics grouping field(s)
+        :return: generator of statistics rows
         """
         timezone_sign = '+' if timezone > 0 else '-'
 
-        ts_campaigns_stats = self.api.get_statistics({
-            "group_by": "campaign_id",
+        yield from self.api.get_statistics({
+            "group_by": group_by,
             "day_from": date_from,
             "day_to": date_to,
             "tz": "{:s}{:02d}00".format(timezone_sign, abs(timezone)),
-            "campaign_id": ts_campaign_ids
+            "campaign_id": list(dict.fromkeys(ts_campaign_ids))
         })
 
-        ts_campaigns = self.get_ts_campaigns()
 
-        for stats in ts_campaigns_stats:
-            ts_campaigns[stats.campaign_id].set_cost(stats.money)
+def get_pages_count(response, page_size: int):
+    """
+    Read the number of pages from the total rows count of the campaigns list response.
 
-        costs = {}
+    :param response: response object
+    :param page_size: rows of the first page
+    :return: pages count or None when the response has no total
+    """
+    total = getattr(response, 'total', None)
 
-        for ts_campaign_id, ts_campaign in self.ts_campaigns.items():
-            costs[ts_campaign_id] = ts_campaign.cost
+    if total is None:
+        return None
 
-        return costs
+    return -(-int(total) // page_size)
 
 
 class PropellerAdsAPIV5:
@@ -106,63 +284,92 @@ class PropellerAdsAPIV5:
     V5 PropellerAds API handler
     """
 
-    def __init__(self, api_key):
+    def __init__(
+            self,
+            api_key,
+            pool_size: int = 10,
+            cache: CatalogCache = None,
+            transport: Transport = None,
+            base_uri: str = None
+    ):
         self.api_key = api_key
-        self.base_uri = 'https://ssp-api.propellerads.com/v5/'
+        self.base_uri = base_uri if base_uri else 'https://ssp-api.propellerads.com/v5/'
+        self.transport = transport if transport else Transport(pool_size)
+        self.cache = cache
 
-    def __get(self, endpoint: str, payload: dict, headers: dict = None):
+    def __get(
+            self,
+            endpoint: str,
+            payload: dict,
+            headers: dict = None,
+            cache: CatalogCache = None,
+            field: str = None
+    ):
         """
         :param endpoint: request endpoint
         :param payload: payload dict
         :param headers: headers dict
+        :param cache: CatalogCache used for this request
+        :param field: field the response must have, error bodies are rejected before being cached
         :return: response object
         """
         headers = headers if headers else {}
-        response = requests.get(
+
+        def decode(text):
+            response = json.loads(
+                text,
+                object_hook=lambda d: SimpleNamespace(**d)
+            )
+
+            if field is not None and not hasattr(response, field):
+                raise Exception('Unexpected response of %s: %s' % (endpoint, text[:500]))
+
+            return response
+
+        return cached_get(
+            self.transport,
+            cache,
             "%s%s" % (self.base_uri, endpoint),
             payload,
             headers={
                 'Authorization':
                     'Bearer %s' % self.api_key,
                 **headers
-            }
-        )
-
-        return json.loads(
-            response.text,
-            object_hook=lambda d: SimpleNamespace(**d)
+            },
+            namespace=self.api_key,
+            decode=decode
         )
 
-    def __post(
+    def __post_stream(
             self,
             endpoint: str,
+            record: type,
             payload: dict = None,
             json_data: dict = None,
             headers: dict = None
     ):
         """
         :param endpoint: request endpoint
+        :param record: record type of the response array rows
         :param payload: payload dict
         :param json_data: json dict
         :param headers: headers dict
-        :return: response object
+        :return: generator of records decoded while the response is read
         """
         headers = headers if headers else {}
-        response = requests.post(
-            "%s%s" % (self.base_uri, endpoint),
-            payload,
-            json=json_data,
-            headers={
-                'Authorization':
-                    'Bearer %s' % self.api_key,
-                **headers
-            }
-        )
 
-        return json.loads(
-            response.text,
-            object_hook=lambda d: SimpleNamespace(**d)
-        )
+        with self.transport.post(
+                "%s%s" % (self.base_uri, endpoint),
+                data=payload,
+                json=json_data,
+                headers={
+                    'Authorization':
+                        'Bearer %s' % self.api_key,
+                    **headers
+                },
+                stream=True
+        ) as response:
+            yield from iter_records(iter_text(response), record)
 
     def get_campaigns_list(
             self,
@@ -199,20 +406,27 @@ class PropellerAdsAPIV5:
         if page_size:
             payload['page_size'] = page_size
 
-        return self.__get('adv/campaigns', payload)
+        return self.__get('adv/campaigns', payload, cache=self.cache, field='result')
 
     def get_statistics(self, payload):
         """
         :param payload: payload dict
-        :return: response object
+        :return: generator of TSPropellerAdsStats records
         """
-        return self.__post(
+        return self.__post_stream(
             'adv/statistics',
+            TSPropellerAdsStats,
             json_data=payload,
             headers={'Content-Type': 'application/json'}
         )
 
 
+TSPropellerAdsStats = record_type(
+    'TSPropellerAdsStats',
+    ['campaign_id', 'date', 'zone_id', 'sub_id', 'money']
+)
+
+
 class TSPropellerAdsCampaign(TSCampaign):
     """
     PropellerAds Campaign
@@ -227,5 +441,11 @@ class TSPropellerAdsCampaign(TSCampaign):
     STATUS_STOPPED = 8
     STATUS_COMPLETED = 9
 
+    __slots__ = ()
+
     def __init__(self, ts_name, id, url, name):
         super().__init__(ts_name, id, url, name)
+
+
+# provider class registered under the module name
+PROVIDER = TSPropellerAdsProvider
@@ -0,0 +1,97 @@
+"""
+Read-only reconciliation of traffic sources costs with the costs currently in Binom
+Made by @plutus
+"""
+import csv
+import json
+from collections import namedtuple
+
+from aggregate import COST_PRECISION
+
+CostDelta = namedtuple('CostDelta', ['camp_id', 'name', 'day', 'binom_cost', 'ts_cost', 'delta'])
+
+
+def compute_deltas(
+        binom_campaigns: list,
+        totals: list,
+        binom_costs: dict,
+        day,
+        skipped: set = frozenset()
+) -> list:
+    """
+    Compare the traffic sources totals with Binom costs position by position.
+
+    :param binom_campaigns: Binom campaigns by position (MatchColumns.binom_campaigns)
+    :param totals: traffic sources costs by position (MatchColumns.sum_costs)
+    :param binom_costs: dict of current costs by Binom campaign IDs
+    :param day: compared day
+    :param skipped: Binom campaigns positions to leave out
+    :return: list of CostDelta objects, campaigns without cost on both sides are left out
+    """
+    deltas = []
+
+    for position, (binom_campaign, ts_cost) in enumerate(zip(binom_campaigns, totals)):
+        binom_cost = binom_costs.get(int(binom_campaign.id), 0.0)
+
+        if (not ts_cost and not binom_cost) or position in skipped:
+            continue
+
+        deltas.append(CostDelta(
+            binom_campaign.id,
+            binom_campaign.name,
+            str(day),
+            round(binom_cost, COST_PRECISION),
+            round(ts_cost, COST_PRECISION),
+            round(ts_cost - binom_cost, COST_PRECISION)
+        ))
+
+    return deltas
+
+
+def sort_deltas(deltas: list) -> list:
+    """
+    :param deltas: list of CostDelta objects
+    :return: deltas sorted by descending absolute delta, then day and campaign
+    """
+    return sorted(deltas, key=lambda delta: (-abs(delta.delta), delta.day, int(delta.camp_id)))
+
+
+def write_report(deltas: list, path: str):
+    """
+    :param deltas: list of CostDelta objects
+    :param path: report path, JSON for a .json extension, CSV otherwise
+    """
+    with open(path, 'w', newline='') as file:
+        if path.endswith('.json'):
+            json.dump([delta._asdict() for delta in deltas], file, indent=2)
+            return
+
+        writer = csv.writer(file)
+        writer.writerow(CostDelta._fields)
+        writer.writerows(deltas)
+
+
+def summarize(deltas: list) -> list:
+    """
+    :param deltas: list of CostDelta objects
+    :return: list of report lines
+    """
+    changed = [delta for delta in deltas if delta.delta]
+    # zero costs are never pushed
+    pushed = [delta for delta in changed if delta.ts_cost]
+
+    return [
+        'Would update Binom Campaign(camp_id=%s, cost=%s, date=%s), currently %s' % (
+            delta.camp_id, delta.ts_cost, delta.day, delta.binom_cost)
+        for delta in pushed
+    ] + [
+        'Dry run: %d compared, %d differ, %d would be updated, '
+        'Binom %.2f, traffic sources %.2f, delta %+.2f' % (
+            len(deltas),
+            len(changed),
+            len(pushed),
+            sum(delta.binom_cost for delta in deltas),
+            sum(delta.ts_cost for delta in deltas),
+            sum(delta.delta for delta in deltas)
+        )
+    ]
@@ -0,0 +1,307 @@
+"""
+Sharded matching and aggregation over a process pool for large accounts,
+Binom campaigns are partitioned by zlib.crc32 of their click key
+Made by @plutus
+"""
+import zlib
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+from aggregate import CostAggregator
+from match import Match
+from snapshot import PLAIN_CLICK_KEY
+from traffic_source import TSProviders, parse_click_url
+
+# rows under which a sharded aggregation is reduced in process
+SHARD_MIN_ROWS = 100000
+
+
+def get_shard(click_key: str, shards: int) -> int:
+    """
+    :param click_key: click key as parsed from a click URL
+    :param shards: number of shards
+    :return: shard of the key
+    """
+    return zlib.crc32(click_key.encode('utf-8')) % shards
+
+
+def parse_urls(urls: list, offset: int, shards: int):
+    """
+    Worker: parse a chunk of traffic source campaign URLs.
+
+    :param urls: campaign URLs
+    :param offset: index of the first URL in the provider campaigns
+    :param shards: number of shards
+    :return: (list of (array of campaign indexes, list of (host, click_key)) by shard,
+              array of indexes of the URLs that can't be parsed)
+    """
+    grouped = [(array('l'), []) for _ in range(shards)]
+    unparsed = array('l')
+
+    for index, url in enumerate(urls, offset):
+        key = parse_click_url(url) if url else None
+
+        if key is None:
+            unparsed.append(index)
+            continue
+
+        indexes, keys = grouped[get_shard(key[1], shards)]
+        indexes.append(index)
+        keys.append(key)
+
+    return grouped, unparsed
+
+
+def match_shard(binom_domain: str, positions: array, click_keys: list, ts_columns: list):
+    """
+    Worker: build the partial index of one shard and match its Binom campaigns.
+
+    :param binom_domain: Binom tracking domain
+    :param positions: positions of the shard Binom campaigns
+    :param click_keys: click keys of the shard Binom campaigns
+    :param ts_columns: (array of campaign indexes, list of (host, click_key)) by provider code
+    :return: (array of Binom positions, array of provider codes, array of campaign indexes),
+             ascending by position
+    """
+    index = {}
+
+    for ts_code, (indexes, keys) in enumerate(ts_columns):
+        for ts_index, key in zip(indexes, keys):
+            index.setdefault(key, []).append((ts_code, ts_index))
+
+    pairs = (array('l'), array('l'), array('l'))
+
+    for position, click_key in zip(positions, click_keys):
+        key = parse_click_url("%s/click.php?key=%s" % (binom_domain, click_key))
+
+        for ts_code, ts_index in index.get(key, ()) if key else ():
+            pairs[0].append(position)
+            pairs[1].append(ts_code)
+            pairs[2].append(ts_index)
+
+    return pairs
+
+
+def reduce_shard(aggregator: CostAggregator):
+    """
+    Worker: reduce the rows of one shard.
+
+    :param aggregator: CostAggregator object
+    :return: CostAggregator.reduce_columns() result
+    """
+    return aggregator.reduce_columns()
+
+
+class Sharder:
+    """
+    Runs the CPU bound parts of a sync, URL parsing with matching and the
+    aggregation of token statistics, on a pool of processes.
+
+    Traffic source URLs are parsed in chunks and grouped by shard of their
+    click key, each shard then indexes its part and matches the Binom
+    campaigns of the same shard. Results come back as compact arrays of
+    positions and indexes, not as campaign objects.
+    """
+
+    def __init__(self, shards: int, min_rows: int = SHARD_MIN_ROWS):
+        """
+        :param shards: number of shards and processes
+        :param min_rows: rows under which aggregation is not sent to processes
+        """
+        self.shards = max(1, shards)
+        self.min_rows = min_rows
+        self.binom_campaigns = None
+        self.shard_of_position = None
+
+    def get_binom_shards(self, binom_domain: str, binom_campaigns: list):
+        """
+        :param binom_domain: Binom tracking domain
+        :param binom_campaigns: Binom campaigns
+        :return: list of shards by position, None for campaigns without click key
+        """
+        if binom_campaigns is not self.binom_campaigns:
+            shard_of_position = []
+
+            for binom_campaign in binom_campaigns:
+                click_key = binom_campaign.click_key
+
+                if click_key and not PLAIN_CLICK_KEY.match(click_key):
+                    # hash the key as the URL parser decodes it
+                    key = parse_click_url("%s/click.php?key=%s" % (binom_domain, click_key))
+                    click_key = key[1] if key else None
+
+                shard_of_position.append(get_shard(click_key, self.shards) if click_key else None)
+
+            self.binom_campaigns = binom_campaigns
+            self.shard_of_position = shard_of_position
+
+        return self.shard_of_position
+
+    def match(self, binom, ts_providers: TSProviders, binom_campaigns=None):
+        """
+        Same results as match.match_campaigns(), without the providers match indexes.
+
+        :param binom: Binom object
+        :param ts_providers: TSProviders object with fetched campaigns
+        :param binom_campaigns: already fetched Binom campaigns, fetched here when not given
+        :return: list of Match objects, matched traffic sources campaigns
+        """
+        binom_domain = binom.get_tracking_domain()
+
+        if binom_campaigns is None:
+            binom_campaigns = list(binom.get_all_campaigns())
+
+        ts_names = list(ts_providers.get_ts_providers())
+        ts_campaigns = [list(ts_providers.get_ts_provider(ts_name).get_ts_campaigns().values()) for ts_name in ts_names]
+        shard_of_position = self.get_binom_shards(binom_domain, binom_campaigns)
+        ts_columns = [[(array('l'), []) for _ in ts_names] for _ in range(self.shards)]
+        unparsed = [array('l') for _ in ts_names]
+        binom_columns = [(array('l'), []) for _ in range(self.shards)]
+
+        for position, (binom_campaign, shard) in enumerate(zip(binom_campaigns, shard_of_position)):
+            if shard is not None:
+                binom_columns[shard][0].append(position)
+                binom_columns[shard][1].append(binom_campaign.click_key)
+
+        with ProcessPoolExecutor(max_workers=self.shards) as executor:
+            for ts_code, campaigns in enumerate(ts_campaigns):
+                size = -(-len(campaigns) // self.shards) or 1
+                futures = [
+                    executor.submit(
+                        parse_urls, [ts_campaign.url for ts_campaign in campaigns[i:i + size]], i, self.shards)
+                    for i in range(0, len(campaigns), size)
+                ]
+
+                for future in futures:
+                    grouped, chunk_unparsed = future.result()
+                    unparsed[ts_code].extend(chunk_unparsed)
+
+                    for shard, (indexes, keys) in enumerate(grouped):
+                        ts_columns[shard][ts_code][0].extend(indexes)
+                        ts_columns[shard][ts_code][1].extend(keys)
+
+            results = list(executor.map(
+                match_shard,
+                [binom_domain] * self.shards,
+                [positions for positions, _ in binom_columns],
+                [click_keys for _, click_keys in binom_columns],
+                ts_columns
+            ))
+
+        hits = {}
+
+        for positions, ts_codes, ts_indexes in results:
+            for position, ts_code, ts_index in zip(positions, ts_codes, ts_indexes):
+                hits.setdefault(position, []).append((ts_code, ts_index))
+
+        return self.build_matches(
+            binom_domain, binom_campaigns, ts_providers, ts_names, ts_campaigns, hits, unparsed)
+
+    @staticmethod
+    def build_matches(binom_domain, binom_campaigns, ts_providers, ts_names, ts_campaigns, hits, unparsed):
+        """
+        :return: list of Match objects, matched traffic sources campaigns, in match_campaigns() order
+        """
+        matches = []
+        matched_ts_campaigns = {}
+        fallback = [
+            [ts_campaigns[ts_code][ts_index] for ts_index in unparsed[ts_code]]
+            if ts_providers.get_ts_provider(ts_name).substring_fallback else []
+            for ts_code, ts_name in enumerate(ts_names)
+        ]
+
+        for position, binom_campaign in enumerate(binom_campaigns):
+            if not binom_campaign.click_key:
+                continue
+
+            if not matched_ts_campaigns:
+                matched_ts_campaigns = {ts_name: [] for ts_name in ts_names}
+
+            binom_campaign_url = "%s/click.php?key=%s" % (binom_domain, binom_campaign.click_key)
+            match = Match(binom_campaign)
+            found = [[] for _ in ts_names]
+
+            for ts_code, ts_index in hits.get(position, ()):
+                found[ts_code].append(ts_campaigns[ts_code][ts_index])
+
+            for ts_code, ts_name in enumerate(ts_names):
+                found[ts_code].extend(
+                    ts_campaign for ts_campaign in fallback[ts_code]
+                    if ts_campaign.url and binom_campaign_url in ts_campaign.url
+                )
+
+                for ts_campaign in found[ts_code]:
+                    match.add_ts_campaign(ts_name, ts_campaign)
+                    matched_ts_campaigns[ts_name].append(ts_campaign)
+
+            if match.get_ts_campaigns_count() > 0:
+                matches.append(match)
+
+        return matches, matched_ts_campaigns
+
+    def create_aggregator(self, binom_domain: str, binom_campaigns: list):
+        """
+        :param binom_domain: Binom tracking domain
+        :param binom_campaigns: Binom campaigns the aggregated positions refer to
+        :return: ShardedCostAggregator object
+        """
+        return ShardedCostAggregator(
+            self.get_binom_shards(binom_domain, binom_campaigns), self.shards, self.min_rows)
+
+
+class ShardedCostAggregator:
+    """
+    CostAggregator split by shard of the Binom campaigns, rows are routed on
+    add() and the shards are reduced in parallel processes.
+    """
+
+    def __init__(self, shard_of_position: list, shards: int, min_rows: int = SHARD_MIN_ROWS):
+        """
+        :param shard_of_position: list of shards by Binom campaign position
+        :param shards: number of shards
+        :param min_rows: rows under which shards are reduced in process
+        """
+        self.shard_of_position = shard_of_position
+        self.aggregators = [CostAggregator() for _ in range(shards)]
+        self.min_rows = min_rows
+
+    def __len__(self):
+        return sum(map(len, self.aggregators))
+
+    def add_source(self, fx_rate: float = 1.0, utc_offset: int = None) -> int:
+        """
+        :return: source code passed to add(), see CostAggregator.add_source()
+        """
+        for aggregator in self.aggregators:
+            source = aggregator.add_source(fx_rate, utc_offset)
+
+        return source
+
+    def add(self, source: int, position: int, date: str, token_value, cost: float):
+        """
+        See CostAggregator.add()
+        """
+        self.aggregators[self.shard_of_position[position] or 0].add(source, position, date, token_value, cost)
+
+    def reduce(self) -> dict:
+        """
+        :return: dict of costs by (position, day (YYYY-MM-DD), token value)
+        """
+        aggregators = [aggregator for aggregator in self.aggregators if len(aggregator)]
+
+        if len(self) < self.min_rows or len(aggregators) < 2:
+            results = [aggregator.reduce_columns() for aggregator in aggregators]
+        else:
+            with ProcessPoolExecutor(max_workers=len(aggregators)) as executor:
+                results = list(executor.map(reduce_shard, aggregators))
+
+        # shards hold disjoint positions, their totals don't overlap
+        totals = {}
+
+        for positions, day_codes, token_codes, sums, days, token_values in results:
+            totals.update(
+                ((position, days[day_code], token_values[token_code]), cost)
+                for position, day_code, token_code, cost in zip(positions, day_codes, token_codes, sums)
+            )
+
+        return totals
@@ -0,0 +1,527 @@
+"""
+Persisted match results, re-matched incrementally when the catalogs change
+Made by @plutus
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+
+from match import Match, match_campaigns
+from metrics import metrics
+from traffic_source import TSProviders, parse_click_url
+
+SNAPSHOT_VERSION = 3
+
+# click keys parsed back from a click URL unchanged
+PLAIN_CLICK_KEY = re.compile(r'^[\w-]+$')
+
+# click key of a campaign not parsed yet, None is stored for unparseable URLs
+UNPARSED = object()
+
+EMPTY = frozenset()
+
+
+class MatchSnapshot:
+    """
+    JSON file holding the matches (Binom camp_id -> TS campaign ids per
+    provider) and what they were computed from: the Binom click keys, and per
+    traffic source a digest of the whole catalog plus the digest and the
+    parsed click key of each campaign URL.
+
+    On the next run the fresh catalogs are diffed against it: unchanged
+    catalogs are taken as they are, in the others only the campaigns whose
+    URL digest changed are parsed. Added, removed and changed campaigns on
+    either side are re-matched against the stored click keys, the providers
+    match indexes are only built by full re-matches, so the matching cost
+    follows the churn instead of the catalogs size. The file is rewritten
+    only when something changed.
+    """
+
+    def __init__(self, path: str, max_churn: float = 0.5, check: bool = False, rebuild: bool = False):
+        """
+        :param path: snapshot file path
+        :param max_churn: share of changed campaigns above which everything is re-matched
+        :param check: compare incremental results with a full re-match
+        :param rebuild: ignore the snapshot on the next match
+        """
+        self.path = path
+        self.max_churn = max_churn
+        self.check = check
+        self.rebuild = rebuild
+        self.generation = 0
+
+    def load(self):
+        """
+        :return: snapshot dict or None when missing or unreadable
+        """
+        if not os.path.exists(self.path):
+            return None
+
+        try:
+            with open(self.path) as file:
+                snapshot = json.load(file)
+        except ValueError as error:
+            logging.warning('Ignoring match snapshot %s: %r', self.path, error)
+            return None
+
+        return snapshot if snapshot.get('version') == SNAPSHOT_VERSION else None
+
+    def save(self, snapshot: dict):
+        """
+        :param snapshot: snapshot dict, written atomically
+        """
+        temporary = '%s.tmp' % self.path
+
+        with open(temporary, 'w') as file:
+            # dumps() encodes in C, dump() to a file does not
+            file.write(json.dumps(snapshot, separators=(',', ':')))
+
+        os.replace(temporary, self.path)
+
+    def match(self, binom, ts_providers: TSProviders, binom_campaigns: list, matcher=match_campaigns):
+        """
+        :param binom: Binom object
+        :param ts_providers: TSProviders object with fetched campaigns, match indexes are not needed
+        :param binom_campaigns: fetched Binom campaigns
+        :param matcher: function matching every campaign, match_campaigns or Sharder.match
+        :return: (list of Match objects, matched traffic sources campaigns), as match_campaigns
+        """
+        snapshot = get_settings(binom, ts_providers)
+        snapshot['binom'] = get_binom_keys(binom_campaigns)
+        digests = {
+            ts_name: get_catalog_digest(ts_campaigns)
+            for ts_name, ts_campaigns in ts_providers.get_ts_campaigns()
+        }
+        previous = None if self.rebuild else self.load()
+        compatible = previous is not None and is_compatible(previous, snapshot)
+        unchanged = compatible and snapshot['binom'] == previous['binom'] and digests == {
+            ts_name: catalog['digest'] for ts_name, catalog in previous['ts'].items()
+        }
+        pairs = None
+
+        if unchanged:
+            pairs, snapshot['ts'] = previous['matches'], previous['ts']
+        elif compatible:
+            pairs, snapshot['ts'] = self.update(previous, snapshot, digests, ts_providers)
+
+        if pairs is None:
+            metrics.inc('match_snapshot_runs_total', mode='full')
+            matches, matched_ts_campaigns = matcher(binom, ts_providers, binom_campaigns)
+            pairs = to_pairs(matches)
+            snapshot['ts'] = get_ts_catalogs(
+                snapshot, digests, ts_providers, previous['ts'] if compatible else {})
+        else:
+            metrics.inc('match_snapshot_runs_total', mode='unchanged' if unchanged else 'incremental')
+            matches, matched_ts_campaigns = build_matches(binom_campaigns, pairs, ts_providers)
+
+            if self.check:
+                matches, matched_ts_campaigns, checked_pairs = self.verify(
+                    binom, ts_providers, binom_campaigns, matches, matched_ts_campaigns, pairs, matcher)
+                unchanged = unchanged and checked_pairs is pairs
+                pairs = checked_pairs
+
+        self.rebuild = False
+
+        if unchanged:
+            self.generation = previous['generation']
+            return matches, matched_ts_campaigns
+
+        self.generation = (previous or {}).get('generation', 0) + 1
+        self.save({**snapshot, 'version': SNAPSHOT_VERSION, 'generation': self.generation, 'matches': pairs})
+
+        return matches, matched_ts_campaigns
+
+    def update(self, previous: dict, snapshot: dict, digests: dict, ts_providers: TSProviders):
+        """
+        :param previous: loaded snapshot
+        :param snapshot: settings and Binom click keys of this run
+        :param digests: dict of catalog digests by traffic source names
+        :param ts_providers: TSProviders object
+        :return: (pairs dict, traffic sources catalogs to store),
+                 (None, None) when the churn is too high for an incremental update
+        """
+        binom_keys, old_binom_keys = snapshot['binom'], previous['binom']
+        changed_binom = {
+            camp_id for camp_id, click_key in binom_keys.items()
+            if old_binom_keys.get(camp_id) != click_key
+        }
+        churn = len(changed_binom) + len(old_binom_keys.keys() - binom_keys.keys())
+        total = len(binom_keys)
+        catalogs, changed_ts, stale_ts = {}, {}, {}
+
+        for ts_name, ts_campaigns in ts_providers.get_ts_campaigns():
+            old_catalog = previous['ts'].get(ts_name)
+            total += len(ts_campaigns)
+
+            if old_catalog is not None and old_catalog['digest'] == digests[ts_name]:
+                catalogs[ts_name] = old_catalog
+                continue
+
+            catalogs[ts_name], changed_ts[ts_name], stale_ts[ts_name] = \
+                diff_catalog(ts_campaigns, digests[ts_name], old_catalog)
+            churn += len(stale_ts[ts_name])
+
+        if churn > self.max_churn * max(1, total):
+            return None, None
+
+        binom_host = get_binom_host(snapshot['binom_domain'])
+
+        for ts_name, changed in changed_ts.items():
+            set_click_keys(catalogs[ts_name], changed, binom_host)
+
+        # unchanged Binom campaigns keep their matches, minus removed or changed TS campaigns
+        pairs = {}
+        filtered = stale_ts or previous['ts'].keys() - catalogs.keys()
+
+        for camp_id, matched in previous['matches'].items():
+            if camp_id not in binom_keys or camp_id in changed_binom:
+                continue
+
+            if filtered and any(
+                    ts_name not in catalogs or not stale_ts.get(ts_name, EMPTY).isdisjoint(ts_ids)
+                    for ts_name, ts_ids in matched.items()
+            ):
+                matched = {
+                    ts_name: [ts_id for ts_id in ts_ids if ts_id not in stale_ts.get(ts_name, EMPTY)]
+                    for ts_name, ts_ids in matched.items()
+                    if ts_name in catalogs
+                }
+                matched = {ts_name: ts_ids for ts_name, ts_ids in matched.items() if ts_ids}
+
+            pairs[camp_id] = matched
+
+        # changed Binom campaigns against the stored keys of every traffic sources campaign
+        if changed_binom:
+            add_binom_matches(pairs, changed_binom, snapshot, catalogs, ts_providers)
+
+        # changed traffic sources campaigns against the unchanged Binom campaigns
+        if any(changed_ts.values()):
+            add_ts_matches(pairs, changed_ts, changed_binom, snapshot, catalogs, ts_providers)
+
+        metrics.inc('match_rematched_total', len(changed_binom), side='binom')
+        metrics.inc('match_rematched_total', sum(map(len, changed_ts.values())), side='ts')
+
+        return {camp_id: matched for camp_id, matched in pairs.items() if matched}, catalogs
+
+    def verify(self, binom, ts_providers, binom_campaigns, matches, matched_ts_campaigns, pairs, matcher):
+        """
+        Consistency check: re-match everything and compare.
+
+        :return: (matches, matched_ts_campaigns, pairs) of the full match when they differ
+        """
+        full_matches, full_matched_ts_campaigns = matcher(binom, ts_providers, binom_campaigns)
+        full_pairs = to_pairs(full_matches)
+
+        if normalize(full_pairs) == normalize(pairs):
+            return matches, matched_ts_campaigns, pairs
+
+        logging.warning('Incremental matches differ from a full re-match, using the full one')
+        metrics.inc('match_snapshot_mismatch_total')
+
+        return full_matches, full_matched_ts_campaigns, full_pairs
+
+
+def get_settings(binom, ts_providers: TSProviders) -> dict:
+    """
+    :return: dict of the settings the matches depend on
+    """
+    return {
+        'binom_domain': binom.get_tracking_domain(),
+        'substring_fallback': {
+            ts_name: ts_provider.substring_fallback
+            for ts_name, ts_provider in ts_providers.get_ts_providers().items()
+        }
+    }
+
+
+def get_binom_keys(binom_campaigns: list) -> dict:
+    """
+    :return: dict of click keys by Binom campaign ids as strings
+    """
+    return {
+        str(binom_campaign.id): binom_campaign.click_key
+        for binom_campaign in binom_campaigns
+        if binom_campaign.click_key
+    }
+
+
+def get_catalog_digest(ts_campaigns: dict) -> str:
+    """
+    :param ts_campaigns: dict of TSCampaign objects by ids
+    :return: digest of the campaigns ids and URLs, whatever order the pages arrived in
+    """
+    return hashlib.sha1('\n'.join(
+        '%s\t%s' % (ts_id, ts_campaigns[ts_id].url or '') for ts_id in sorted(ts_campaigns)
+    ).encode()).hexdigest()
+
+
+def get_url_digest(url) -> str:
+    """
+    :param url: traffic source campaign URL
+    :return: short digest of the URL
+    """
+    return hashlib.blake2b((url or '').encode(), digest_size=8).hexdigest()
+
+
+def get_binom_host(domain: str):
+    """
+    :param domain: Binom tracking domain
+    :return: host the click URLs of the Binom campaigns are parsed with
+    """
+    return (parse_click_url("%s/click.php?key=key" % domain) or (None,))[0]
+
+
+def get_click_key(url, binom_host: str):
+    """
+    :param url: traffic source campaign URL
+    :param binom_host: Binom tracking host
+    :return: click key of a URL to the Binom host, '' for another host, None when the URL can't be parsed
+    """
+    key = parse_click_url(url) if url else None
+
+    if key is None:
+        return None
+
+    return key[1] if key[0] == binom_host else ''
+
+
+def diff_catalog(ts_campaigns: dict, digest: str, previous: dict = None):
+    """
+    Stored form of a traffic source catalog: parallel lists of the campaigns
+    ids, URL digests and click keys.
+
+    :param ts_campaigns: dict of TSCampaign objects by ids
+    :param digest: catalog digest
+    :param previous: stored catalog of the same provider, if any
+    :return: (catalog dict, list of (position, TSCampaign) of the added and URL-changed
+             campaigns whose click keys are left to set_click_keys(), set of removed
+             and changed TS campaign ids)
+    """
+    ids = [str(ts_id) for ts_id in ts_campaigns]
+    url_digests = [get_url_digest(ts_campaign.url) for ts_campaign in ts_campaigns.values()]
+    old_keys = dict(zip(
+        zip(previous['ids'], previous['url_digests']), previous['click_keys']
+    )) if previous else {}
+    click_keys = [old_keys.get(entry, UNPARSED) for entry in zip(ids, url_digests)]
+    changed = [
+        (position, ts_campaign)
+        for position, (click_key, ts_campaign) in enumerate(zip(click_keys, ts_campaigns.values()))
+        if click_key is UNPARSED
+    ]
+    stale = {ids[position] for position, _ in changed}
+
+    if previous:
+        stale.update(set(previous['ids']).difference(ids))
+
+    return {'digest': digest, 'ids': ids, 'url_digests': url_digests, 'click_keys': click_keys}, changed, stale
+
+
+def set_click_keys(catalog: dict, changed: list, binom_host: str, match_index=None):
+    """
+    :param catalog: catalog dict from diff_catalog(), updated in place
+    :param changed: list of (position, TSCampaign) to parse
+    :param binom_host: Binom tracking host
+    :param match_index: TSMatchIndex of the provider, its parsed keys are reused
+    """
+    indexed = {}
+
+    if match_index is not None:
+        for (host, click_key), ts_campaigns in match_index.index.items():
+            indexed.update((str(ts_campaign.id), click_key if host == binom_host else '')
+                           for ts_campaign in ts_campaigns)
+
+        indexed.update((str(ts_campaign.id), None) for ts_campaign in match_index.unparsed)
+
+    ids, click_keys = catalog['ids'], catalog['click_keys']
+
+    for position, ts_campaign in changed:
+        ts_id = ids[position]
+        click_keys[position] = indexed[ts_id] if ts_id in indexed else get_click_key(ts_campaign.url, binom_host)
+
+
+def get_ts_catalogs(snapshot: dict, digests: dict, ts_providers: TSProviders, previous: dict) -> dict:
+    """
+    Traffic sources catalogs to store after a full re-match.
+
+    :param snapshot: settings of this run
+    :param digests: dict of catalog digests by traffic source names
+    :param ts_providers: TSProviders object, the match indexes the matcher built are reused
+    :param previous: traffic sources catalogs of a compatible previous snapshot
+    :return: dict of catalog dicts by traffic source names
+    """
+    binom_host = get_binom_host(snapshot['binom_domain'])
+    catalogs = {}
+
+    for ts_name, ts_campaigns in ts_providers.get_ts_campaigns():
+        old_catalog = previous.get(ts_name)
+
+        if old_catalog is not None and old_catalog['digest'] == digests[ts_name]:
+            catalogs[ts_name] = old_catalog
+            continue
+
+        catalog, changed, _ = diff_catalog(ts_campaigns, digests[ts_name], old_catalog)
+        set_click_keys(catalog, changed, binom_host, ts_providers.get_ts_provider(ts_name).match_index)
+        catalogs[ts_name] = catalog
+
+    return catalogs
+
+
+def is_compatible(previous: dict, snapshot: dict) -> bool:
+    """
+    :return: True when the snapshot was made with the same domain and providers settings
+    """
+    return previous.get('binom_domain') == snapshot['binom_domain'] \
+        and previous.get('substring_fallback') == snapshot['substring_fallback']
+
+
+def add_binom_matches(pairs, changed_binom, snapshot, catalogs, ts_providers):
+    """
+    Add matches of added or key-changed Binom campaigns, as TSMatchIndex.match()
+    would find them.
+
+    :param pairs: pairs dict updated in place
+    :param changed_binom: changed Binom campaign ids
+    :param snapshot: settings and Binom click keys of this run
+    :param catalogs: dict of catalog dicts by traffic source names
+    :param ts_providers: TSProviders object
+    """
+    domain, binom_keys = snapshot['binom_domain'], snapshot['binom']
+    binom_host = get_binom_host(domain)
+    lookups = {}
+
+    for ts_name, catalog in catalogs.items():
+        ts_provider = ts_providers.get_ts_provider(ts_name)
+        by_key, unparsed = {}, []
+
+        for ts_id, click_key in zip(catalog['ids'], catalog['click_keys']):
+            if click_key is None:
+                unparsed.append(ts_id)
+            elif click_key:
+                by_key.setdefault(click_key, []).append(ts_id)
+
+        if ts_provider.substring_fallback and unparsed:
+            ts_campaigns = {str(ts_id): ts_campaign for ts_id, ts_campaign in ts_provider.get_ts_campaigns().items()}
+            unparsed = [(ts_id, ts_campaigns[ts_id].url) for ts_id in unparsed]
+        else:
+            unparsed = []
+
+        lookups[ts_name] = by_key, unparsed
+
+    for camp_id in changed_binom:
+        url = "%s/click.php?key=%s" % (domain, binom_keys[camp_id])
+        key = parse_click_url(url)
+        pairs[camp_id] = {}
+
+        for ts_name, (by_key, unparsed) in lookups.items():
+            ts_ids = list(by_key.get(key[1], ())) if key and key[0] == binom_host else []
+            ts_ids.extend(ts_id for ts_id, ts_url in unparsed if ts_url and url in ts_url)
+
+            if ts_ids:
+                pairs[camp_id][ts_name] = ts_ids
+
+
+def add_ts_matches(pairs, changed_ts, changed_binom, snapshot, catalogs, ts_providers):
+    """
+    Add matches of added or URL-changed traffic sources campaigns.
+
+    :param pairs: pairs dict updated in place
+    :param changed_ts: dict of lists of (position, TSCampaign) by traffic source names, see diff_catalog()
+    :param changed_binom: Binom campaign ids already re-matched
+    :param snapshot: settings and Binom click keys of this run
+    :param catalogs: dict of catalog dicts by traffic source names
+    :param ts_providers: TSProviders object
+    """
+    domain, binom_keys = snapshot['binom_domain'], snapshot['binom']
+    binom_by_key = {}
+
+    for camp_id, click_key in binom_keys.items():
+        if camp_id in changed_binom:
+            continue
+
+        if not PLAIN_CLICK_KEY.match(click_key):
+            parsed = parse_click_url("%s/click.php?key=%s" % (domain, click_key))
+            click_key = parsed[1] if parsed else click_key
+
+        binom_by_key.setdefault(click_key, []).append(camp_id)
+
+    for ts_name, changed in changed_ts.items():
+        substring_fallback = ts_providers.get_ts_provider(ts_name).substring_fallback
+        ids, click_keys = catalogs[ts_name]['ids'], catalogs[ts_name]['click_keys']
+
+        for position, ts_campaign in changed:
+            url, click_key = ts_campaign.url, click_keys[position]
+
+            if click_key is not None:
+                camp_ids = binom_by_key.get(click_key, ()) if click_key else ()
+            elif url and substring_fallback:
+                camp_ids = [
+                    camp_id for camp_id, binom_key in binom_keys.items()
+                    if camp_id not in changed_binom
+                    and "%s/click.php?key=%s" % (domain, binom_key) in url
+                ]
+            else:
+                camp_ids = ()
+
+            for camp_id in camp_ids:
+                pairs.setdefault(camp_id, {}).setdefault(ts_name, []).append(ids[position])
+
+
+def build_matches(binom_campaigns: list, pairs: dict, ts_providers: TSProviders):
+    """
+    :param binom_campaigns: fetched Binom campaigns, the matches keep their order
+    :param pairs: dict of TS campaign ids by traffic source names by Binom campaign ids
+    :param ts_providers: TSProviders object
+    :return: (list of Match objects, matched traffic sources campaigns)
+    """
+    ts_campaigns = {
+        ts_name: {str(ts_id): ts_campaign for ts_id, ts_campaign in campaigns.items()}
+        for ts_name, campaigns in ts_providers.get_ts_campaigns()
+    }
+    matches = []
+    matched_ts_campaigns = {}
+
+    for binom_campaign in binom_campaigns:
+        matched = pairs.get(str(binom_campaign.id))
+
+        if not matched:
+            continue
+
+        match = Match(binom_campaign)
+
+        for ts_name, ts_ids in matched.items():
+            for ts_id in ts_ids:
+                ts_campaign = ts_campaigns[ts_name][ts_id]
+                match.add_ts_campaign(ts_name, ts_campaign)
+                matched_ts_campaigns.setdefault(ts_name, []).append(ts_campaign)
+
+        matches.append(match)
+
+    return matches, matched_ts_campaigns
+
+
+def to_pairs(matches: list) -> dict:
+    """
+    :param matches: list of Match objects
+    :return: dict of TS campaign ids by traffic source names by Binom campaign ids, ids as strings
+    """
+    return {
+        str(match.get_binom_campaign().id): {
+            ts_name: [str(ts_id) for ts_id in ts_campaigns]
+            for ts_name, ts_campaigns in match.get_matched_ts_campaigns()
+            if ts_campaigns
+        }
+        for match in matches
+    }
+
+
+def normalize(pairs: dict) -> dict:
+    """
+    :return: pairs with order-independent TS campaign ids
+    """
+    return {
+        camp_id: {ts_name: frozenset(ts_ids) for ts_name, ts_ids in matched.items() if ts_ids}
+        for camp_id, matched in pairs.items()
+        if any(matched.values())
+    }
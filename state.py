@@ -0,0 +1,110 @@
+"""
+Local state of the costs already pushed to Binom
+Made by @plutus
+"""
+import datetime
+import hashlib
+
+from peewee import CharField, CompositeKey, DateTimeField, FloatField, \
+    IntegerField, Model, SqliteDatabase
+
+from aggregate import round_cost
+
+
+class PushedCost(Model):
+    """
+    Cost last pushed to Binom for given campaign and day
+    """
+    camp_id = IntegerField()
+    date = CharField(max_length=10)
+    cost = FloatField()
+    stats_hash = CharField(max_length=40)
+    updated_at = DateTimeField(default=datetime.datetime.utcnow)
+
+    class Meta:
+        primary_key = CompositeKey('camp_id', 'date')
+
+
+class StateStore:
+    """
+    SQLite store used to skip updates of costs that did not change since the last push
+    """
+    def __init__(self, path: str):
+        """
+        :param path: SQLite database file path
+        """
+        self.database = SqliteDatabase(path, pragmas={'journal_mode': 'wal', 'synchronous': 'normal'})
+        # a model bound to this store only, so several stores (tenants) can live in one process
+        self.model = type('PushedCost', (PushedCost,), {})
+        self.model.bind(self.database)
+        self.database.connect(reuse_if_open=True)
+        # creates the schema on the first run, no-op afterwards
+        self.database.create_tables([self.model], safe=True)
+
+    @staticmethod
+    def hash_stats(stats) -> str:
+        """
+        :param stats: iterable of (ts_name, ts_campaign_id, cost) tuples
+        :return: content hash of the traffic source stats
+        """
+        digest = hashlib.sha1()
+
+        for ts_name, ts_campaign_id, cost in sorted(stats, key=lambda row: (row[0], str(row[1]))):
+            digest.update(('%s:%s:%r;' % (ts_name, ts_campaign_id, float(cost))).encode())
+
+        return digest.hexdigest()
+
+    def get_pushed(self, camp_ids: list, date: str) -> dict:
+        """
+        :param camp_ids: list of Binom campaign IDs
+        :param date: day (YYYY-MM-DD)
+        :return: dict of PushedCost objects by campaign IDs
+        """
+        pushed = {}
+
+        for i in range(0, len(camp_ids), 500):
+            query = self.model.select().where(
+                (self.model.date == date) & (self.model.camp_id.in_(camp_ids[i:i + 500]))
+            )
+            pushed.update((row.camp_id, row) for row in query)
+
+        return pushed
+
+    def is_changed(self, pushed, cost: float, stats_hash: str) -> bool:
+        """
+        :param pushed: PushedCost object or None
+        :param cost: new cost
+        :param stats_hash: new stats hash
+        :return: True when the cost must be pushed again
+        """
+        if pushed is None:
+            return True
+
+        if pushed.stats_hash == stats_hash:
+            return False
+
+        return round_cost(pushed.cost) != round_cost(cost)
+
+    def save(self, rows: list):
+        """
+        :param rows: list of (camp_id, date, cost, stats_hash) tuples
+        """
+        now = datetime.datetime.utcnow()
+
+        with self.database.atomic():
+            for i in range(0, len(rows), 200):
+                self.model.insert_many(
+                    [
+                        {
+                            'camp_id': camp_id,
+                            'date': date,
+                            'cost': cost,
+                            'stats_hash': stats_hash,
+                            'updated_at': now
+                        }
+                        for camp_id, date, cost, stats_hash in rows[i:i + 200]
+                    ]
+                ).on_conflict_replace().execute()
+
+    def close(self):
+        self.database.close()
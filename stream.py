@@ -0,0 +1,130 @@
+"""
+Streaming decoding of large JSON array responses into compact records
+Made by @plutus
+"""
+import codecs
+import json
+from collections import namedtuple
+
+from metrics import get_endpoint, metrics
+
+CHUNK_SIZE = 64 * 1024
+WHITESPACE = ' \t\n\r'
+
+decoder = json.JSONDecoder()
+
+
+def record_type(name: str, fields: list):
+    """
+    :param name: record type name
+    :param fields: kept fields, missing ones default to None
+    :return: namedtuple type
+    """
+    return namedtuple(name, fields, defaults=(None,) * len(fields))
+
+
+def iter_text(response, chunk_size: int = CHUNK_SIZE):
+    """
+    :param response: requests response opened with stream=True
+    :param chunk_size: read size in bytes
+    :return: generator of decoded text chunks
+    """
+    text_decoder = codecs.getincrementaldecoder(response.encoding or 'utf-8')(errors='replace')
+    received = 0
+
+    try:
+        for chunk in response.iter_content(chunk_size):
+            received += len(chunk)
+            text = text_decoder.decode(chunk)
+            if text:
+                yield text
+    finally:
+        metrics.inc('http_received_bytes_total', received, endpoint=get_endpoint(response.url))
+
+    text = text_decoder.decode(b'', final=True)
+    if text:
+        yield text
+
+
+def iter_json_array(chunks):
+    """
+    Decode elements of a top level JSON array one by one.
+
+    :param chunks: iterable of text chunks
+    :return: generator of decoded elements
+    """
+    chunks = iter(chunks)
+    buffer = ''
+    position = 0
+
+    def skip_whitespace():
+        nonlocal buffer, position
+        while True:
+            while position < len(buffer) and buffer[position] in WHITESPACE:
+                position += 1
+            if position < len(buffer):
+                return True
+            buffer, position = next(chunks, ''), 0
+            if not buffer:
+                return False
+
+    if not skip_whitespace():
+        return
+
+    if buffer[position] != '[':
+        # read what the message shows, not the rest of the body
+        text = buffer[position:]
+        while len(text) < 500:
+            chunk = next(chunks, '')
+            if not chunk:
+                break
+            text += chunk
+        raise Exception('Unexpected response: %s' % text[:500])
+
+    position += 1
+
+    while skip_whitespace():
+        if buffer[position] == ']':
+            return
+
+        if buffer[position] == ',':
+            position += 1
+            continue
+
+        while True:
+            try:
+                element, end = decoder.raw_decode(buffer, position)
+            except ValueError:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    raise
+                buffer = buffer[position:] + chunk
+                position = 0
+                continue
+
+            # a number may continue in the next chunk
+            if isinstance(element, (int, float)) and \
+                    (end == len(buffer) or buffer[end] not in ',]' + WHITESPACE):
+                chunk = next(chunks, None)
+                if chunk is not None:
+                    buffer = buffer[position:] + chunk
+                    position = 0
+                    continue
+
+            position = end
+            yield element
+            break
+
+    raise ValueError('Unterminated JSON array')
+
+
+def iter_records(chunks, record: type):
+    """
+    :param chunks: iterable of text chunks of a JSON array of objects
+    :param record: record type from record_type()
+    :return: generator of records
+    """
+    fields = record._fields
+
+    for row in iter_json_array(chunks):
+        yield record(*[row.get(field) for field in fields])
@@ -5,14 +5,112 @@ Made by @plutus
 
 import datetime
 import logging
+from bisect import bisect_left
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
-import pytz
-
-from binom import Binom
-from config import config
+from aggregate import CostAggregator, CostTolerance, MatchColumns, round_cost
+from binom import Binom, BinomCampaign, CostItem
+from cache import CatalogCache
+from config import Config
+from journal import JournalItem, RunJournal
 from match import match_campaigns
+from metrics import metrics
 from provider import get_ts_providers
+from reconcile import compute_deltas, sort_deltas
+from shard import Sharder
+from snapshot import MatchSnapshot
+from state import StateStore
 from traffic_source import TSProviders
+from transport import Transport, TransportPool
+
+# token_value None stands for the whole campaign
+CostUpdate = namedtuple(
+    'CostUpdate',
+    ['binom_campaign', 'cost', 'day', 'stats_hash', 'token_value'],
+    defaults=(None,)
+)
+
+
+class SyncSummary:
+    """
+    Collects per-campaign update results of a single sync run
+    """
+
+    def __init__(self):
+        self.updated = []
+        self.failed = []
+        self.skipped = []
+        self.suppressed = []
+        self.warnings = []
+
+    def add_result(self, binom_campaign, real_cost: float, date, response):
+        """
+        :param binom_campaign: Binom campaign object
+        :param real_cost: cost that was sent
+        :param date: updated date
+        :param response: Binom response object
+        """
+        if hasattr(
+                response,
+                'update_status'
+        ) and bool(response.update_status) is True:
+            self.updated.append((binom_campaign.id, real_cost, date))
+        else:
+            self.failed.append((binom_campaign.id, real_cost, date, 'update rejected'))
+
+        if hasattr(response, 'warning'):
+            self.warnings.extend(
+                'Binom Campaign(camp_id=%s): %s' % (binom_campaign.id, warning)
+                for warning in response.warning
+            )
+
+    def add_error(self, binom_campaign, real_cost: float, date, error: Exception):
+        """
+        :param binom_campaign: Binom campaign object
+        :param real_cost: cost that was sent
+        :param date: updated date
+        :param error: exception raised while updating
+        """
+        self.failed.append((binom_campaign.id, real_cost, date, repr(error)))
+
+    def add_skipped(self, binom_campaign, real_cost: float, date):
+        """
+        :param binom_campaign: Binom campaign object
+        :param real_cost: cost that was not sent
+        :param date: skipped date
+        """
+        self.skipped.append((binom_campaign.id, real_cost, date))
+
+    def add_suppressed(self, binom_campaign, real_cost: float, date, current_cost: float):
+        """
+        :param binom_campaign: Binom campaign object
+        :param real_cost: cost that was not sent
+        :param date: skipped date
+        :param current_cost: cost it is within tolerance of
+        """
+        self.suppressed.append((binom_campaign.id, real_cost, date, current_cost))
+
+    def report(self):
+        """
+        :return: list of report lines
+        """
+        lines = [
+            'Updated Binom Campaign(camp_id=%s, cost=%s, date=%s)' % (camp_id, cost, date)
+            for camp_id, cost, date in sorted(self.updated, key=lambda row: (str(row[2]), row[0]))
+        ]
+        lines.extend(
+            'Failed Binom Campaign(camp_id=%s, cost=%s, date=%s): %s' % (camp_id, cost, date, error)
+            for camp_id, cost, date, error in sorted(self.failed, key=lambda row: (str(row[2]), row[0]))
+        )
+
+        if self.warnings:
+            lines.append('Warning(s): %s' % "\n".join(self.warnings))
+
+        lines.append('Summary: %d updated, %d unchanged, %d within tolerance, %d failed, %d warning(s)' % (
+            len(self.updated), len(self.skipped), len(self.suppressed), len(self.failed), len(self.warnings)))
+
+        return lines
 
 
 class CostSynchronizer:
@@ -20,106 +118,687 @@ class CostSynchronizer:
     Core class used to handle cost synchronization
     """
 
-    def __init__(self, binom: Binom, timezone: int, ts_providers: TSProviders, yesterday):
+    def __init__(
+            self,
+            binom: Binom,
+            timezone: int,
+            ts_providers: TSProviders,
+            yesterday,
+            update_concurrency: int = 1,
+            update_batch_size: int = 100,
+            state_store: StateStore = None,
+            provider_timeout: float = None,
+            tenant: str = None,
+            tolerance: CostTolerance = None,
+            tolerance_source: str = 'state',
+            token_number: int = 0,
+            token: str = 'zone_id',
+            token_chunk_size: int = 100,
+            journal: RunJournal = None,
+            match_snapshot: MatchSnapshot = None,
+            fx_rates: dict = None,
+            sharder: Sharder = None
+    ):
         self.binom = binom
         self.timezone = timezone
         self.ts_providers = ts_providers
         self.costs_by_ts = {}
+        self.costs_errors = {}
+        self.matches = None
+        self.match_columns = None
         self.matched_ts_campaigns = {}
         self.yesterday = yesterday
+        self.update_concurrency = max(1, update_concurrency)
+        self.update_batch_size = max(1, update_batch_size)
+        self.state_store = state_store
+        self.provider_timeout = provider_timeout
+        self.tenant = tenant
+        self.tolerance = tolerance if tolerance else None
+        self.tolerance_source = tolerance_source
+        self.token_number = token_number
+        self.token = token
+        self.token_chunk_size = max(1, token_chunk_size)
+        self.journal = journal
+        self.match_snapshot = match_snapshot
+        self.fx_rates = fx_rates if fx_rates else {}
+        self.sharder = sharder
+        self.summary = SyncSummary()
 
     def sync(self):
         """
         Fetch Binom campaigns, match them with traffic sources campaigns and sync costs.
         """
+        if self.token_number:
+            return self.sync_tokens(self.yesterday.date(), self.yesterday.date())
 
-        matches, matched_ts_campaigns = match_campaigns(self.binom, self.ts_providers)
+        self.resume()
+        self.get_matches()
 
-        self.matched_ts_campaigns = matched_ts_campaigns
+        with metrics.span('fetch_costs'):
+            self.fetch_costs()
 
-        for match in matches:
-            binom_campaign = match.get_binom_campaign()
-            real_cost = 0.0
+        with metrics.span('aggregate'):
+            skipped = self.skip_failed_providers(self.costs_errors)
+            updates = [
+                CostUpdate(binom_campaign, real_cost, None, stats_hash)
+                for binom_campaign, real_cost, stats_hash in self.sum_costs(self.costs_by_ts, skipped)
+            ]
 
-            for ts_name, ts_campaigns in match.get_matched_ts_campaigns():
-                self.fetch_cost(ts_name=ts_name)
-                for ts_campaign in ts_campaigns.values():
-                    if ts_campaign.cost:
-                        real_cost += float(ts_campaign.cost)
+        with metrics.span('update'):
+            self.update_costs(updates)
 
-            # skip zeros
-            if not real_cost:
+        self.complete_journal()
+
+        return self.report()
+
+    def sync_range(self, date_from: datetime.date, date_to: datetime.date):
+        """
+        Backfill costs day by day for the given dates range.
+
+        Campaigns are fetched and matched once, statistics are fetched once
+        for the whole range grouped by campaign and day.
+
+        :param date_from: first day to sync
+        :param date_to: last day to sync (inclusive)
+        """
+        check_dates(date_from, date_to)
+
+        if self.token_number:
+            return self.sync_tokens(date_from, date_to)
+
+        self.resume()
+        self.get_matches()
+
+        with metrics.span('fetch_costs'):
+            costs_by_day, errors = self.fetch_daily_costs(date_from, date_to)
+
+        with metrics.span('aggregate'):
+            skipped = self.skip_failed_providers(errors)
+            updates = []
+
+            for day in iter_days(date_from, date_to):
+                updates.extend(
+                    CostUpdate(binom_campaign, real_cost, day, stats_hash)
+                    for binom_campaign, real_cost, stats_hash in
+                    self.sum_costs(costs_by_day.get(str(day), {}), skipped)
+                )
+
+        with metrics.span('update'):
+            self.update_costs(updates)
+
+        self.complete_journal()
+
+        return self.report()
+
+    def sync_tokens(self, date_from: datetime.date, date_to: datetime.date):
+        """
+        Push costs per value of Binom token token_number (e.g. per zone) instead of per campaign.
+
+        Binom campaigns are handled token_chunk_size at a time: the statistics of
+        their traffic sources campaigns are streamed, summed per (campaign, day,
+        token value), pushed and dropped, so memory does not grow with the
+        number of zones.
+
+        :param date_from: first day to sync
+        :param date_to: last day to sync (inclusive)
+        """
+        self.resume()
+        self.get_matches()
+
+        for start in range(0, len(self.match_columns.binom_campaigns), self.token_chunk_size):
+            with metrics.span('fetch_costs'):
+                updates = self.fetch_token_costs(start, start + self.token_chunk_size, date_from, date_to)
+
+            with metrics.span('update'):
+                self.update_costs(updates)
+
+        self.complete_journal()
+
+        return self.report()
+
+    def fetch_token_costs(
+            self,
+            start: int,
+            stop: int,
+            date_from: datetime.date,
+            date_to: datetime.date
+    ):
+        """
+        :param start: first Binom campaign position of the chunk
+        :param stop: position after the last one
+        :param date_from: first day
+        :param date_to: last day (inclusive)
+        :return: list of CostUpdate objects with a token value, skipping zeros
+        """
+        if self.sharder is not None:
+            aggregator = self.sharder.create_aggregator(
+                self.binom.get_tracking_domain(), self.match_columns.binom_campaigns)
+        else:
+            aggregator = CostAggregator()
+
+        skipped = set()
+
+        for ts_name, (binom_positions, ts_campaign_ids) in self.match_columns.columns.items():
+            # positions are ascending, the chunk is a slice of the column
+            first, last = bisect_left(binom_positions, start), bisect_left(binom_positions, stop)
+
+            if first == last:
                 continue
 
-            self.update_cost(binom_campaign, real_cost)
+            owners = {}
+            capabilities = self.ts_providers.get_ts_provider(ts_name).capabilities
+            source = aggregator.add_source(
+                self.fx_rates.get(ts_name, 1.0),
+                None if capabilities.supports_timezone else self.timezone
+            )
+
+            for position, ts_campaign_id in zip(binom_positions[first:last], ts_campaign_ids[first:last]):
+                owners.setdefault(ts_campaign_id, []).append(position)
+
+            try:
+                for ts_campaign_id, day, token_value, cost in \
+                        self.ts_providers.iter_token_costs(
+                            ts_name,
+                            list(owners),
+                            date_from="%s 00:00:00" % date_from,
+                            date_to="%s 23:59:59" % date_to,
+                            timezone=self.timezone,
+                            token=self.token
+                        ):
+                    if token_value is None or not cost:
+                        continue
+
+                    for position in owners.get(ts_campaign_id, ()):
+                        aggregator.add(source, position, day, str(token_value), cost)
+            except Exception as error:
+                skipped.update(binom_positions[first:last])
+                self.summary.warnings.append(
+                    'Fetching %s costs by %s failed, Binom campaigns matched with it are skipped: %r'
+                    % (ts_name, self.token, error))
 
-    def fetch_cost(self, ts_name: str):
+        return [
+            CostUpdate(
+                self.match_columns.binom_campaigns[position],
+                round_cost(cost),
+                datetime.date.fromisoformat(day),
+                None,
+                token_value
+            )
+            for (position, day, token_value), cost in sorted(aggregator.reduce().items())
+            if position not in skipped and round_cost(cost)
+        ]
+
+    def dry_run(self, date_from: datetime.date = None, date_to: datetime.date = None):
         """
-        Fetch campaigns cost and store it in the TSProvider items
+        Compare traffic sources costs with the current Binom costs without updating anything.
 
-        :param ts_name: traffic source name
+        :param date_from: first day to compare, yesterday only when not given
+        :param date_to: last day to compare (inclusive)
+        :return: list of CostDelta objects sorted by descending absolute delta
         """
+        if date_from is not None:
+            check_dates(date_from, date_to)
 
-        ts_provider = self.ts_providers.get_ts_provider(ts_name)
+        self.get_matches()
 
-        if ts_name not in self.costs_by_ts.keys():
-            self.costs_by_ts[ts_name] = ts_provider.get_cost(
-                [
-                    matched_campaign.id for ts_name, matched_campaigns in
-                    self.matched_ts_campaigns.items()
-                    for matched_campaign in matched_campaigns
-                ],
-                date_from="%s 00:00:00" % self.yesterday.date(),
-                date_to="%s 23:59:59" % self.yesterday.date(),
-                timezone=self.timezone
+        with metrics.span('fetch_costs'):
+            if date_from is None:
+                self.fetch_costs()
+                days = [self.yesterday.date()]
+                costs_by_day, errors = {str(days[0]): self.costs_by_ts}, self.costs_errors
+            else:
+                days = list(iter_days(date_from, date_to))
+                costs_by_day, errors = self.fetch_daily_costs(date_from, date_to)
+
+            with ThreadPoolExecutor(max_workers=min(self.update_concurrency, len(days))) as executor:
+                binom_costs = list(executor.map(
+                    lambda day: self.binom.get_costs(day, self.timezone), days))
+
+        with metrics.span('aggregate'):
+            skipped = self.skip_failed_providers(errors)
+            deltas = []
+
+            for day, day_binom_costs in zip(days, binom_costs):
+                totals, _ = self.match_columns.sum_costs(costs_by_day.get(str(day), {}), fx_rates=self.fx_rates)
+                deltas.extend(compute_deltas(
+                    self.match_columns.binom_campaigns, totals, day_binom_costs, day, skipped))
+
+        return sort_deltas(deltas)
+
+    def resume(self):
+        """
+        Push the updates an interrupted run planned but did not get acknowledged.
+        """
+        if self.journal is None:
+            return
+
+        updates = []
+
+        for item in self.journal.get_pending():
+            if item.token_value is not None and not self.token_number:
+                self.summary.warnings.append(
+                    'Journal update of Binom Campaign(camp_id=%s, %s=%s) skipped, token costs are disabled'
+                    % (item.camp_id, self.token, item.token_value))
+                continue
+
+            updates.append(CostUpdate(
+                BinomCampaign(id=item.camp_id),
+                item.cost,
+                datetime.date.fromisoformat(item.day),
+                item.stats_hash,
+                item.token_value
+            ))
+
+        if updates:
+            logging.info('Resuming %d update(s) of an interrupted run', len(updates))
+            metrics.inc('sync_resumed_updates_total', len(updates))
+
+            with metrics.span('resume'):
+                self.update_costs(updates)
+
+    def complete_journal(self):
+        """
+        Mark the run as complete, the next one will not resume anything.
+        """
+        if self.journal is not None:
+            self.journal.complete()
+
+    def close(self):
+        """
+        Close the state store and the journal files.
+        """
+        if self.state_store is not None:
+            self.state_store.close()
+
+        if self.journal is not None:
+            self.journal.close()
+
+    def reset(self, catalogs: bool = False):
+        """
+        Prepare the synchronizer for the next run, keeping its HTTP sessions.
+
+        :param catalogs: drop campaigns and matches too, not only costs
+        """
+        self.costs_by_ts = {}
+        self.costs_errors = {}
+        self.summary = SyncSummary()
+
+        if catalogs:
+            self.matches = None
+            self.match_columns = None
+            self.matched_ts_campaigns = {}
+            self.ts_providers.reset()
+
+    def get_matches(self):
+        """
+        Match Binom campaigns with traffic sources campaigns once per synchronizer.
+
+        :return: list of Match objects
+        """
+        if self.matches is None:
+            # sharded matching parses URLs in its processes, without the providers indexes
+            matcher = self.sharder.match if self.sharder is not None else match_campaigns
+            # the snapshot matches changed campaigns against its stored keys, a full
+            # re-match builds the indexes it needs on first use
+            build_indexes = self.sharder is None and self.match_snapshot is None
+
+            with metrics.span('fetch_catalogs'):
+                self.ts_providers.fetch_ts_campaigns(self.provider_timeout, build_indexes=build_indexes)
+                binom_campaigns = list(self.binom.get_all_campaigns())
+
+            if build_indexes:
+                with metrics.span('build_index'):
+                    self.ts_providers.build_match_indexes()
+
+            with metrics.span('match'):
+                if self.match_snapshot is not None:
+                    self.matches, self.matched_ts_campaigns = self.match_snapshot.match(
+                        self.binom, self.ts_providers, binom_campaigns, matcher)
+                else:
+                    self.matches, self.matched_ts_campaigns = matcher(
+                        self.binom, self.ts_providers, binom_campaigns)
+
+                self.match_columns = MatchColumns(self.matches)
+
+            metrics.inc('sync_binom_campaigns_total', len(binom_campaigns))
+            metrics.inc('sync_matched_campaigns_total', len(self.matches))
+            metrics.inc('sync_matched_pairs_total', len(self.match_columns))
+
+        return self.matches
+
+    def get_matched_ids(self):
+        """
+        :return: dict of de-duplicated matched campaigns ids by traffic source names
+        """
+        return {
+            ts_name: list(dict.fromkeys(
+                matched_campaign.id for matched_campaign in matched_campaigns
+            ))
+            for ts_name, matched_campaigns in self.matched_ts_campaigns.items()
+        }
+
+    def skip_failed_providers(self, errors: dict):
+        """
+        Campaigns matched with a provider whose costs failed would get a partial cost.
+
+        :param errors: dict of exceptions by traffic source names
+        :return: set of Binom campaigns positions to skip
+        """
+        skipped = self.match_columns.get_positions(errors.keys())
+
+        for ts_name, error in errors.items():
+            self.summary.warnings.append(
+                'Fetching %s costs failed, Binom campaigns matched with it are skipped: %r'
+                % (ts_name, error))
+
+        return skipped
+
+    def sum_costs(self, costs_by_ts: dict, skipped: set = frozenset()):
+        """
+        :param costs_by_ts: dict of costs by campaign ids grouped by traffic sources
+        :param skipped: Binom campaigns positions to leave out
+        :return: generator of (Binom campaign object, rounded real cost, stats hash) skipping zeros,
+                 stats hash is None without state store
+        """
+        totals, stats = self.match_columns.sum_costs(
+            costs_by_ts,
+            with_stats=self.state_store is not None,
+            fx_rates=self.fx_rates
+        )
+
+        for position, real_cost in enumerate(map(round_cost, totals)):
+            # skip zeros
+            if not real_cost or position in skipped:
+                continue
+
+            yield (
+                self.match_columns.binom_campaigns[position],
+                real_cost,
+                StateStore.hash_stats(stats[position]) if stats else None
             )
 
-    def update_cost(self, binom_campaign, real_cost: float):
+    def report(self):
         """
-        Update Binom campaign cost
+        Log and print the summary of the run, tenants runs are only logged.
 
-        :param binom_campaign: Binom campaign object
-        :param real_cost: new cost that will be applied
+        :return: SyncSummary object
+        """
+        labels = {'tenant': self.tenant} if self.tenant else {}
+
+        for line in self.summary.report():
+            if self.tenant:
+                logging.info('[%s] %s', self.tenant, line)
+            else:
+                logging.info(line)
+                print(line)
+
+        for status, rows in (
+                ('updated', self.summary.updated),
+                ('unchanged', self.summary.skipped),
+                ('suppressed', self.summary.suppressed),
+                ('failed', self.summary.failed)
+        ):
+            metrics.inc('sync_updates_total', len(rows), status=status, **labels)
+
+        return self.summary
+
+    def fetch_costs(self):
+        """
+        Fetch yesterday costs of all traffic sources concurrently
         """
-        response = self.binom.update_cost(
-            camp_id=binom_campaign.id,
-            cost_type=Binom.COST_TYPE_FULL,
-            date=Binom.DATE_YESTERDAY,
+        self.costs_by_ts, self.costs_errors = self.ts_providers.fetch_costs(
+            self.get_matched_ids(),
+            date_from="%s 00:00:00" % self.yesterday.date(),
+            date_to="%s 23:59:59" % self.yesterday.date(),
             timezone=self.timezone,
-            cost=real_cost
+            timeout=self.provider_timeout
         )
 
-        if hasattr(
-                response,
-                'update_status'
-        ) and bool(response.update_status) is True:
-            info_msg = 'Updated Binom Campaign(camp_id=%s, cost=%s, date=%s)' \
-                       % (binom_campaign.id, real_cost, self.yesterday.date())
-            logging.info(info_msg)
-            print(info_msg)
+    def fetch_daily_costs(self, date_from: datetime.date, date_to: datetime.date):
+        """
+        Fetch costs of all traffic sources for the dates range grouped by day.
 
-        if hasattr(response, 'warning'):
-            print('Warning(s): %s' % "\n".join(response.warning))
+        :param date_from: first day
+        :param date_to: last day (inclusive)
+        :return: (dict of costs_by_ts by day (YYYY-MM-DD), dict of exceptions by traffic source names)
+        """
+        daily_costs_by_ts, errors = self.ts_providers.fetch_costs(
+            self.get_matched_ids(),
+            date_from="%s 00:00:00" % date_from,
+            date_to="%s 23:59:59" % date_to,
+            timezone=self.timezone,
+            daily=True,
+            timeout=self.provider_timeout
+        )
+        costs_by_day = {}
 
+        for ts_name, daily_costs in daily_costs_by_ts.items():
+            for day, costs in daily_costs.items():
+                costs_by_day.setdefault(day, {})[ts_name] = costs
 
-if __name__ == "__main__":
-    logging.basicConfig(
-        filename='update.log',
-        level=logging.INFO,
-        format='%(asctime)s %(message)s',
-        datefmt='%m/%d/%Y %H:%M:%S'
+        return costs_by_day, errors
+
+    def skip_unchanged(self, updates: list):
+        """
+        Drop updates whose cost was already pushed according to the state store,
+        or is within the tolerance of the current cost (last pushed one, or the
+        Binom one read in bulk when tolerance_source is 'binom').
+
+        :param updates: list of CostUpdate objects
+        :return: list of CostUpdate objects to push
+        """
+        read_binom = self.tolerance is not None and self.tolerance_source == 'binom'
+
+        # both the state and the Binom costs are kept per campaign, not per token
+        if (self.state_store is None and not read_binom) or self.token_number:
+            return updates
+
+        changed = []
+        updates_by_day = {}
+
+        for update in updates:
+            updates_by_day.setdefault(self.get_day(update), []).append(update)
+
+        for day, day_updates in updates_by_day.items():
+            pushed = {} if self.state_store is None else self.state_store.get_pushed(
+                [int(update.binom_campaign.id) for update in day_updates], str(day))
+            binom_costs = self.binom.get_costs(day, self.timezone) if read_binom else {}
+
+            for update in day_updates:
+                # Binom serves the IDs as strings, the state store keeps integers
+                last_pushed = pushed.get(int(update.binom_campaign.id))
+
+                if self.state_store is not None and not self.state_store.is_changed(
+                        last_pushed,
+                        update.cost,
+                        update.stats_hash
+                ):
+                    self.summary.add_skipped(update.binom_campaign, update.cost, day)
+                    continue
+
+                if read_binom:
+                    current = binom_costs.get(int(update.binom_campaign.id))
+                else:
+                    current = last_pushed.cost if last_pushed is not None else None
+
+                if self.tolerance is not None and self.tolerance.is_within(current, update.cost):
+                    self.summary.add_suppressed(update.binom_campaign, update.cost, day, current)
+                else:
+                    changed.append(update)
+
+        return changed
+
+    def get_day(self, update: CostUpdate):
+        """
+        :param update: CostUpdate object
+        :return: updated day
+        """
+        return update.day if update.day else self.yesterday.date()
+
+    def update_costs(self, updates: list):
+        """
+        Update Binom campaigns costs, update_batch_size of them submitted ahead
+
+        :param updates: list of CostUpdate objects, day None stands for yesterday
+        """
+        updates = {
+            (update.binom_campaign.id, update.day, update.token_value): update
+            for update in self.skip_unchanged(updates)
+        }
+        pushed = []
+
+        if self.journal is not None:
+            self.journal.plan([
+                JournalItem(camp_id, str(self.get_day(update)), update.cost, token_value, update.stats_hash)
+                for (camp_id, day, token_value), update in updates.items()
+            ])
+
+        for item, response, error in self.binom.update_costs(
+                [
+                    CostItem(camp_id, day, update.cost, token_value)
+                    for (camp_id, day, token_value), update in updates.items()
+                ],
+                self.timezone,
+                batch_size=self.update_batch_size,
+                concurrency=self.update_concurrency,
+                token_number=self.token_number
+        ):
+            update = updates[(item.camp_id, item.day, item.token_value)]
+            day = self.get_day(update)
+            label = day if update.token_value is None else '%s %s=%s' % (day, self.token, update.token_value)
+
+            if error is not None:
+                self.summary.add_error(update.binom_campaign, update.cost, label, error)
+                continue
+
+            self.summary.add_result(update.binom_campaign, update.cost, label, response)
+
+            if not hasattr(response, 'update_status') or not bool(response.update_status):
+                continue
+
+            if self.journal is not None:
+                self.journal.ack(update.binom_campaign.id, str(day), update.token_value)
+
+            if update.token_value is None:
+                pushed.append((update.binom_campaign.id, str(day), update.cost, update.stats_hash))
+
+        if self.state_store is not None and pushed:
+            self.state_store.save(pushed)
+
+
+def check_dates(date_from: datetime.date, date_to: datetime.date):
+    """
+    :param date_from: first day
+    :param date_to: last day (inclusive)
+    """
+    if date_from > date_to:
+        raise Exception('First day %s is after the last day %s' % (date_from, date_to))
+
+
+def iter_days(date_from: datetime.date, date_to: datetime.date):
+    """
+    :param date_from: first day
+    :param date_to: last day (inclusive)
+    :return: generator of days
+    """
+    day = date_from
+
+    while day <= date_to:
+        yield day
+        day += datetime.timedelta(days=1)
+
+
+def create_cache(config: Config):
+    """
+    :param config: Config object
+    :return: CatalogCache object or None when caching is disabled
+    """
+    if not config.get('CACHE_DIR'):
+        return None
+
+    return CatalogCache(
+        config.get('CACHE_DIR'),
+        ttl=int(config.get('CACHE_TTL')),
+        max_entries=int(config.get('CACHE_MAX_ENTRIES'))
     )
 
-    binom = Binom(config.get('BINOM_DOMAIN').rstrip('/'), config.get('BINOM_API_KEY'))
+
+def create_synchronizer(
+        config: Config,
+        cache: CatalogCache = None,
+        force: bool = False,
+        transports: TransportPool = None,
+        tenant: str = None,
+        rebuild_matches: bool = False
+) -> CostSynchronizer:
+    """
+    :param config: Config object
+    :param cache: CatalogCache shared by the API clients
+    :param force: push every cost, without the state store
+    :param transports: TransportPool shared between tenants, own transports when not given
+    :param tenant: tenant name of a multi-tenant run
+    :param rebuild_matches: re-match every campaign instead of updating the match snapshot
+    :return: CostSynchronizer object
+    """
+    update_concurrency = int(config.get('UPDATE_CONCURRENCY'))
+    binom_domain = config.get('BINOM_DOMAIN').rstrip('/')
+
+    if transports is not None:
+        transport = transports.get(binom_domain, 'BINOM_RATE_LIMIT', pool_size=update_concurrency)
+    else:
+        transport = Transport.from_config(config, 'BINOM_RATE_LIMIT', pool_size=update_concurrency)
+
+    binom = Binom(binom_domain, config.get('BINOM_API_KEY'), cache=cache, transport=transport)
+    tolerance_source = config.get('UPDATE_TOLERANCE_SOURCE')
+
+    if tolerance_source not in ('state', 'binom'):
+        raise Exception('CS_UPDATE_TOLERANCE_SOURCE must be state or binom, got %r' % tolerance_source)
+
     timezone = int(config.get('TIMEZONE'))
-    today = datetime.datetime.now(pytz.utc) + datetime.timedelta(hours=timezone)
+    today = datetime.datetime.now(datetime.timezone(datetime.timedelta(hours=timezone)))
     # script executes after midnight, we need yesterday date
     yesterday = today + datetime.timedelta(days=-1)
 
-    synchronizer = CostSynchronizer(
+    ts_providers = get_ts_providers(config, cache, transports)
+
+    return CostSynchronizer(
         binom,
         timezone,
-        get_ts_providers(config),
-        yesterday
+        ts_providers,
+        yesterday,
+        update_concurrency=update_concurrency,
+        update_batch_size=int(config.get('UPDATE_BATCH_SIZE')),
+        state_store=None if force or not config.get('STATE_DB')
+        else StateStore(config.get('STATE_DB')),
+        provider_timeout=float(config.get('PROVIDER_TIMEOUT')),
+        tenant=tenant,
+        tolerance=CostTolerance(
+            config.get('UPDATE_TOLERANCE_ABS'),
+            config.get('UPDATE_TOLERANCE_REL')
+        ),
+        tolerance_source=tolerance_source,
+        token_number=int(config.get('TOKEN_NUMBER')),
+        token=config.get('TOKEN_FIELD'),
+        token_chunk_size=int(config.get('TOKEN_CHUNK_SIZE')),
+        journal=RunJournal(config.get('JOURNAL'), int(config.get('JOURNAL_FSYNC_EVERY')))
+        if config.get('JOURNAL') else None,
+        match_snapshot=MatchSnapshot(
+            config.get('MATCH_SNAPSHOT'),
+            max_churn=float(config.get('MATCH_SNAPSHOT_MAX_CHURN')),
+            check=config.get('MATCH_SNAPSHOT_CHECK') == '1',
+            rebuild=rebuild_matches
+        ) if config.get('MATCH_SNAPSHOT') else None,
+        fx_rates={
+            ts_name: float(config.get('%s_FX_RATE' % ts_name.upper()) or 1)
+            for ts_name in ts_providers.get_ts_providers()
+        },
+        sharder=Sharder(int(config.get('SHARDS'))) if int(config.get('SHARDS')) > 1 else None
     )
-    synchronizer.sync()
+
+
+if __name__ == "__main__":
+    import sys
+
+    from cli import main
+
+    main(['sync'] + sys.argv[1:])
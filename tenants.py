@@ -0,0 +1,260 @@
+"""
+Multi-tenant mode: syncs many Binom trackers and traffic sources accounts from one process
+Made by @plutus
+"""
+import datetime
+import json
+import logging
+import os
+import re
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import CatalogCache
+from config import Config
+from metrics import metrics
+from sync import create_synchronizer
+from transport import TransportPool
+
+TenantResult = namedtuple('TenantResult', ['name', 'summary', 'error', 'seconds'])
+
+TENANT_NAME = re.compile(r'^[\w.-]+$')
+
+# files a tenant must not share with another one, suffixed with the tenant name by default
+PER_TENANT_FILES = ('STATE_DB', 'JOURNAL', 'MATCH_SNAPSHOT')
+
+
+def load_tenants(path: str, base: Config) -> list:
+    """
+    Read the tenants file:
+
+        {
+            "concurrency": 4,
+            "defaults": {"TIMEZONE": 1},
+            "tenants": [
+                {"name": "tracker-1", "BINOM_DOMAIN": "...", "BINOM_API_KEY": "...",
+                 "PROPELLER_ADS_API_KEY": "..."}
+            ]
+        }
+
+    Tenant keys are the config keys without the CS_ prefix, missing ones come from
+    "defaults" and then from the environment. Each tenant gets its own state
+    database and journal unless STATE_DB / JOURNAL are given.
+
+    :param path: JSON file path
+    :param base: Config object the tenants inherit from
+    :return: list of (tenant name, Config object)
+    """
+    with open(path) as file:
+        data = json.load(file)
+
+    defaults = normalize_keys(data.get('defaults', {}), base)
+    tenants = []
+    files = {}
+
+    for row in data.get('tenants', []):
+        row = dict(row)
+        name = str(row.pop('name', ''))
+
+        if not TENANT_NAME.match(name):
+            raise Exception('Invalid tenant name %r in %s' % (name, path))
+
+        if any(name == tenant for tenant, _ in tenants):
+            raise Exception('Duplicate tenant %r in %s' % (name, path))
+
+        values = {**base.config, **defaults, **normalize_keys(row, base)}
+
+        for key in PER_TENANT_FILES:
+            if key not in row and key.lower() not in row and values.get(key):
+                root, ext = os.path.splitext(values[key])
+                values[key] = '%s-%s%s' % (root, name, ext)
+
+            if values.get(key):
+                if values[key] in files:
+                    raise Exception('Tenants %r and %r share the file %s' % (files[values[key]], name, values[key]))
+                files[values[key]] = name
+
+        tenants.append((name, Config(values)))
+
+    return tenants
+
+
+def normalize_keys(values: dict, base: Config) -> dict:
+    """
+    :param values: tenant config values
+    :param base: Config object defining the known keys
+    :return: dict of string values by config keys
+    """
+    normalized = {}
+
+    for key, value in values.items():
+        key = key.upper()
+        key = key[3:] if key.startswith('CS_') else key
+
+        if key not in base.config:
+            raise Exception('Unknown tenant config key %s' % key)
+
+        normalized[key] = '' if value is None else str(value)
+
+    return normalized
+
+
+class TenantsRunner:
+    """
+    Runs the CostSynchronizer pipeline of every tenant with a bounded number of
+    tenants in flight. Transports are shared per API host, a failing tenant
+    does not stop the others.
+    """
+
+    def __init__(
+            self,
+            tenants: list,
+            transports: TransportPool,
+            cache: CatalogCache = None,
+            concurrency: int = 4,
+            force: bool = False,
+            rebuild_matches: bool = False
+    ):
+        """
+        :param tenants: list of (tenant name, Config object)
+        :param transports: TransportPool shared by all tenants
+        :param cache: CatalogCache shared by all tenants
+        :param concurrency: max number of tenants synced at once
+        :param force: push every cost, without the state store
+        :param rebuild_matches: re-match every campaign instead of updating the match snapshots
+        """
+        self.tenants = tenants
+        self.transports = transports
+        self.cache = cache
+        self.concurrency = max(1, concurrency)
+        self.force = force
+        self.rebuild_matches = rebuild_matches
+
+    @classmethod
+    def from_file(
+            cls,
+            path: str,
+            config: Config,
+            cache: CatalogCache = None,
+            force: bool = False,
+            rebuild_matches: bool = False
+    ):
+        """
+        :param path: tenants JSON file path
+        :param config: Config object the tenants inherit from
+        :param cache: CatalogCache shared by all tenants
+        :param force: push every cost, without the state store
+        :param rebuild_matches: re-match every campaign instead of updating the match snapshots
+        :return: TenantsRunner object
+        """
+        with open(path) as file:
+            concurrency = json.load(file).get('concurrency', config.get('TENANT_CONCURRENCY'))
+
+        return cls(
+            load_tenants(path, config),
+            TransportPool(config),
+            cache,
+            concurrency=int(concurrency),
+            force=force,
+            rebuild_matches=rebuild_matches
+        )
+
+    def run(self, date_from: datetime.date = None, date_to: datetime.date = None) -> list:
+        """
+        :param date_from: first day to backfill, yesterday only when not given
+        :param date_to: last day to backfill (inclusive), defaults to yesterday
+        :return: list of TenantResult objects
+        """
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            results = list(executor.map(
+                lambda tenant: self.run_tenant(*tenant, date_from, date_to),
+                self.tenants
+            ))
+
+        self.report(results)
+
+        return results
+
+    def run_tenant(
+            self,
+            name: str,
+            config: Config,
+            date_from: datetime.date = None,
+            date_to: datetime.date = None
+    ) -> TenantResult:
+        """
+        :param name: tenant name
+        :param config: tenant Config object
+        :param date_from: first day to backfill, yesterday only when not given
+        :param date_to: last day to backfill (inclusive), defaults to yesterday
+        :return: TenantResult object
+        """
+        started = time.perf_counter()
+        synchronizer = None
+
+        try:
+            synchronizer = create_synchronizer(
+                config,
+                self.cache,
+                force=self.force,
+                transports=self.transports,
+                tenant=name,
+                rebuild_matches=self.rebuild_matches
+            )
+
+            if date_from:
+                summary = synchronizer.sync_range(date_from, date_to or synchronizer.yesterday.date())
+            else:
+                summary = synchronizer.sync()
+        except Exception as error:
+            logging.exception('[%s] Sync failed', name)
+            metrics.inc('tenants_total', status='failed')
+
+            return TenantResult(name, None, error, time.perf_counter() - started)
+        finally:
+            if synchronizer is not None:
+                synchronizer.close()
+
+        metrics.inc('tenants_total', status='ok')
+
+        return TenantResult(name, summary, None, time.perf_counter() - started)
+
+    @staticmethod
+    def report(results: list):
+        """
+        Log and print one summary covering all tenants.
+
+        :param results: list of TenantResult objects
+        :return: list of report lines
+        """
+        lines = []
+        totals = [0, 0, 0, 0, 0]
+
+        for result in sorted(results, key=lambda row: row.name):
+            if result.error is not None:
+                lines.append('Tenant %s failed after %.1fs: %r' % (result.name, result.seconds, result.error))
+                continue
+
+            counts = [
+                len(result.summary.updated),
+                len(result.summary.skipped),
+                len(result.summary.suppressed),
+                len(result.summary.failed),
+                len(result.summary.warnings)
+            ]
+            totals = [total + count for total, count in zip(totals, counts)]
+            lines.append(
+                'Tenant %s: %d updated, %d unchanged, %d within tolerance, %d failed, %d warning(s) in %.1fs'
+                % (result.name, *counts, result.seconds))
+
+        lines.append(
+            'Summary: %d tenant(s), %d failed tenant(s), %d updated, %d unchanged, %d within tolerance, '
+            '%d failed, %d warning(s)'
+            % (len(results), sum(1 for result in results if result.error is not None), *totals))
+
+        for line in lines:
+            logging.info(line)
+            print(line)
+
+        return lines
@@ -0,0 +1,117 @@
+"""
+Shared fixtures: the fake Binom and PropellerAds APIs of the benchmarks and
+a stub HTTP server answering scripted responses
+Made by @plutus
+"""
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.datagen import SyntheticAccount  # noqa: E402
+from benchmarks.fake_server import FakeAPIServer  # noqa: E402
+
+
+class StubServer(ThreadingHTTPServer):
+    """
+    Answers every request with respond(path) -> (status, headers dict, body bytes)
+    and records the (monotonic time, path) of the requests.
+    """
+    daemon_threads = True
+
+    def __init__(self, respond):
+        super().__init__(('127.0.0.1', 0), StubHandler)
+        self.respond = respond
+        self.requests = []
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self.server_address[1]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def handle_request(self):
+        server = self.server
+        # the unread body of a POST would break the kept-alive connection
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+        with server.lock:
+            server.requests.append((time.monotonic(), self.path))
+
+        status, headers, body = server.respond(self.path)
+
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = handle_request
+    do_POST = handle_request
+
+    def log_message(self, format, *args):
+        pass
+
+
+def scripted(*responses):
+    """
+    :param responses: statuses or (status, headers) tuples, answered in order, 200 afterwards
+    :return: respond function of StubServer
+    """
+    responses = list(responses)
+
+    def respond(path):
+        response = responses.pop(0) if responses else 200
+        status, headers = response if isinstance(response, tuple) else (response, {})
+        return status, headers, b'{}'
+
+    return respond
+
+
+@pytest.fixture
+def stub_server():
+    """
+    :return: function starting a StubServer with the given respond function
+    """
+    servers = []
+
+    def start(respond):
+        server = StubServer(respond)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def fake_server():
+    """
+    :return: function starting a FakeAPIServer, SyntheticAccount arguments as keywords
+    """
+    servers = []
+
+    def start(binom_count=20, ts_count=50, match_ratio=0.8, max_page_size=1000, **kwargs):
+        account = SyntheticAccount(binom_count, ts_count, match_ratio, **kwargs)
+        server = FakeAPIServer(account, max_page_size=max_page_size).start()
+        servers.append(server)
+        return server
+
+    yield start
+
+    for server in servers:
+        server.shutdown()
+        server.server_close()
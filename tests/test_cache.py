@@ -0,0 +1,98 @@
+import json
+import os
+import threading
+
+import pytest
+
+from binom import Binom
+from cache import CatalogCache
+from providers.propeller_ads import PropellerAdsAPIV5
+from transport import Transport
+
+
+def serve(*bodies):
+    """
+    :param bodies: JSON values answered with status 200 in order, the last one afterwards
+    :return: respond function of StubServer
+    """
+    bodies = list(bodies)
+
+    def respond(path):
+        body = bodies.pop(0) if len(bodies) > 1 else bodies[0]
+        return 200, {'Content-Type': 'application/json'}, json.dumps(body).encode()
+
+    return respond
+
+
+def get_entries(cache: CatalogCache):
+    return [name for name in os.listdir(cache.directory) if not name.startswith('.')]
+
+
+def test_binom_error_body_is_not_cached(stub_server, tmp_path):
+    campaigns = [{'id': 1, 'name': 'first', 'click_key': 'abc'}]
+    server = stub_server(serve({'status': 'error', 'message': 'Invalid key'}, campaigns))
+    cache = CatalogCache(str(tmp_path))
+    binom = Binom(server.url, 'key', cache=cache, transport=Transport(retries=0))
+
+    with pytest.raises(Exception, match='Invalid key'):
+        list(binom.get_all_campaigns())
+
+    assert get_entries(cache) == []
+
+    assert [campaign.id for campaign in binom.get_all_campaigns()] == [1]
+    assert [campaign.id for campaign in binom.get_all_campaigns()] == [1]
+    assert len(server.requests) == 2
+    assert sorted(get_entries(cache))[0].endswith('.json.gz')
+
+
+def test_unfinished_read_is_not_cached(stub_server, tmp_path):
+    server = stub_server(serve([{'id': camp_id} for camp_id in range(10)]))
+    cache = CatalogCache(str(tmp_path))
+    binom = Binom(server.url, 'key', cache=cache, transport=Transport(retries=0))
+    campaigns = binom.get_all_campaigns()
+    next(campaigns)
+    campaigns.close()
+
+    assert get_entries(cache) == []
+
+
+def test_propeller_ads_error_body_is_not_cached(stub_server, tmp_path):
+    server = stub_server(serve({'status': 'error'}, {'result': [], 'total': 0}))
+    cache = CatalogCache(str(tmp_path))
+    api = PropellerAdsAPIV5('key', cache=cache, transport=Transport(retries=0), base_uri=server.url + '/v5/')
+
+    with pytest.raises(Exception, match='Unexpected response'):
+        api.get_campaigns_list(page=1)
+
+    assert get_entries(cache) == []
+    assert api.get_campaigns_list(page=1).result == []
+    assert api.get_campaigns_list(page=1).result == []
+    assert len(server.requests) == 2
+
+
+def test_concurrent_writes_of_an_entry(tmp_path):
+    cache = CatalogCache(str(tmp_path))
+    key = cache.get_key('http://127.0.0.1/arm.php', {'action': 'campaign@get_all'})
+    barrier = threading.Barrier(8)
+    errors = []
+
+    def write(number):
+        try:
+            with cache.writer(key, etag='"%d"' % number) as write_chunk:
+                barrier.wait()
+                for _ in range(100):
+                    write_chunk('[%d]' % number)
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=write, args=(number,)) for number in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    body = ''.join(cache.iter_body(key))
+    assert body == body[:3] * 100
+    assert cache.get_meta(key)['etag'] in ['"%d"' % number for number in range(8)]
+    assert not [name for name in get_entries(cache) if name.endswith('.tmp')]
@@ -0,0 +1,41 @@
+from binom import Binom
+from cache import CatalogCache
+from daemon import SyncDaemon
+from transport import Transport
+
+
+class CatalogSynchronizer:
+    """
+    Synchronizer reading the Binom campaigns on each catalogs refresh
+    """
+    timezone = 3
+
+    def __init__(self, binom: Binom):
+        self.binom = binom
+
+    def reset(self, catalogs=False):
+        pass
+
+    def get_matches(self):
+        list(self.binom.get_all_campaigns())
+
+    def sync_range(self, date_from, date_to):
+        pass
+
+
+def test_catalog_refresh_bypasses_fresh_cache(stub_server, tmp_path):
+    server = stub_server(lambda path: (200, {}, b'[]'))
+    cache = CatalogCache(str(tmp_path), ttl=3600)
+    binom = Binom(server.url, 'key', cache=cache, transport=Transport(retries=0))
+    daemon = SyncDaemon(CatalogSynchronizer(binom), catalog_interval=0, cache=cache)
+
+    daemon.run_cycle()
+    daemon.run_cycle()
+
+    assert len(server.requests) == 2
+
+    # without a scheduled refresh the cached campaigns are used
+    daemon.catalog_interval = 3600
+    daemon.run_cycle()
+
+    assert len(server.requests) == 2
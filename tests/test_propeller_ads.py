@@ -0,0 +1,89 @@
+import json
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from providers.propeller_ads import TSPropellerAdsProvider
+
+
+def create_provider(url: str, **kwargs):
+    return TSPropellerAdsProvider('propeller_ads', 'key', base_uri=url + '/v5/', **kwargs)
+
+
+def test_campaigns_pages_capped_by_api(fake_server):
+    server = fake_server(ts_count=1000, max_page_size=100)
+    ts_campaigns = create_provider(server.url, page_size=500).get_ts_campaigns()
+
+    assert sorted(ts_campaigns) == list(range(1, 1001))
+    assert server.requests['adv/campaigns'] == 10
+
+
+def test_campaigns_pages_without_paging_metadata(stub_server):
+    rows = [{'id': ts_id, 'name': 'c%d' % ts_id, 'target_url': None} for ts_id in range(1, 251)]
+
+    def respond(path):
+        query = parse_qs(urlsplit(path).query)
+        page = int(query['page'][0])
+        # the API caps the page size at 100
+        result = rows[(page - 1) * 100:page * 100]
+        return 200, {}, json.dumps({'result': result}).encode()
+
+    server = stub_server(respond)
+    ts_campaigns = create_provider(server.url, page_size=500).get_ts_campaigns()
+
+    assert sorted(ts_campaigns) == list(range(1, 251))
+    assert len(server.requests) == 3
+
+
+def test_campaigns_stop_on_empty_page(stub_server):
+    rows = [{'id': ts_id, 'name': 'c%d' % ts_id, 'target_url': None} for ts_id in range(1, 201)]
+
+    def respond(path):
+        page = int(parse_qs(urlsplit(path).query)['page'][0])
+        return 200, {}, json.dumps({'result': rows[(page - 1) * 100:page * 100]}).encode()
+
+    server = stub_server(respond)
+    ts_campaigns = create_provider(server.url, page_size=100).get_ts_campaigns()
+
+    assert len(ts_campaigns) == 200
+    assert len(server.requests) == 3
+
+
+def test_invalid_page_size():
+    with pytest.raises(Exception, match='page size'):
+        create_provider('http://127.0.0.1', page_size=0)
+
+
+def test_costs_without_money(stub_server):
+    rows = [
+        {'campaign_id': 1, 'date': '2026-10-01', 'zone_id': 10, 'money': 1.5},
+        {'campaign_id': 2, 'date': '2026-10-01', 'zone_id': 20, 'money': None}
+    ]
+    server = stub_server(lambda path: (200, {}, json.dumps(rows).encode()))
+    provider = create_provider(server.url)
+
+    assert provider.get_cost([1, 2], '2026-10-01', '2026-10-01', 3) == {1: 1.5, 2: 0.0}
+    assert provider.get_daily_cost([1, 2], '2026-10-01', '2026-10-01', 3) == \
+        {'2026-10-01': {1: 1.5, 2: 0.0}}
+    assert list(provider.iter_token_costs([1, 2], '2026-10-01', '2026-10-01', 3)) == [
+        (1, '2026-10-01', 10, 1.5),
+        (2, '2026-10-01', 20, 0.0)
+    ]
+    # the costs do not need the campaigns catalog
+    assert all('adv/campaigns' not in path for _, path in server.requests)
+
+
+def test_campaigns_pages_ignore_other_metadata(stub_server):
+    rows = [{'id': ts_id, 'name': 'c%d' % ts_id, 'target_url': None} for ts_id in range(1, 251)]
+
+    def respond(path):
+        page = int(parse_qs(urlsplit(path).query)['page'][0])
+        result = rows[(page - 1) * 100:page * 100]
+        # rows of the current page, not a total
+        return 200, {}, json.dumps({'result': result, 'meta': {'count': len(result)}}).encode()
+
+    server = stub_server(respond)
+    ts_campaigns = create_provider(server.url, page_size=100).get_ts_campaigns()
+
+    assert sorted(ts_campaigns) == list(range(1, 251))
+    assert len(server.requests) == 3
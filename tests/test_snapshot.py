@@ -0,0 +1,116 @@
+import os
+import random
+from types import SimpleNamespace
+
+import pytest
+
+from match import match_campaigns
+from shard import Sharder
+from snapshot import MatchSnapshot, normalize, to_pairs
+from traffic_source import TSCampaign, TSProvider, TSProviders
+
+BINOM_DOMAIN = 'https://tracker.example.com'
+
+
+class StaticBinom:
+    def __init__(self, binom_campaigns: list):
+        self.binom_campaigns = binom_campaigns
+
+    def get_tracking_domain(self):
+        return BINOM_DOMAIN
+
+    def get_all_campaigns(self):
+        return self.binom_campaigns
+
+
+class StaticProvider(TSProvider):
+    def __init__(self, ts_name: str, urls: dict):
+        super().__init__(ts_name)
+        self.urls = urls
+
+    def get_ts_campaigns(self):
+        if self.ts_campaigns is None:
+            self.ts_campaigns = {
+                ts_id: TSCampaign(self.ts_name, ts_id, url) for ts_id, url in self.urls.items()
+            }
+
+        return self.ts_campaigns
+
+
+def generate(binom_count: int = 200, ts_count: int = 600):
+    rng = random.Random(0)
+    binom_campaigns = [
+        SimpleNamespace(id=camp_id, click_key='%016x' % rng.getrandbits(64))
+        for camp_id in range(1, binom_count + 1)
+    ]
+    urls = {}
+
+    for ts_id in range(1, ts_count + 1):
+        click_key = rng.choice(binom_campaigns).click_key
+
+        if ts_id % 50 == 0:
+            # unparsed URL, matched by the substring fallback
+            urls[ts_id] = 'see %s/click.php?key=%s here' % (BINOM_DOMAIN, click_key)
+        else:
+            urls[ts_id] = '%s/click.php?key=%s&zone={zoneid}' % (BINOM_DOMAIN, click_key)
+
+    return binom_campaigns, urls
+
+
+def get_providers(urls: dict) -> TSProviders:
+    return TSProviders({'static': StaticProvider('static', dict(urls))})
+
+
+def get_full_pairs(binom_campaigns: list, urls: dict) -> dict:
+    ts_providers = get_providers(urls)
+    matches, _ = match_campaigns(StaticBinom(binom_campaigns), ts_providers, binom_campaigns)
+
+    return normalize(to_pairs(matches))
+
+
+@pytest.mark.parametrize('matcher', ['in_process', 'sharded'])
+def test_incremental_update_equals_full_match(tmp_path, matcher):
+    binom_campaigns, urls = generate()
+    snapshot = MatchSnapshot(str(tmp_path / 'matches.json'))
+    sharder = Sharder(2) if matcher == 'sharded' else None
+
+    def run():
+        ts_providers = get_providers(urls)
+        binom = StaticBinom(binom_campaigns)
+
+        if sharder is None:
+            matches, _ = snapshot.match(binom, ts_providers, binom_campaigns)
+        else:
+            matches, _ = snapshot.match(binom, ts_providers, binom_campaigns, sharder.match)
+
+        return normalize(to_pairs(matches)), ts_providers
+
+    assert run()[0] == get_full_pairs(binom_campaigns, urls)
+
+    # nothing changed: same matches, no index built and the file is not rewritten
+    written = os.stat(snapshot.path).st_mtime_ns
+    pairs, ts_providers = run()
+
+    assert pairs == get_full_pairs(binom_campaigns, urls)
+    assert snapshot.generation == 1
+    assert os.stat(snapshot.path).st_mtime_ns == written
+    assert ts_providers.get_ts_provider('static').match_index is None
+
+    binom_campaigns[3].click_key = 'changed'
+    binom_campaigns.append(SimpleNamespace(id=1000, click_key=binom_campaigns[5].click_key))
+    del binom_campaigns[10]
+    del urls[7]
+    urls[4] = '%s/click.php?key=%s' % (BINOM_DOMAIN, binom_campaigns[20].click_key)
+    urls[1001] = '%s/click.php?key=changed' % BINOM_DOMAIN
+    urls[1002] = 'see %s/click.php?key=%s here' % (BINOM_DOMAIN, binom_campaigns[30].click_key)
+
+    pairs, ts_providers = run()
+
+    assert snapshot.generation == 2
+    assert pairs == get_full_pairs(binom_campaigns, urls)
+    # changed campaigns are looked up in the stored keys, not in a match index
+    assert ts_providers.get_ts_provider('static').match_index is None
+
+    with open(snapshot.path) as file:
+        # URL digests and click keys are stored, not the URLs
+        assert 'click.php' not in file.read()
@@ -0,0 +1,178 @@
+import datetime
+
+import pytest
+
+import cli
+from binom import Binom
+from providers.propeller_ads import TSPropellerAdsProvider
+from state import StateStore
+from sync import CostSynchronizer
+from traffic_source import TSCampaign, TSProvider, TSProviders
+
+YESTERDAY = datetime.datetime(2026, 10, 1)
+
+
+class RecordingProvider(TSProvider):
+    """
+    Provider with fixed campaigns and costs, recording the ids it is asked for
+    """
+
+    def __init__(self, ts_name: str, urls: dict, cost: float):
+        super().__init__(ts_name)
+        self.urls = urls
+        self.cost = cost
+        self.requested_ids = []
+
+    def get_ts_campaigns(self):
+        if self.ts_campaigns is None:
+            self.ts_campaigns = {
+                ts_id: TSCampaign(self.ts_name, ts_id, url) for ts_id, url in self.urls.items()
+            }
+
+        return self.ts_campaigns
+
+    def get_cost(self, ts_campaign_ids, date_from, date_to, timezone):
+        self.requested_ids.extend(ts_campaign_ids)
+        return {ts_id: self.cost for ts_id in ts_campaign_ids}
+
+
+def create_synchronizer(server, *ts_providers, **kwargs):
+    """
+    :param server: FakeAPIServer
+    :param ts_providers: extra TSProvider objects
+    :return: CostSynchronizer of the fake APIs PropellerAds account and the extra providers
+    """
+    providers = TSProviders({'propeller_ads': TSPropellerAdsProvider(
+        'propeller_ads', 'key', stats_chunk_size=10, base_uri=server.url + '/v5/')})
+
+    for ts_provider in ts_providers:
+        providers.add_ts_provider(ts_provider.ts_name, ts_provider)
+
+    return CostSynchronizer(Binom(server.url, 'key'), 3, providers, YESTERDAY, **kwargs)
+
+
+def get_expected_costs(account, extra: dict = None) -> dict:
+    """
+    :param account: SyntheticAccount
+    :param extra: dict of extra costs by Binom campaign ids
+    :return: dict of the costs pushed to the Binom campaigns
+    """
+    expected = dict(extra or {})
+
+    for binom_campaign in account.binom_campaigns:
+        for ts_campaign in account.ts_campaigns:
+            if 'key=%s&' % binom_campaign['click_key'] in ts_campaign['target_url']:
+                expected[binom_campaign['id']] = \
+                    expected.get(binom_campaign['id'], 0.0) + account.costs[ts_campaign['id']]
+
+    return {camp_id: cost for camp_id, cost in expected.items() if round(cost, 4)}
+
+
+def test_providers_get_their_own_ids(fake_server):
+    server = fake_server(binom_count=10, ts_count=40)
+    binom_campaigns = server.account.binom_campaigns
+    other = RecordingProvider('other', {
+        # ids also used by the PropellerAds campaigns
+        1: 'http://127.0.0.1/click.php?key=%s' % binom_campaigns[0]['click_key'],
+        2: 'http://127.0.0.1/click.php?key=%s' % binom_campaigns[1]['click_key'],
+        3: 'http://127.0.0.1/click.php?key=%s' % binom_campaigns[1]['click_key'],
+        4: 'https://landing.example.com/'
+    }, 0.5)
+    synchronizer = create_synchronizer(server, other)
+    summary = synchronizer.sync()
+
+    assert sorted(other.requested_ids) == [1, 2, 3]
+    assert sorted(ts_id for ids in server.stats_calls for ts_id in ids) == \
+        sorted(ts_campaign.id for ts_campaign in synchronizer.matched_ts_campaigns['propeller_ads'])
+    assert server.updates == pytest.approx(get_expected_costs(server.account, {1: 0.5, 2: 1.0}))
+    assert summary.failed == []
+
+
+def test_repeat_sync_skips_unchanged_costs(fake_server, tmp_path):
+    server = fake_server(binom_count=20, ts_count=60)
+    state_store = StateStore(str(tmp_path / 'state.db'))
+    expected = get_expected_costs(server.account)
+
+    summary = create_synchronizer(server, state_store=state_store).sync()
+
+    assert len(summary.updated) == len(expected)
+    assert server.requests['save_update_costs'] == len(expected)
+
+    summary = create_synchronizer(server, state_store=state_store).sync()
+
+    assert summary.updated == []
+    assert len(summary.skipped) == len(expected)
+    assert server.requests['save_update_costs'] == len(expected)
+
+    # --force runs without the state store and pushes everything again
+    summary = create_synchronizer(server, state_store=None).sync()
+
+    assert len(summary.updated) == len(expected)
+    assert server.requests['save_update_costs'] == 2 * len(expected)
+
+
+def test_repeat_sync_skips_string_ids(fake_server, tmp_path):
+    server = fake_server(binom_count=20, ts_count=60)
+    expected = get_expected_costs(server.account)
+
+    # as the real Binom API serves them
+    for binom_campaign in server.account.binom_campaigns:
+        binom_campaign['id'] = str(binom_campaign['id'])
+
+    state_store = StateStore(str(tmp_path / 'state.db'))
+    create_synchronizer(server, state_store=state_store).sync()
+    summary = create_synchronizer(server, state_store=state_store).sync()
+
+    assert summary.updated == []
+    assert len(summary.skipped) == len(expected)
+    assert server.requests['save_update_costs'] == len(expected)
+
+
+def test_changed_cost_is_pushed(fake_server, tmp_path):
+    server = fake_server(binom_count=20, ts_count=60)
+    state_store = StateStore(str(tmp_path / 'state.db'))
+    create_synchronizer(server, state_store=state_store).sync()
+    pushed = server.requests['save_update_costs']
+
+    synchronizer = create_synchronizer(server, state_store=state_store)
+    synchronizer.get_matches()
+    match = synchronizer.matches[0]
+    ts_campaign_id = next(iter(match.get_ts_campaigns_by_ts_name('propeller_ads')))
+    server.account.costs[ts_campaign_id] += 1.5
+    summary = synchronizer.sync()
+
+    camp_id = match.get_binom_campaign().id
+    assert [row[0] for row in summary.updated] == [camp_id]
+    assert server.requests['save_update_costs'] == pushed + 1
+    assert server.updates[camp_id] == pytest.approx(get_expected_costs(server.account)[camp_id])
+
+
+def test_reversed_dates_are_rejected(fake_server):
+    server = fake_server()
+    synchronizer = create_synchronizer(server)
+
+    with pytest.raises(Exception, match='after the last day'):
+        synchronizer.dry_run(datetime.date(2026, 10, 5), datetime.date(2026, 10, 1))
+
+    with pytest.raises(Exception, match='after the last day'):
+        synchronizer.sync_range(datetime.date(2026, 10, 5), datetime.date(2026, 10, 1))
+
+    assert server.get_requests_count() == 0
+
+    with pytest.raises(SystemExit):
+        cli.main(['dry-run', '--from', '2026-10-05', '--to', '2026-10-01'])
+
+
+def test_dry_run_deltas(fake_server):
+    server = fake_server(binom_count=20, ts_count=60)
+    expected = get_expected_costs(server.account)
+    deltas = create_synchronizer(server).dry_run()
+
+    assert {int(delta.camp_id): delta.delta for delta in deltas} == pytest.approx(expected)
+    assert server.requests.get('save_update_costs') is None
+
+    create_synchronizer(server).sync()
+    deltas = create_synchronizer(server).dry_run(YESTERDAY.date(), YESTERDAY.date())
+
+    assert len(deltas) == len(expected)
+    assert all(delta.binom_cost == delta.ts_cost for delta in deltas)
@@ -0,0 +1,23 @@
+import tenants
+from journal import RunJournal
+from tenants import TenantsRunner
+from test_sync import create_synchronizer
+
+
+def test_failed_tenant_closes_its_files(fake_server, tmp_path, monkeypatch):
+    server = fake_server(binom_count=10, ts_count=30)
+    journal = RunJournal(str(tmp_path / 'sync.journal'))
+    synchronizer = create_synchronizer(server, journal=journal)
+
+    def fail(*args, **kwargs):
+        raise Exception('Binom is down')
+
+    monkeypatch.setattr(synchronizer.binom, 'update_costs', fail)
+    monkeypatch.setattr(tenants, 'create_synchronizer', lambda *args, **kwargs: synchronizer)
+
+    [result] = TenantsRunner([('tracker-1', None)], transports=None).run()
+
+    assert 'Binom is down' in str(result.error)
+    assert journal.file is None
+    # the planned updates are resumed by the next run
+    assert journal.get_pending()
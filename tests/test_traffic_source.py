@@ -0,0 +1,151 @@
+import os
+import threading
+import time
+
+import pytest
+
+from providers.propeller_ads import TSPropellerAdsProvider
+from traffic_source import ProviderCapabilities, TSProvider, TSProviders, chunk_ids, merge_costs
+
+
+class BlockedProvider(TSProvider):
+    """
+    Provider whose statistics calls block until released
+    """
+
+    def __init__(self, ts_name: str):
+        super().__init__(ts_name)
+        self.released = threading.Event()
+
+    def get_cost(self, ts_campaign_ids, date_from, date_to, timezone):
+        self.released.wait(10)
+        return {}
+
+
+class StaticCostProvider(TSProvider):
+    def get_cost(self, ts_campaign_ids, date_from, date_to, timezone):
+        return {ts_id: 1.0 for ts_id in ts_campaign_ids}
+
+
+def test_provider_timeout_bounds_wall_time():
+    blocked = BlockedProvider('blocked')
+    ts_providers = TSProviders({'blocked': blocked, 'static': StaticCostProvider('static')})
+    started = time.monotonic()
+
+    try:
+        costs, errors = ts_providers.fetch_costs(
+            {'blocked': [1], 'static': [1, 2]}, '2026-10-01', '2026-10-01', 3, timeout=0.2)
+    finally:
+        blocked.released.set()
+
+    assert time.monotonic() - started < 2
+    assert costs == {'static': {1: 1.0, 2: 1.0}}
+    assert 'timed out' in str(errors['blocked'])
+
+
+def test_chunk_ids():
+    assert chunk_ids([1, 2, 2, 3, 1, 4, 5], 2) == [[1, 2], [3, 4], [5]]
+    assert chunk_ids([3, 1, 3], None) == [[3, 1]]
+    assert chunk_ids([], 10) == []
+
+
+def test_merge_costs():
+    assert merge_costs([{1: 1.5, 2: 2.0}, {}, {3: 0.25}]) == {1: 1.5, 2: 2.0, 3: 0.25}
+
+
+@pytest.mark.parametrize('chunk_size, calls', [(1, 25), (10, 3), (25, 1), (24, 2), (100, 1)])
+def test_statistics_chunk_boundaries(fake_server, chunk_size, calls):
+    server = fake_server(ts_count=30)
+    ts_provider = TSPropellerAdsProvider(
+        'propeller_ads', 'key', stats_chunk_size=chunk_size, base_uri=server.url + '/v5/')
+    ts_providers = TSProviders({'propeller_ads': ts_provider})
+    # duplicates are sent once
+    ts_campaign_ids = list(range(1, 26)) + [1, 5, 25]
+
+    costs, errors = ts_providers.fetch_costs(
+        {'propeller_ads': ts_campaign_ids}, '2026-10-01 00:00:00', '2026-10-01 23:59:59', 3)
+
+    assert errors == {}
+    assert server.requests['adv/statistics'] == calls
+    assert sorted(map(len, server.stats_calls), reverse=True) == \
+        [len(chunk) for chunk in chunk_ids(range(1, 26), chunk_size)]
+    assert sorted(ts_id for ids in server.stats_calls for ts_id in ids) == list(range(1, 26))
+    assert costs['propeller_ads'] == pytest.approx({ts_id: server.account.costs[ts_id] for ts_id in range(1, 26)})
+
+
+def test_statistics_totals(fake_server):
+    server = fake_server(ts_count=30)
+    ts_provider = TSPropellerAdsProvider(
+        'propeller_ads', 'key', stats_chunk_size=7, base_uri=server.url + '/v5/')
+    costs, errors = TSProviders({'propeller_ads': ts_provider}).fetch_costs(
+        {'propeller_ads': list(range(1, 31))}, '2026-10-01 00:00:00', '2026-10-01 23:59:59', 3)
+
+    assert errors == {}
+    assert server.requests['adv/statistics'] == 5
+    assert sorted(map(sorted, server.stats_calls)) == chunk_ids(range(1, 31), 7)
+    assert sum(costs['propeller_ads'].values()) == pytest.approx(sum(server.account.costs.values()))
+
+
+def test_statistics_chunked_once(fake_server):
+    server = fake_server(ts_count=30)
+    ts_provider = TSPropellerAdsProvider(
+        'propeller_ads', 'key', stats_chunk_size=10, stats_concurrency=2, base_uri=server.url + '/v5/')
+    ts_providers = TSProviders({'propeller_ads': ts_provider})
+
+    rows = list(ts_providers.iter_token_costs(
+        'propeller_ads', list(range(1, 26)), '2026-10-01 00:00:00', '2026-10-01 23:59:59', 3, 'zone_id'))
+
+    assert sorted(map(len, server.stats_calls)) == [5, 10, 10]
+    assert sum(cost for _, _, _, cost in rows) == \
+        pytest.approx(sum(server.account.costs[ts_id] for ts_id in range(1, 26)))
+
+    # the provider sends the ids it is given in one call, chunking is left to TSProviders
+    ts_provider.get_cost(list(range(1, 26)), '2026-10-01 00:00:00', '2026-10-01 23:59:59', 3)
+
+    assert len(server.stats_calls[-1]) == 25
+
+
+class SlowProvider(TSProvider):
+    capabilities = ProviderCapabilities(max_ids_per_stats_call=2, max_concurrent_stats_calls=3)
+
+    def __init__(self, ts_name: str):
+        super().__init__(ts_name)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def get_cost(self, ts_campaign_ids, date_from, date_to, timezone):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+        time.sleep(0.02)
+
+        with self.lock:
+            self.in_flight -= 1
+
+        return {ts_id: 1.0 for ts_id in ts_campaign_ids}
+
+
+def test_concurrent_statistics_calls_are_bounded():
+    ts_provider = SlowProvider('slow')
+    costs, errors = TSProviders({'slow': ts_provider}).fetch_costs(
+        {'slow': list(range(20))}, '2026-10-01', '2026-10-01', 3)
+
+    assert len(costs['slow']) == 20
+    assert ts_provider.max_in_flight == 3
+
+
+class WideProvider(SlowProvider):
+    capabilities = ProviderCapabilities(max_ids_per_stats_call=1, max_concurrent_stats_calls=10)
+
+
+def test_executor_sized_from_capabilities(monkeypatch):
+    # a default pool would have cpu_count + 4 threads
+    monkeypatch.setattr(os, 'cpu_count', lambda: 1)
+    ts_providers = {'first': WideProvider('first'), 'second': WideProvider('second')}
+    costs, errors = TSProviders(dict(ts_providers)).fetch_costs(
+        {'first': list(range(20)), 'second': list(range(20))}, '2026-10-01', '2026-10-01', 3)
+
+    assert errors == {}
+    assert [ts_provider.max_in_flight for ts_provider in ts_providers.values()] == [10, 10]
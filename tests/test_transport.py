@@ -0,0 +1,174 @@
+import email.utils
+import time
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+import transport
+from binom import Binom, CostItem
+from conftest import scripted
+from transport import CircuitOpenError, TokenBucket, Transport, TransportError
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """
+    :return: list of the retry delays, slept without waiting
+    """
+    delays = []
+    monkeypatch.setattr(transport.time, 'sleep', delays.append)
+    monkeypatch.setattr(transport.random, 'uniform', lambda low, high: high)
+    return delays
+
+
+def test_retries_with_backoff(stub_server, sleeps):
+    server = stub_server(scripted(503, 502, 200))
+    response = Transport(retries=3, backoff=0.5).get(server.url)
+
+    assert response.status_code == 200
+    assert len(server.requests) == 3
+    assert sleeps == [0.5, 1.0]
+
+
+def test_backoff_is_capped():
+    client = Transport(backoff=0.5, max_backoff=3)
+
+    assert all(client.get_delay(attempt) <= 3 for attempt in range(10))
+
+
+def test_fails_after_retries(stub_server, sleeps):
+    server = stub_server(scripted(500, 500, 500))
+
+    with pytest.raises(TransportError) as error:
+        Transport(retries=2).get(server.url)
+
+    assert error.value.response.status_code == 500
+    assert len(server.requests) == 3
+    assert len(sleeps) == 2
+
+
+def test_retry_after_seconds(stub_server, sleeps):
+    server = stub_server(scripted((429, {'Retry-After': '2'}), 200))
+
+    assert Transport(retries=1).get(server.url).status_code == 200
+    assert sleeps == [2.0]
+
+
+def test_retry_after_date(stub_server, sleeps):
+    retry_at = email.utils.formatdate(time.time() + 10, usegmt=True)
+    server = stub_server(scripted((503, {'Retry-After': retry_at}), 200))
+
+    assert Transport(retries=1, max_backoff=30).get(server.url).status_code == 200
+    assert 8 <= sleeps[0] <= 10
+
+
+def test_rate_limited_response_drains_bucket(stub_server):
+    server = stub_server(scripted((429, {'Retry-After': '0.2'}), 200))
+    client = Transport(retries=1, rate_limit=10)
+
+    assert client.get(server.url).status_code == 200
+
+    bucket, breaker = client.get_host_state(server.url)
+    (first, _), (second, _) = server.requests
+
+    # 0.2s of Retry-After, then the 2 drained tokens and the next one refill at 10/s
+    assert second - first >= 0.28
+    assert breaker.failures == 0
+
+
+def test_drained_bucket_blocks():
+    bucket = TokenBucket(10)
+    bucket.drain(0.2)
+    started = time.monotonic()
+    bucket.acquire()
+
+    assert time.monotonic() - started >= 0.25
+
+
+def test_client_error_is_not_retried(stub_server, sleeps):
+    server = stub_server(scripted(404))
+    client = Transport(retries=3)
+
+    with pytest.raises(TransportError) as error:
+        client.get(server.url)
+
+    assert not isinstance(error.value, CircuitOpenError)
+    assert error.value.response.status_code == 404
+    assert len(server.requests) == 1
+    assert sleeps == []
+    assert client.get_host_state(server.url)[1].failures == 0
+
+
+def test_breaker_opens_probes_and_closes(stub_server):
+    server = stub_server(scripted(500, 500))
+    client = Transport(retries=0, failure_threshold=2, reset_timeout=0.2)
+
+    for _ in range(2):
+        with pytest.raises(TransportError):
+            client.get(server.url)
+
+    with pytest.raises(CircuitOpenError):
+        client.get(server.url)
+
+    assert len(server.requests) == 2
+
+    time.sleep(0.25)
+
+    # the probe succeeds and closes the circuit
+    assert client.get(server.url).status_code == 200
+    assert client.get(server.url).status_code == 200
+    assert len(server.requests) == 4
+
+
+def test_failed_probe_reopens_breaker(stub_server, sleeps):
+    server = stub_server(scripted(*[500] * 5))
+    client = Transport(retries=2, failure_threshold=1, reset_timeout=0)
+
+    with pytest.raises(TransportError):
+        client.get(server.url)
+
+    assert len(server.requests) == 3
+
+    # a single attempt for the probe, its failure reopens the circuit
+    with pytest.raises(TransportError):
+        client.get(server.url)
+
+    assert len(server.requests) == 4
+    assert client.get_host_state(server.url)[1].is_open()
+
+
+def test_single_bad_request_does_not_open_breaker(stub_server, sleeps):
+    def respond(path):
+        if parse_qs(urlsplit(path).query)['camp_id'] == ['7']:
+            return 500, {}, b'{}'
+
+        return 200, {}, b'{"update_status": true}'
+
+    server = stub_server(respond)
+    binom = Binom(server.url, 'key', transport=Transport(retries=4, failure_threshold=5))
+    items = [CostItem(camp_id, None, 1.0) for camp_id in range(1, 43)]
+    results = list(binom.update_costs(items, 3, concurrency=1))
+    failed = [result for result in results if result.error is not None]
+
+    assert [result.item.camp_id for result in failed] == [7]
+    assert not isinstance(failed[0].error, CircuitOpenError)
+    assert len(server.requests) == 41 + 5
+
+
+def test_slow_update_does_not_hold_the_next_ones(stub_server):
+    def respond(path):
+        camp_id = parse_qs(urlsplit(path).query)['camp_id'][0]
+        time.sleep(1.0 if camp_id == '1' else 0.05)
+        return 200, {}, b'{"update_status": true}'
+
+    server = stub_server(respond)
+    binom = Binom(server.url, 'key', transport=Transport(retries=0))
+    items = [CostItem(camp_id, None, 1.0) for camp_id in range(1, 21)]
+    results = list(binom.update_costs(items, 3, batch_size=4, concurrency=4))
+
+    assert sorted(result.item.camp_id for result in results) == list(range(1, 21))
+    assert all(result.error is None for result in results)
+    # every other update was sent while the first one was still running
+    started = server.requests[0][0]
+    assert all(at - started < 0.9 for at, _ in server.requests)
+    assert results[-1].item.camp_id == 1
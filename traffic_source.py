@@ -3,6 +3,32 @@ Base classes for traffic source provider(s) and campaign.
 Those classes must be extended when adding new provider to the list.
 Made by @plutus
 """
+import asyncio
+import datetime
+import functools
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import parse_qs, urlsplit
+
+# what the provider API can do, TSProviders picks the fetch strategy from it:
+# max_ids_per_stats_call None means no limit, max_concurrent_stats_calls is
+# the number of those calls in flight (None for all of them), rate_limit is
+# the default requests per second when CS_<NAME>_RATE_LIMIT is not set,
+# without supports_timezone token statistics are hourly UTC rows bucketed
+# into days here
+ProviderCapabilities = namedtuple(
+    'ProviderCapabilities',
+    [
+        'supports_pagination',
+        'max_ids_per_stats_call',
+        'supports_day_grouping',
+        'supports_tokens',
+        'rate_limit',
+        'supports_timezone',
+        'max_concurrent_stats_calls'
+    ],
+    defaults=(False, None, False, False, None, True, None)
+)
 
 
 class TSProvider:
@@ -11,14 +37,57 @@ class TSProvider:
 
     It is used to fetch campaigns, match them with Binom campaigns and to fetch costs.
     """
+    capabilities = ProviderCapabilities()
+
+    # config keys of the constructor arguments, prefixed with the provider name
+    # (API_KEY is CS_PROPELLER_ADS_API_KEY for propeller_ads)
+    config_args = ()
+    config_kwargs = {}
 
-    def __init__(self, ts_name: str):
+    def __init__(self, ts_name: str, substring_fallback: bool = True):
         self.ts_name = ts_name
         self.ts_campaigns = None
+        self.match_index = None
+        self.substring_fallback = substring_fallback
 
     def __repr__(self):
         return 'TSProvider <%s>' % self.ts_name
 
+    @classmethod
+    def from_config(cls, ts_name: str, config, **kwargs):
+        """
+        :param ts_name: traffic source name
+        :param config: Config object
+        :param kwargs: other constructor arguments (cache, transport)
+        :return: TSProvider object
+        """
+        prefix = ts_name.upper()
+        args = []
+
+        for key in cls.config_args:
+            value = config.get('%s_%s' % (prefix, key))
+
+            if not value:
+                raise Exception('%s requires CS_%s_%s' % (ts_name, prefix, key))
+
+            args.append(value)
+
+        for arg, key in cls.config_kwargs.items():
+            value = config.get('%s_%s' % (prefix, key))
+
+            # unset keys keep the constructor defaults
+            if value is not None:
+                kwargs[arg] = value
+
+        return cls(ts_name, *args, **kwargs)
+
+    def reset(self):
+        """
+        Drop fetched campaigns and the match index, they will be fetched again on next use.
+        """
+        self.ts_campaigns = None
+        self.match_index = None
+
     def get_ts_campaigns(self):
         """
         Fetch traffic source campaigns.
@@ -27,6 +96,34 @@ class TSProvider:
         """
         raise Exception('get_campaings function must be implemented')
 
+    def iter_ts_campaigns(self):
+        """
+        Yield traffic source campaigns, providers with paginated APIs
+        can override it to yield campaigns before the last page arrives.
+
+        :return: generator of TSCampaign objects
+        """
+        yield from self.get_ts_campaigns().values()
+
+    def get_match_index(self):
+        """
+        Build (once) the matching index over fetched campaigns.
+
+        :return: TSMatchIndex object
+        """
+        if self.match_index is None:
+            match_index = TSMatchIndex(self.substring_fallback)
+            ts_campaigns = {}
+
+            for ts_campaign in self.iter_ts_campaigns():
+                ts_campaigns[ts_campaign.id] = ts_campaign
+                match_index.add(ts_campaign)
+
+            self.ts_campaigns = ts_campaigns
+            self.match_index = match_index
+
+        return self.match_index
+
     def match(self, binom_campaign_url: str):
         """
         Match any campaigns from this provider with the binom campaign URL
@@ -34,7 +131,7 @@ class TSProvider:
         :param binom_campaign_url: url to match
         :return: list of TSCampaign objects
         """
-        raise Exception('match function must be implemented')
+        return self.get_match_index().match(binom_campaign_url)
 
     def get_cost(
             self,
@@ -51,6 +148,135 @@ class TSProvider:
         """
         raise Exception('get_cost function must be implemented')
 
+    def get_daily_cost(
+            self,
+            ts_campaign_ids: list,
+            date_from: str,
+            date_to: str,
+            timezone: int
+    ):
+        """
+        :param ts_campaign_ids:
+        :param date_from:
+        :param date_to:
+        :param timezone:
+        :return: dict of costs by campaign ids grouped by day (YYYY-MM-DD)
+        """
+        raise Exception('get_daily_cost function must be implemented')
+
+    def iter_token_costs(
+            self,
+            ts_campaign_ids: list,
+            date_from: str,
+            date_to: str,
+            timezone: int,
+            token: str
+    ):
+        """
+        Optional, used when costs are pushed per Binom token (e.g. per zone).
+
+        :param ts_campaign_ids: list of campaigns ids
+        :param date_from: date from
+        :param date_to: date to
+        :param timezone: timezone
+        :param token: statistics field passed to Binom as the token value (e.g. zone_id)
+        :return: generator of (campaign id, day (YYYY-MM-DD) or UTC hour (YYYY-MM-DD HH:00:00)
+                 without supports_timezone, token value, cost) tuples
+        """
+        raise Exception('iter_token_costs function must be implemented')
+
+
+class AsyncTSProvider(TSProvider):
+    """
+    Base class for traffic source providers with asyncio APIs.
+
+    Sync methods are kept for matching, they run the async ones when
+    the campaigns were not fetched by TSProviders beforehand.
+    """
+
+    async def get_ts_campaigns_async(self):
+        """
+        :return: dict of TSCampaign objects by campaign ids
+        """
+        raise Exception('get_ts_campaigns_async function must be implemented')
+
+    async def get_cost_async(
+            self,
+            ts_campaign_ids: list,
+            date_from: str,
+            date_to: str,
+            timezone: int
+    ):
+        """
+        :return: dict of costs by campaign ids
+        """
+        raise Exception('get_cost_async function must be implemented')
+
+    async def get_daily_cost_async(
+            self,
+            ts_campaign_ids: list,
+            date_from: str,
+            date_to: str,
+            timezone: int
+    ):
+        """
+        :return: dict of costs by campaign ids grouped by day (YYYY-MM-DD)
+        """
+        raise Exception('get_daily_cost_async function must be implemented')
+
+    def get_ts_campaigns(self):
+        if self.ts_campaigns is None:
+            self.ts_campaigns = asyncio.run(self.get_ts_campaigns_async())
+
+        return self.ts_campaigns
+
+    def get_cost(self, ts_campaign_ids: list, date_from: str, date_to: str, timezone: int):
+        return asyncio.run(self.get_cost_async(ts_campaign_ids, date_from, date_to, timezone))
+
+    def get_daily_cost(self, ts_campaign_ids: list, date_from: str, date_to: str, timezone: int):
+        return asyncio.run(
+            self.get_daily_cost_async(ts_campaign_ids, date_from, date_to, timezone))
+
+
+class SyncTSProviderAdapter:
+    """
+    Exposes the async interface of a blocking TSProvider by running its
+    methods in an executor.
+    """
+
+    def __init__(self, ts_provider: TSProvider, build_index: bool = True, executor=None):
+        """
+        :param ts_provider: TSProvider object
+        :param build_index: index campaigns of paginated providers while they are fetched
+        :param executor: executor of the blocking calls, the loop default one when None
+        """
+        self.ts_provider = ts_provider
+        self.build_index = build_index
+        self.executor = executor
+
+    async def run(self, function, *args, **kwargs):
+        """
+        :param function: blocking callable
+        :return: function result
+        """
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, functools.partial(function, *args, **kwargs))
+
+    async def get_ts_campaigns_async(self):
+        if not self.build_index or not self.ts_provider.capabilities.supports_pagination:
+            return await self.run(self.ts_provider.get_ts_campaigns)
+
+        # indexing pages as they arrive keeps the index off the matching loop
+        await self.run(self.ts_provider.get_match_index)
+
+        return self.ts_provider.ts_campaigns
+
+    async def get_cost_async(self, *args, **kwargs):
+        return await self.run(self.ts_provider.get_cost, *args, **kwargs)
+
+    async def get_daily_cost_async(self, *args, **kwargs):
+        return await self.run(self.ts_provider.get_daily_cost, *args, **kwargs)
+
 
 class TSProviders:
     """
@@ -87,6 +313,237 @@ class TSProviders:
             return self.ts_providers[ts_name]
         return None
 
+    def reset(self):
+        """
+        Drop fetched campaigns of every provider
+        """
+        for ts_provider in self.ts_providers.values():
+            ts_provider.reset()
+
+    def get_async_provider(self, ts_name, build_index: bool = True, executor=None):
+        """
+        :param ts_name: traffic source name
+        :param build_index: see SyncTSProviderAdapter
+        :param executor: executor of blocking providers calls, see SyncTSProviderAdapter
+        :return: AsyncTSProvider or SyncTSProviderAdapter
+        """
+        ts_provider = self.ts_providers[ts_name]
+
+        if isinstance(ts_provider, AsyncTSProvider):
+            return ts_provider
+
+        return SyncTSProviderAdapter(ts_provider, build_index, executor)
+
+    async def gather(self, calls: dict, timeout: float = None):
+        """
+        Await provider calls concurrently, each one with its own timeout.
+
+        :param calls: dict of coroutines by traffic source names
+        :param timeout: seconds per provider, None to wait forever
+        :return: (dict of results, dict of exceptions) by traffic source names
+        """
+        ts_names = list(calls.keys())
+        results = await asyncio.gather(
+            *[asyncio.wait_for(calls[ts_name], timeout) for ts_name in ts_names],
+            return_exceptions=True
+        )
+        values, errors = {}, {}
+
+        for ts_name, result in zip(ts_names, results):
+            if isinstance(result, asyncio.TimeoutError):
+                errors[ts_name] = Exception('%s timed out after %ss' % (ts_name, timeout))
+            elif isinstance(result, BaseException):
+                errors[ts_name] = result
+            else:
+                values[ts_name] = result
+
+        return values, errors
+
+    def fetch_ts_campaigns(self, timeout: float = None, build_indexes: bool = True):
+        """
+        Fetch campaigns of all providers concurrently before matching.
+
+        :param timeout: seconds per provider
+        :param build_indexes: build match indexes while fetching, off when matching does not use them
+        """
+        async def fetch(executor):
+            return await self.gather({
+                ts_name: self.get_async_provider(ts_name, build_indexes, executor).get_ts_campaigns_async()
+                for ts_name, ts_provider in self.ts_providers.items()
+                if ts_provider.ts_campaigns is None
+            }, timeout)
+
+        ts_campaigns, errors = run_with_executor(fetch, len(self.ts_providers))
+
+        for ts_name, campaigns in ts_campaigns.items():
+            self.ts_providers[ts_name].ts_campaigns = campaigns
+
+        # matching without one of the providers would push partial costs
+        if errors:
+            raise Exception('Fetching campaigns failed: %s' % ', '.join(
+                '%s (%r)' % (ts_name, error) for ts_name, error in errors.items()))
+
+    def fetch_costs(
+            self,
+            ts_campaign_ids: dict,
+            date_from: str,
+            date_to: str,
+            timezone: int,
+            daily: bool = False,
+            timeout: float = None
+    ):
+        """
+        Fetch costs of all providers concurrently.
+
+        :param ts_campaign_ids: dict of campaigns ids lists by traffic source names
+        :param date_from: date from
+        :param date_to: date to
+        :param timezone: timezone
+        :param daily: group costs by day, see TSProvider.get_daily_cost()
+        :param timeout: seconds per provider
+        :return: (dict of costs, dict of exceptions) by traffic source names
+        """
+        async def fetch(executor):
+            return await self.gather({
+                ts_name: self.fetch_provider_costs(ts_name, ids, date_from, date_to, timezone, daily, executor)
+                for ts_name, ids in ts_campaign_ids.items()
+            }, timeout)
+
+        return run_with_executor(fetch, sum(
+            self.get_stats_concurrency(ts_name, ids, date_from, date_to, daily)
+            for ts_name, ids in ts_campaign_ids.items()
+        ))
+
+    def get_stats_concurrency(
+            self,
+            ts_name: str,
+            ts_campaign_ids: list,
+            date_from: str,
+            date_to: str,
+            daily: bool = False
+    ) -> int:
+        """
+        :param ts_name: traffic source name
+        :param ts_campaign_ids: list of campaigns ids
+        :param date_from: date from
+        :param date_to: date to
+        :param daily: group costs by day
+        :return: number of statistics calls fetch_provider_costs() has in flight at once
+        """
+        capabilities = self.ts_providers[ts_name].capabilities
+        calls = len(chunk_ids(ts_campaign_ids, capabilities.max_ids_per_stats_call))
+
+        if daily and not capabilities.supports_day_grouping:
+            calls *= len(get_days(date_from, date_to))
+
+        return min(calls, capabilities.max_concurrent_stats_calls or calls)
+
+    async def fetch_provider_costs(
+            self,
+            ts_name: str,
+            ts_campaign_ids: list,
+            date_from: str,
+            date_to: str,
+            timezone: int,
+            daily: bool = False,
+            executor=None
+    ):
+        """
+        Fetch costs of one provider with the strategy its capabilities allow:
+        statistics calls of at most max_ids_per_stats_call ids, at most
+        max_concurrent_stats_calls of them at once, and one call per day when
+        it can't group statistics by day.
+
+        :param executor: executor of blocking providers calls, see SyncTSProviderAdapter
+        :return: dict of costs by campaign ids, grouped by day (YYYY-MM-DD) when daily
+        """
+        ts_provider = self.get_async_provider(ts_name, executor=executor)
+        capabilities = self.ts_providers[ts_name].capabilities
+        chunks = chunk_ids(ts_campaign_ids, capabilities.max_ids_per_stats_call)
+        semaphore = asyncio.Semaphore(capabilities.max_concurrent_stats_calls or max(1, len(chunks)))
+
+        async def bounded(call):
+            async with semaphore:
+                return await call
+
+        if not daily:
+            results = await asyncio.gather(*[
+                bounded(ts_provider.get_cost_async(chunk, date_from, date_to, timezone))
+                for chunk in chunks
+            ])
+            return merge_costs(results)
+
+        if capabilities.supports_day_grouping:
+            results = await asyncio.gather(*[
+                bounded(ts_provider.get_daily_cost_async(chunk, date_from, date_to, timezone))
+                for chunk in chunks
+            ])
+            days = {day for costs_by_day in results for day in costs_by_day}
+
+            return {
+                day: merge_costs([costs_by_day.get(day, {}) for costs_by_day in results])
+                for day in sorted(days)
+            }
+
+        days = get_days(date_from, date_to)
+        results = await asyncio.gather(*[
+            bounded(ts_provider.get_cost_async(chunk, '%s 00:00:00' % day, '%s 23:59:59' % day, timezone))
+            for day in days
+            for chunk in chunks
+        ])
+
+        return {
+            str(day): merge_costs(results[i * len(chunks):(i + 1) * len(chunks)])
+            for i, day in enumerate(days)
+        }
+
+    def iter_token_costs(
+            self,
+            ts_name: str,
+            ts_campaign_ids: list,
+            date_from: str,
+            date_to: str,
+            timezone: int,
+            token: str
+    ):
+        """
+        :param ts_name: traffic source name
+        :param ts_campaign_ids: list of campaigns ids
+        :param date_from: date from
+        :param date_to: date to
+        :param timezone: timezone
+        :param token: statistics field passed to Binom as the token value
+        :return: generator of (campaign id, day (YYYY-MM-DD), token value, cost) tuples,
+                 chunks are streamed one after another or read concurrently as capabilities allow
+        """
+        ts_provider = self.ts_providers[ts_name]
+        capabilities = ts_provider.capabilities
+
+        if not capabilities.supports_tokens:
+            raise Exception('%s costs cannot be grouped by token' % ts_name)
+
+        chunks = chunk_ids(ts_campaign_ids, capabilities.max_ids_per_stats_call)
+        concurrency = min(len(chunks), capabilities.max_concurrent_stats_calls or len(chunks))
+
+        if concurrency <= 1:
+            for chunk in chunks:
+                yield from ts_provider.iter_token_costs(chunk, date_from, date_to, timezone, token)
+            return
+
+        def fetch(chunk):
+            return list(ts_provider.iter_token_costs(chunk, date_from, date_to, timezone, token))
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for future in as_completed([executor.submit(fetch, chunk) for chunk in chunks]):
+                yield from future.result()
+
+    def build_match_indexes(self):
+        """
+        Build match indexes of providers that did not build them while fetching campaigns
+        """
+        for ts_provider in self.ts_providers.values():
+            ts_provider.get_match_index()
+
     def get_ts_campaigns(self):
         """
         :return: list of campaigns grouped by traffic sources
@@ -104,11 +561,143 @@ class TSProviders:
             yield ts_name, ts_campaigns
 
 
+def run_with_executor(function, max_workers: int = None):
+    """
+    Run a coroutine with a dedicated thread pool for the blocking providers calls.
+
+    asyncio.run() joins its default executor, so a call still blocked after
+    its provider timed out would hold the caller until it returns. The
+    dedicated pool is shut down without waiting, such a call finishes in the
+    background and its result is dropped.
+
+    :param function: coroutine function taking the executor
+    :param max_workers: blocking calls in flight at once, sized from the providers
+                        capabilities rather than from the CPUs count
+    :return: coroutine result
+    """
+    if max_workers is not None:
+        max_workers = max(1, max_workers)
+
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ts-provider')
+
+    try:
+        return asyncio.run(function(executor))
+    finally:
+        executor.shutdown(wait=False)
+
+
+def chunk_ids(ts_campaign_ids: list, size: int = None) -> list:
+    """
+    :param ts_campaign_ids: list of campaigns ids
+    :param size: max ids per chunk, None for a single chunk
+    :return: list of de-duplicated ids lists
+    """
+    ts_campaign_ids = list(dict.fromkeys(ts_campaign_ids))
+
+    if not size:
+        return [ts_campaign_ids]
+
+    return [ts_campaign_ids[i:i + size] for i in range(0, len(ts_campaign_ids), size)]
+
+
+def merge_costs(results: list) -> dict:
+    """
+    :param results: dicts of costs by campaign ids of disjoint chunks
+    :return: dict of costs by campaign ids
+    """
+    costs = {}
+
+    for result in results:
+        costs.update(result)
+
+    return costs
+
+
+def get_days(date_from: str, date_to: str) -> list:
+    """
+    :param date_from: date from (YYYY-MM-DD, time ignored)
+    :param date_to: date to (YYYY-MM-DD, time ignored)
+    :return: list of datetime.date objects, both ends included
+    """
+    first = datetime.date.fromisoformat(str(date_from)[:10])
+    last = datetime.date.fromisoformat(str(date_to)[:10])
+
+    return [first + datetime.timedelta(days=i) for i in range((last - first).days + 1)]
+
+
+def parse_click_url(url: str):
+    """
+    Extract Binom host and click key from the campaign URL.
+
+    :param url: URL with Binom click.php?key=... link
+    :return: (host, click_key) tuple or None when URL can't be parsed
+    """
+    try:
+        parts = urlsplit(url.strip())
+        host = parts.hostname
+    except (AttributeError, ValueError):
+        return None
+
+    click_keys = parse_qs(parts.query).get('key')
+
+    if not host or not click_keys:
+        return None
+
+    return host, click_keys[0]
+
+
+class TSMatchIndex:
+    """
+    Index of traffic source campaigns keyed by (Binom host, click key).
+
+    Campaigns with URLs that can't be parsed are kept aside and matched
+    with the substring test when fallback is enabled.
+    """
+
+    def __init__(self, substring_fallback: bool = True):
+        self.index = {}
+        self.unparsed = []
+        self.substring_fallback = substring_fallback
+
+    def __len__(self):
+        return sum(len(ts_campaigns) for ts_campaigns in self.index.values()) \
+            + len(self.unparsed)
+
+    def add(self, ts_campaign):
+        """
+        :param ts_campaign: TSCampaign object
+        """
+        key = parse_click_url(ts_campaign.url) if ts_campaign.url else None
+
+        if key is None:
+            self.unparsed.append(ts_campaign)
+            return
+
+        self.index.setdefault(key, []).append(ts_campaign)
+
+    def match(self, binom_campaign_url: str):
+        """
+        :param binom_campaign_url: Binom campaign URL
+        :return: list of TSCampaign objects
+        """
+        key = parse_click_url(binom_campaign_url)
+        ts_campaigns = list(self.index.get(key, ())) if key else []
+
+        if self.substring_fallback:
+            ts_campaigns.extend(
+                ts_campaign for ts_campaign in self.unparsed
+                if ts_campaign.url and binom_campaign_url in ts_campaign.url
+            )
+
+        return ts_campaigns
+
+
 class TSCampaign:
     """
     Wrapper for traffic source campaign to remain consistent
     across different traffic sources APIs implementations.
     """
+    __slots__ = ('ts_name', 'id', 'url', 'name', 'cost')
 
     def __init__(self, ts_name: str, id: int, url: str, name: str = 'Placeholder', cost: float = None):
         """
@@ -0,0 +1,379 @@
+"""
+Shared HTTP transport for the API clients: connection pooling, timeouts,
+per-host rate limits, retries with backoff and circuit breaking
+Made by @plutus
+"""
+import email.utils
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import get_endpoint, metrics
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# CircuitBreaker.allow() results
+ALLOWED = 'allowed'
+PROBE = 'probe'
+
+
+class TransportError(Exception):
+    """
+    Raised when a request failed after all retries
+    """
+
+    def __init__(self, message: str, response=None):
+        super().__init__(message)
+        self.response = response
+
+
+class CircuitOpenError(TransportError):
+    """
+    Raised without sending the request while the host circuit is open
+    """
+
+
+def create_session(pool_size: int = 10):
+    """
+    :param pool_size: max number of kept-alive connections per host
+    :return: requests.Session reusing connections between calls
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    return session
+
+
+class TokenBucket:
+    """
+    Allows rate requests per second on average with bursts up to capacity
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Block until a token is available.
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+    def drain(self, seconds: float):
+        """
+        Stop handing tokens for given time, used when the API asked to slow down.
+
+        :param seconds: pause length
+        """
+        with self.lock:
+            self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive failed requests and lets a
+    single probe request through after reset_timeout seconds.
+
+    A failure is a request that still failed once its retries ran out, so
+    the threshold counts distinct requests whatever the number of retries.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """
+        :return: ALLOWED, PROBE for the single request probing an open circuit, or None
+        """
+        with self.lock:
+            if self.opened_at is None:
+                return ALLOWED
+
+            if not self.probing and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.probing = True
+                return PROBE
+
+            return None
+
+    def is_open(self):
+        """
+        :return: True while the circuit is open or probed
+        """
+        return self.opened_at is not None
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+
+            if self.probing or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self.probing = False
+
+
+class Transport:
+    """
+    HTTP client shared by the API wrappers
+    """
+
+    def __init__(
+            self,
+            pool_size: int = 10,
+            timeout: float = 60,
+            retries: int = 4,
+            backoff: float = 0.5,
+            max_backoff: float = 30,
+            rate_limit: float = None,
+            failure_threshold: int = 5,
+            reset_timeout: float = 30
+    ):
+        """
+        :param pool_size: kept-alive connections per host
+        :param timeout: connect and read timeout in seconds
+        :param retries: retries of failed requests
+        :param backoff: first retry delay in seconds, doubled on each retry
+        :param max_backoff: max retry delay in seconds
+        :param rate_limit: requests per second per host, None for no limit
+        :param failure_threshold: consecutive failed requests opening the host circuit
+        :param reset_timeout: seconds before a request probes an open circuit
+        """
+        self.session = create_session(pool_size)
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.rate_limit = rate_limit
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.buckets = {}
+        self.breakers = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(
+            cls,
+            config,
+            rate_limit_key: str = None,
+            pool_size: int = None,
+            default_rate_limit: float = None
+    ):
+        """
+        :param config: Config object
+        :param rate_limit_key: config key of the requests per second limit
+        :param pool_size: kept-alive connections per host, CS_HTTP_POOL_SIZE by default
+        :param default_rate_limit: requests per second when the config key is missing or 0
+        :return: Transport object
+        """
+        rate_limit = float(config.get(rate_limit_key) or 0) if rate_limit_key else 0
+        rate_limit = rate_limit if rate_limit > 0 else default_rate_limit or 0
+
+        return cls(
+            pool_size=pool_size if pool_size else int(config.get('HTTP_POOL_SIZE')),
+            timeout=float(config.get('HTTP_TIMEOUT')),
+            retries=int(config.get('HTTP_RETRIES')),
+            rate_limit=rate_limit if rate_limit > 0 else None,
+            failure_threshold=int(config.get('HTTP_BREAKER_THRESHOLD') or 5),
+            reset_timeout=float(config.get('HTTP_BREAKER_RESET') or 30)
+        )
+
+    def get_host_state(self, url: str):
+        """
+        :param url: request url
+        :return: (TokenBucket or None, CircuitBreaker) of the url host
+        """
+        host = urlsplit(url).netloc
+
+        with self.lock:
+            if host not in self.breakers:
+                self.breakers[host] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+                if self.rate_limit:
+                    self.buckets[host] = TokenBucket(self.rate_limit)
+
+            return self.buckets.get(host), self.breakers[host]
+
+    def get_delay(self, attempt: int, response=None):
+        """
+        :param attempt: retry number, starting from 0
+        :param response: failed response, if any
+        :return: seconds to wait before the retry
+        """
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+
+        if retry_after:
+            try:
+                return min(self.max_backoff, float(retry_after))
+            except ValueError:
+                retry_at = email.utils.parsedate_to_datetime(retry_after)
+                if retry_at is not None:
+                    return min(self.max_backoff, max(0.0, retry_at.timestamp() - time.time()))
+
+        # full jitter
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def request(self, method: str, url: str, **kwargs):
+        """
+        :param method: HTTP method
+        :param url: request url
+        :param kwargs: requests.Session.request arguments
+        :return: requests.Response with status below 400
+        """
+        bucket, breaker = self.get_host_state(url)
+        kwargs.setdefault('timeout', self.timeout)
+        permit = breaker.allow()
+
+        if not permit:
+            raise CircuitOpenError('Circuit open for %s' % urlsplit(url).netloc)
+
+        # a probe gets a single attempt, its failure reopens the circuit at once
+        attempts = 1 if permit == PROBE else self.retries + 1
+
+        for attempt in range(attempts):
+            if attempt and breaker.is_open():
+                # other requests opened the circuit while this one was retrying
+                raise CircuitOpenError('Circuit open for %s' % urlsplit(url).netloc)
+
+            if bucket is not None:
+                bucket.acquire()
+
+            response = None
+            started = time.perf_counter()
+
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as error:
+                metrics.observe_request(
+                    method, url, type(error).__name__, time.perf_counter() - started, 0, 0)
+                failure = error
+            else:
+                self.observe(method, url, response, time.perf_counter() - started, kwargs.get('stream'))
+
+                if response.status_code < 400:
+                    breaker.record_success()
+                    return response
+
+                if response.status_code not in RETRY_STATUSES:
+                    # client errors are not transient, the host itself is fine
+                    breaker.record_success()
+                    raise TransportError(
+                        '%s %s failed with %d: %s'
+                        % (method, url, response.status_code, response.text[:200]),
+                        response
+                    )
+
+                failure = '%d %s' % (response.status_code, response.reason)
+                response.close()
+
+            if attempt == attempts - 1:
+                break
+
+            metrics.inc('http_retries_total', endpoint=get_endpoint(url))
+
+            delay = self.get_delay(attempt, response)
+
+            if bucket is not None and response is not None and response.status_code == 429:
+                bucket.drain(delay)
+
+            time.sleep(delay)
+
+        if response is not None and response.status_code == 429:
+            # rate limited, the host is healthy
+            breaker.record_success()
+        else:
+            # one failure per request, however many attempts it made
+            breaker.record_failure()
+
+        raise TransportError(
+            '%s %s failed after %d attempts: %s' % (method, url, attempts, failure),
+            response
+        )
+
+    @staticmethod
+    def observe(method: str, url: str, response, seconds: float, stream: bool = False):
+        """
+        Record request metrics, streamed bodies are counted while they are read.
+        """
+        body = response.request.body or b''
+
+        metrics.observe_request(
+            method,
+            url,
+            response.status_code,
+            seconds,
+            len(response.request.url) + len(body),
+            None if stream else len(response.content)
+        )
+
+    def get(self, url: str, params: dict = None, **kwargs):
+        return self.request('GET', url, params=params, **kwargs)
+
+    def post(self, url: str, data=None, json=None, **kwargs):
+        return self.request('POST', url, data=data, json=json, **kwargs)
+
+
+class TransportPool:
+    """
+    Transports shared by the API clients of all tenants, one per API host,
+    so tenants talking to the same host reuse its connections and rate limit
+    """
+
+    def __init__(self, config):
+        """
+        :param config: Config object with the CS_HTTP_* settings
+        """
+        self.config = config
+        self.transports = {}
+        self.lock = threading.Lock()
+
+    def get(
+            self,
+            url: str,
+            rate_limit_key: str = None,
+            pool_size: int = None,
+            default_rate_limit: float = None
+    ) -> Transport:
+        """
+        :param url: API url, or a name standing for a provider with a fixed API host
+        :param rate_limit_key: config key of the requests per second limit
+        :param pool_size: kept-alive connections of the host, CS_HTTP_POOL_SIZE by default
+        :param default_rate_limit: requests per second when the config key is missing or 0
+        :return: Transport object of the host
+        """
+        host = urlsplit(url).netloc or url
+
+        with self.lock:
+            if host not in self.transports:
+                self.transports[host] = Transport.from_config(
+                    self.config, rate_limit_key, pool_size, default_rate_limit)
+
+            return self.transports[host]